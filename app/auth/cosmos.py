@@ -15,35 +15,58 @@ users_container = None
 reports_container = None
 metrics_container = None
 prescriptions_container = None
+trends_container = None
 
-import uuid
+from app.auth.local_container import LocalContainer
 
-class MockContainer:
-    def __init__(self):
-        self.items = []
-        
-    def query_items(self, query, parameters=None, enable_cross_partition_query=False):
-        # Extremely basic mock query logic just for local testing the auth flows
-        if not parameters: return self.items
-        
-        results = []
-        for item in self.items:
-            match = True
-            for param in parameters:
-                key = param["name"].replace("@", "")
-                val = param["value"]
-                if item.get(key) != val and item.get("id") != val and item.get("user_id") != val and item.get("username") != val:
-                    match = False
-                    break
-            if match:
-                results.append(item)
-        return results
-        
-    def create_item(self, body):
-        if "id" not in body:
-            body["id"] = str(uuid.uuid4())
-        self.items.append(body)
-        return body
+# Optional SQLite file the local containers persist to; in memory if unset
+COSMOS_LOCAL_PATH = os.getenv("AZURE_COSMOS_LOCAL_PATH")
+
+
+def _local_containers():
+    """Indexed in-process containers, for running without a Cosmos account."""
+    if COSMOS_LOCAL_PATH:
+        os.makedirs(os.path.dirname(COSMOS_LOCAL_PATH) or ".", exist_ok=True)
+    timeline = dict(partition_key="user_id", sorted_fields=("timestamp",), path=COSMOS_LOCAL_PATH)
+    return (
+        LocalContainer("Users", partition_key="id", indexed=("username",), path=COSMOS_LOCAL_PATH),
+        LocalContainer("LabReports", **timeline),
+        LocalContainer("LabMetrics", indexed=("report_id", "metric_name"), **timeline),
+        LocalContainer("Prescriptions", **timeline),
+        LocalContainer("LabTrends", path=COSMOS_LOCAL_PATH),
+    )
+
+# Lists are served by ORDER BY timestamp within a user's partition, and the
+# large per-report fields are never filtered on, so they are not indexed
+TIMELINE_INDEXING = {
+    "indexingMode": "consistent",
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [{"path": "/extracted_data/*"}, {"path": "/ai_report/*"}, {"path": "/translated_text/*"}, {"path": '/"_etag"/?'}],
+    "compositeIndexes": [
+        [{"path": "/user_id", "order": "ascending"}, {"path": "/timestamp", "order": "descending"}],
+        [{"path": "/user_id", "order": "ascending"}, {"path": "/timestamp", "order": "ascending"}],
+    ],
+}
+
+
+# One document per (user, analyte); its points array is never queried into
+TRENDS_INDEXING = {
+    "indexingMode": "consistent",
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [{"path": "/points/*"}, {"path": '/"_etag"/?'}],
+}
+
+
+def _timeline_container(container_id):
+    """Creates a /user_id-partitioned container, bringing an existing one's indexing policy up to date."""
+    container = database.create_container_if_not_exists(
+        id=container_id, partition_key=PartitionKey(path="/user_id"), indexing_policy=TIMELINE_INDEXING)
+    policy = container.read().get("indexingPolicy", {})
+    if policy.get("compositeIndexes") != TIMELINE_INDEXING["compositeIndexes"]:
+        # create_container_if_not_exists leaves an existing container's policy as it was
+        container = database.replace_container(
+            container, partition_key=PartitionKey(path="/user_id"), indexing_policy=TIMELINE_INDEXING)
+    return container
 
 if COSMOS_ENDPOINT and COSMOS_KEY:
     try:
@@ -51,22 +74,18 @@ if COSMOS_ENDPOINT and COSMOS_KEY:
         database = client.create_database_if_not_exists(id=DATABASE_NAME)
         
         users_container = database.create_container_if_not_exists(id="Users", partition_key=PartitionKey(path="/id"))
-        reports_container = database.create_container_if_not_exists(id="LabReports", partition_key=PartitionKey(path="/user_id"))
-        metrics_container = database.create_container_if_not_exists(id="LabMetrics", partition_key=PartitionKey(path="/user_id"))
-        prescriptions_container = database.create_container_if_not_exists(id="Prescriptions", partition_key=PartitionKey(path="/user_id"))
+        reports_container = _timeline_container("LabReports")
+        metrics_container = _timeline_container("LabMetrics")
+        prescriptions_container = _timeline_container("Prescriptions")
+        trends_container = database.create_container_if_not_exists(
+            id="LabTrends", partition_key=PartitionKey(path="/user_id"), indexing_policy=TRENDS_INDEXING)
         print("Successfully connected to Azure Cosmos DB and initialized containers.")
     except Exception as e:
         print(f"Error initializing Cosmos DB: {e}")
-        users_container = MockContainer()
-        reports_container = MockContainer()
-        metrics_container = MockContainer()
-        prescriptions_container = MockContainer()
+        users_container, reports_container, metrics_container, prescriptions_container, trends_container = _local_containers()
 else:
-    print("Warning: Cosmos DB credentials missing. Falling back to Mock in-memory containers.")
-    users_container = MockContainer()
-    reports_container = MockContainer()
-    metrics_container = MockContainer()
-    prescriptions_container = MockContainer()
+    print("Warning: Cosmos DB credentials missing. Falling back to local containers.")
+    users_container, reports_container, metrics_container, prescriptions_container, trends_container = _local_containers()
 
 def get_db():
     """Returns the container references for the application."""
@@ -74,5 +93,6 @@ def get_db():
         "users": users_container,
         "reports": reports_container,
         "metrics": metrics_container,
-        "prescriptions": prescriptions_container
+        "prescriptions": prescriptions_container,
+        "trends": trends_container
     }
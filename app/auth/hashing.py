@@ -0,0 +1,114 @@
+"""
+Password hashing off the event loop.
+
+A bcrypt hash or check costs 100-300 ms of CPU by design. Run inside an
+`async def` route, every login stalls every other request in the worker
+for that long. PasswordHasher runs them on a small process pool instead,
+so they neither hold the event loop nor fight over the GIL.
+
+The pool's backlog is bounded. Once HASH_QUEUE_LIMIT hashes are queued or
+running, further requests are refused with HashPoolBusy. The routes turn
+that into 503 + Retry-After, so a login storm gets a fast "try again"
+instead of queueing until every client times out.
+
+    AUTH_BCRYPT_ROUNDS      bcrypt work factor for new hashes (default 12)
+    AUTH_HASH_WORKERS       hashing processes per app worker (default min(4, CPUs))
+    AUTH_HASH_QUEUE_LIMIT   hashes queued or running before shedding (default 32 per process)
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("AUTH_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("AUTH_HASH_QUEUE_LIMIT", str(32 * HASH_WORKERS)))
+
+
+class HashPoolBusy(Exception):
+    """Raised instead of queueing a hash once the pool's backlog is full."""
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT, rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that already runs threads (the DB writer, uvicorn's loop) is unsafe
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            self.shed += 1
+            raise HashPoolBusy()
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        pool = self._get_pool()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except Exception as exc:
+            self.failed += 1
+            if isinstance(exc, BrokenProcessPool):
+                # A worker died (e.g. OOM-killed); start a fresh pool for the next request
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return (await self._run(_hash, password.encode("utf-8"), self.rounds)).decode("utf-8")
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        if isinstance(hashed, str):
+            hashed = hashed.encode("utf-8")
+        return await self._run(_check, password.encode("utf-8"), hashed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "queueLimit": self.queue_limit,
+            "pending": self.pending,
+            "maxPending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "shed": self.shed,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+hasher = PasswordHasher()
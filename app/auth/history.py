@@ -0,0 +1,105 @@
+"""
+Paginated analysis history for signed-in users.
+
+/api/history used to read every report and prescription a user ever had,
+with their extracted tables and AI summaries, through cross-partition
+queries, and sort the lot in Python. Pages are now built from two queries
+scoped to the user's partition. Each one projects only the fields the
+list shows and reads only as far as the page needs. The full document is
+a point read, GET /api/history/{type}/{id}.
+
+The continuation token is a position in the merged stream: the timestamp
+of the last item sent and the ids already sent at that timestamp. A
+Cosmos continuation token only resumes its own query, so it cannot say
+how far each container got once the two are interleaved. Each query is
+served by the (user_id, timestamp) composite index in cosmos.py.
+"""
+import base64
+import heapq
+import json
+from typing import Any, Dict, List, Optional
+
+DEFAULT_PAGE = 20
+MAX_PAGE = 100
+END_OF_TIME = "9999-12-31T23:59:59.999999"  # after every isoformat() timestamp
+
+# type -> (container, projected list query)
+LIST_QUERIES = {
+    "report": ("reports",
+               "SELECT TOP @limit c.id, c.timestamp, c.filename, ARRAY_LENGTH(c.flags) AS flag_count FROM c "
+               "WHERE c.user_id = @user_id AND c.timestamp <= @before ORDER BY c.timestamp DESC"),
+    "prescription": ("prescriptions",
+                     "SELECT TOP @limit c.id, c.timestamp, c.filename, c.language FROM c "
+                     "WHERE c.user_id = @user_id AND c.timestamp <= @before ORDER BY c.timestamp DESC"),
+}
+
+
+def encode_token(timestamp: str, ids: List[str]) -> str:
+    raw = json.dumps({"t": timestamp, "ids": ids}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Raises ValueError if the token was not produced by encode_token."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if not isinstance(state["t"], str) or not isinstance(state["ids"], list):
+            raise TypeError
+        return state
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid continuation token")
+
+
+def _query(container, query: str, user_id: str, before: str, limit: int) -> List[Dict[str, Any]]:
+    params = [
+        {"name": "@limit", "value": limit},
+        {"name": "@user_id", "value": user_id},
+        {"name": "@before", "value": before},
+    ]
+    return list(container.query_items(query=query, parameters=params, partition_key=user_id))
+
+
+def history_page(db: Dict[str, Any], user_id: str, limit: int = DEFAULT_PAGE,
+                 continuation: Optional[str] = None) -> Dict[str, Any]:
+    """One page of `user_id`'s reports and prescriptions, newest first, and the token for the next (None at the end)."""
+    limit = max(1, min(limit, MAX_PAGE))
+    before, sent = END_OF_TIME, set()
+    if continuation:
+        state = decode_token(continuation)
+        before, sent = state["t"], set(state["ids"])
+
+    streams = []
+    for kind, (name, query) in LIST_QUERIES.items():
+        if not db.get(name):
+            continue
+        # Items already sent at `before` come back too; one extra row tells whether anything is left
+        rows = _query(db[name], query, user_id, before, limit + len(sent) + 1)
+        streams.append([dict(row, type=kind) for row in rows if not (row["timestamp"] == before and row["id"] in sent)])
+
+    merged = heapq.merge(*streams, key=lambda item: item["timestamp"], reverse=True)
+    items = []
+    for item in merged:
+        if len(items) == limit:
+            break
+        items.append(item)
+    else:
+        return {"items": items, "continuation": None}
+
+    last = items[-1]["timestamp"]
+    ids = [item["id"] for item in items if item["timestamp"] == last]
+    if last == before:
+        ids += sent
+    return {"items": items, "continuation": encode_token(last, ids)}
+
+
+def history_item(db: Dict[str, Any], user_id: str, kind: str, item_id: str) -> Optional[Dict[str, Any]]:
+    """The full document of one history entry, or None if `user_id` has no such entry."""
+    if kind not in LIST_QUERIES or not db.get(LIST_QUERIES[kind][0]):
+        return None
+    try:
+        item = db[LIST_QUERIES[kind][0]].read_item(item=item_id, partition_key=user_id)
+    except Exception as e:
+        if getattr(e, "status_code", None) == 404:
+            return None
+        raise
+    return dict(item, type=kind)
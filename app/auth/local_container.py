@@ -0,0 +1,404 @@
+"""
+Local stand-in for the Cosmos containers.
+
+cosmos.py falls back to LocalContainer when no Cosmos account is
+configured. It answers the same calls the app makes on a real container
+(query_items, read_item, create/upsert/replace/delete/patch_item,
+execute_item_batch), so auth, history and trends can be exercised, and
+benchmarked at millions of documents, without Azure:
+
+- documents are held per partition key value, so a partition-scoped query
+  or point read touches only that partition
+- `indexed` fields get a hash index, used for equality filters
+- `sorted_fields` get a per-partition sorted index, which serves
+  ORDER BY on that field, with range filters on it, and stops at TOP
+
+Only the query shapes the app sends are understood:
+
+    SELECT [TOP @n] * | c.a, ARRAY_LENGTH(c.b) AS n, ... FROM c
+    [WHERE c.a = @x AND c.b <= @y ...] [ORDER BY c.a [ASC|DESC]]
+
+Anything else raises ValueError rather than returning a wrong answer.
+Errors carry the HTTP status_code Cosmos would send (404, 409, 400).
+
+With `path` set, every write goes through to a SQLite file and the
+container is reloaded from it on start. Set AZURE_COSMOS_LOCAL_PATH to
+keep local accounts and reports across restarts.
+"""
+import bisect
+import json
+import re
+import sqlite3
+import threading
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from app.mediconnect import serializers
+
+_QUERY = re.compile(
+    r"^\s*SELECT\s+(?:TOP\s+(?P<top>@\w+|\d+)\s+)?(?P<columns>.+?)\s+FROM\s+c"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+c\.(?P<order>\w+)(?:\s+(?P<direction>ASC|DESC))?)?\s*$", re.I | re.S)
+_AND = re.compile(r"\s+AND\s+", re.I)
+_CONDITION = re.compile(r"c\.(\w+)\s*(<=|>=|!=|<|>|=)\s*(@\w+)")
+_FIELD = re.compile(r"c\.(\w+)")
+_ARRAY_LENGTH = re.compile(r"ARRAY_LENGTH\(c\.(\w+)\)\s+AS\s+(\w+)", re.I)
+
+_COMPARE = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+}
+
+Query = namedtuple("Query", "top columns conditions order descending")
+
+
+class LocalCosmosError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@lru_cache(maxsize=256)
+def parse_query(query: str) -> Query:
+    """Parses one of the supported query shapes; raises ValueError for anything else."""
+    match = _QUERY.match(query)
+    if not match:
+        raise ValueError(f"Unsupported query: {query}")
+    conditions = []
+    if match.group("where"):
+        for part in _AND.split(match.group("where").strip()):
+            condition = _CONDITION.fullmatch(part.strip())
+            if not condition:
+                raise ValueError(f"Unsupported condition: {part}")
+            conditions.append(condition.groups())
+    columns = None
+    if match.group("columns").strip() != "*":
+        columns = []
+        for column in match.group("columns").split(","):
+            column = column.strip()
+            length = _ARRAY_LENGTH.fullmatch(column)
+            field = _FIELD.fullmatch(column)
+            if length:
+                columns.append((length.group(2), length.group(1), True))
+            elif field:
+                columns.append((field.group(1), field.group(1), False))
+            else:
+                raise ValueError(f"Unsupported column: {column}")
+    return Query(match.group("top"), columns, tuple(conditions), match.group("order"),
+                 (match.group("direction") or "ASC").upper() == "DESC")
+
+
+def _patched(doc: Dict[str, Any], operations: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """A copy of `doc` with Cosmos patch operations applied; only top-level paths, and /field/- to append."""
+    doc = dict(doc)
+    for operation in operations:
+        op, path, value = operation["op"], operation["path"], operation.get("value")
+        parts = path.strip("/").split("/")
+        field = parts[0]
+        if op == "add" and parts[1:] == ["-"]:
+            doc[field] = list(doc.get(field, [])) + [value]
+        elif len(parts) != 1 or field in ("id", "_etag"):
+            raise LocalCosmosError(400, f"Unsupported patch path: {path}")
+        elif op in ("add", "set"):
+            doc[field] = value
+        elif op == "replace":
+            if field not in doc:
+                raise LocalCosmosError(400, f"No value at {path} to replace")
+            doc[field] = value
+        elif op == "remove":
+            if field not in doc:
+                raise LocalCosmosError(400, f"No value at {path} to remove")
+            del doc[field]
+        elif op == "incr":
+            doc[field] = doc.get(field, 0) + value
+        else:
+            raise LocalCosmosError(400, f"Unsupported patch operation: {op}")
+    return doc
+
+
+class _SortedIndex:
+    """(value, id) pairs of one partition in value order."""
+
+    def __init__(self):
+        self.values: List[Any] = []
+        self.ids: List[str] = []
+
+    def add(self, value, doc_id):
+        pos = bisect.bisect_right(self.values, value)
+        self.values.insert(pos, value)
+        self.ids.insert(pos, doc_id)
+
+    def remove(self, value, doc_id):
+        pos = bisect.bisect_left(self.values, value)
+        while self.ids[pos] != doc_id:
+            pos += 1
+        del self.values[pos]
+        del self.ids[pos]
+
+    def scan(self, low=None, low_inclusive=True, high=None, high_inclusive=True, descending=False) -> Iterator[str]:
+        start = 0 if low is None else (bisect.bisect_left if low_inclusive else bisect.bisect_right)(self.values, low)
+        end = len(self.values) if high is None else (bisect.bisect_right if high_inclusive else bisect.bisect_left)(self.values, high)
+        positions = range(end - 1, start - 1, -1) if descending else range(start, end)
+        for pos in positions:
+            yield self.ids[pos]
+
+
+class LocalContainer:
+    def __init__(self, container_id: str = "local", partition_key: str = "user_id", indexed: Sequence[str] = (),
+                 sorted_fields: Sequence[str] = (), path: Optional[str] = None):
+        self.id = container_id
+        self.partition_key = partition_key
+        self._partitions: Dict[Any, Dict[str, Dict[str, Any]]] = {}
+        self._hash: Dict[str, Dict[Any, set]] = {field: {} for field in indexed}
+        self._sorted: Dict[str, Dict[Any, _SortedIndex]] = {field: {} for field in sorted_fields}
+        self._lock = threading.RLock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    container TEXT NOT NULL,
+                    pk TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    PRIMARY KEY (container, pk, id)
+                ) WITHOUT ROWID
+            """)
+            for (body,) in self._conn.execute("SELECT body FROM documents WHERE container = ?", (container_id,)):
+                self._add(json.loads(body))
+
+    @property
+    def items(self) -> List[Dict[str, Any]]:
+        """Every document, in no particular order."""
+        with self._lock:
+            return [doc for partition in self._partitions.values() for doc in partition.values()]
+
+    def count(self) -> int:
+        # Not __len__: callers test containers with `if db.get(...)`, and an empty one must still be truthy
+        return sum(len(partition) for partition in self._partitions.values())
+
+    # --- index maintenance (caller holds the lock) ---
+
+    def _add(self, doc: Dict[str, Any]):
+        pk, doc_id = doc.get(self.partition_key), doc["id"]
+        self._partitions.setdefault(pk, {})[doc_id] = doc
+        for field, index in self._hash.items():
+            value = doc.get(field)
+            if value is not None and not isinstance(value, (dict, list)):
+                index.setdefault(value, set()).add((pk, doc_id))
+        for field, index in self._sorted.items():
+            value = doc.get(field)
+            if value is not None:
+                index.setdefault(pk, _SortedIndex()).add(value, doc_id)
+
+    def _remove(self, doc: Dict[str, Any]):
+        pk, doc_id = doc.get(self.partition_key), doc["id"]
+        del self._partitions[pk][doc_id]
+        for field, index in self._hash.items():
+            value = doc.get(field)
+            if value is not None and not isinstance(value, (dict, list)):
+                bucket = index[value]
+                bucket.discard((pk, doc_id))
+                if not bucket:
+                    del index[value]
+        for field, index in self._sorted.items():
+            value = doc.get(field)
+            if value is not None:
+                index[pk].remove(value, doc_id)
+
+    def _get(self, pk, doc_id) -> Optional[Dict[str, Any]]:
+        return self._partitions.get(pk, {}).get(doc_id)
+
+    def _persist(self, written: Iterable[Dict[str, Any]], deleted: Iterable[Dict[str, Any]] = ()):
+        if self._conn is None:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (container, pk, id, body) VALUES (?, ?, ?, ?)",
+                [(self.id, json.dumps(doc.get(self.partition_key)), doc["id"], serializers.dumps(doc)) for doc in written])
+            self._conn.executemany(
+                "DELETE FROM documents WHERE container = ? AND pk = ? AND id = ?",
+                [(self.id, json.dumps(doc.get(self.partition_key)), doc["id"]) for doc in deleted])
+
+    # --- writes ---
+
+    def _prepare(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        doc = dict(body)
+        if "id" not in doc:
+            doc["id"] = str(uuid.uuid4())
+        return doc
+
+    def _apply(self, op: str, body: Optional[Dict[str, Any]] = None, item: Optional[str] = None, pk=None,
+               operations: Sequence[Dict[str, Any]] = ()):
+        """Applies one write; returns (status, document, replaced document)."""
+        if op in ("create", "upsert", "replace"):
+            doc = self._prepare(body)
+            if op == "replace" and item is not None:
+                doc["id"] = item
+            old = self._get(doc.get(self.partition_key), doc["id"])
+            if op == "create" and old is not None:
+                raise LocalCosmosError(409, f"Entity with the specified id already exists: {doc['id']}")
+            if op == "replace" and old is None:
+                raise LocalCosmosError(404, f"Entity with the specified id does not exist: {doc['id']}")
+            if old is not None:
+                self._remove(old)
+            self._add(doc)
+            return (200 if old is not None else 201), doc, old
+        if op == "delete":
+            old = self._get(pk, item)
+            if old is None:
+                raise LocalCosmosError(404, f"Entity with the specified id does not exist: {item}")
+            self._remove(old)
+            return 204, None, old
+        if op == "patch":
+            old = self._get(pk, item)
+            if old is None:
+                raise LocalCosmosError(404, f"Entity with the specified id does not exist: {item}")
+            doc = _patched(old, operations)
+            self._remove(old)
+            self._add(doc)
+            return 200, doc, old
+        raise ValueError(f"Unsupported operation: {op}")
+
+    def _write(self, op: str, **kwargs) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            status, doc, old = self._apply(op, **kwargs)
+            self._persist([doc] if doc else [], [old] if doc is None else [])
+            return dict(doc) if doc else None
+
+    def create_item(self, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        return self._write("create", body=body)
+
+    def upsert_item(self, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        return self._write("upsert", body=body)
+
+    def replace_item(self, item, body: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        return self._write("replace", body=body, item=item if isinstance(item, str) else item["id"])
+
+    def delete_item(self, item, partition_key, **kwargs):
+        self._write("delete", item=item if isinstance(item, str) else item["id"], pk=partition_key)
+
+    def patch_item(self, item, partition_key, patch_operations: Sequence[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        return self._write("patch", item=item if isinstance(item, str) else item["id"], pk=partition_key,
+                           operations=patch_operations)
+
+    def execute_item_batch(self, batch_operations: Sequence[tuple], partition_key, **kwargs) -> List[Dict[str, Any]]:
+        """Applies every operation or none, like a Cosmos transactional batch."""
+        with self._lock:
+            undo, results = [], []
+            try:
+                for operation in batch_operations:
+                    op, args = operation[0], operation[1]
+                    op_kwargs = operation[2] if len(operation) > 2 else {}
+                    if op == "read":
+                        results.append({"statusCode": 200, "resourceBody": self.read_item(args[0], partition_key)})
+                        continue
+                    body = args[-1] if op in ("create", "upsert", "replace") else None
+                    item = args[0] if op in ("replace", "delete", "patch") else None
+                    operations = args[1] if op == "patch" else ()
+                    if body is not None and body.get(self.partition_key) != partition_key:
+                        raise LocalCosmosError(400, "Partition key of the operation does not match the batch")
+                    status, doc, old = self._apply(op, body=body, item=op_kwargs.get("item", item), pk=partition_key,
+                                                   operations=operations)
+                    undo.append((doc, old))
+                    results.append({"statusCode": status, "resourceBody": dict(doc) if doc else None})
+            except Exception:
+                for doc, old in reversed(undo):
+                    if doc is not None:
+                        self._remove(doc)
+                    if old is not None:
+                        self._add(old)
+                raise
+            self._persist([doc for doc, _ in undo if doc is not None],
+                          [old for doc, old in undo if doc is None])
+            return results
+
+    # --- reads ---
+
+    def read_item(self, item, partition_key, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            doc = self._get(partition_key, item if isinstance(item, str) else item["id"])
+        if doc is None:
+            raise LocalCosmosError(404, f"Entity with the specified id does not exist: {item}")
+        return dict(doc)
+
+    def query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None,
+                    enable_cross_partition_query: bool = False, partition_key=None, max_item_count=None,
+                    **kwargs) -> List[Dict[str, Any]]:
+        parsed = parse_query(query)
+        values = {p["name"]: p["value"] for p in parameters or []}
+        try:
+            conditions = [(field, op, values[name]) for field, op, name in parsed.conditions]
+            top = None if parsed.top is None else int(values[parsed.top] if parsed.top.startswith("@") else parsed.top)
+        except KeyError as e:
+            raise ValueError(f"Missing query parameter {e}")
+        if partition_key is None:
+            partition_key = next((value for field, op, value in conditions if field == self.partition_key and op == "="), None)
+            scoped = partition_key is not None
+        else:
+            scoped = True
+
+        with self._lock:
+            docs, ordered = self._candidates(parsed, conditions, partition_key, scoped)
+            results = []
+            checks = [(field, _COMPARE[op], value) for field, op, value in conditions]
+            if scoped and self.partition_key not in (field for field, _, _ in checks):
+                checks.append((self.partition_key, _COMPARE["="], partition_key))
+            for doc in docs:
+                if all(compare(doc.get(field), value) for field, compare, value in checks):
+                    results.append(doc)
+                    if ordered and top is not None and len(results) == top:
+                        break
+            if parsed.order and not ordered:
+                results.sort(key=lambda doc: (doc.get(parsed.order) is not None, doc.get(parsed.order)),
+                             reverse=parsed.descending)
+            if top is not None:
+                results = results[:top]
+            return [self._project(doc, parsed.columns) for doc in results]
+
+    def _candidates(self, parsed: Query, conditions, pk, scoped: bool):
+        """The documents that can match, and whether they already come in ORDER BY order."""
+        if scoped and parsed.order in self._sorted:
+            index = self._sorted[parsed.order].get(pk)
+            if index is None:
+                return [], True
+            bounds = {}
+            for field, op, value in conditions:
+                if field == parsed.order and op in ("<", "<=", ">", ">="):
+                    if op[0] == "<":
+                        bounds.update(high=value, high_inclusive=op == "<=")
+                    else:
+                        bounds.update(low=value, low_inclusive=op == ">=")
+            partition = self._partitions[pk]
+            return (partition[doc_id] for doc_id in index.scan(descending=parsed.descending, **bounds)), True
+
+        buckets = [self._hash[field].get(value, set()) for field, op, value in conditions
+                   if op == "=" and field in self._hash]
+        if buckets:
+            keys = min(buckets, key=len)
+            return [self._partitions[key_pk][doc_id] for key_pk, doc_id in keys if not scoped or key_pk == pk], False
+        if scoped:
+            return list(self._partitions.get(pk, {}).values()), False
+        return [doc for partition in self._partitions.values() for doc in partition.values()], False
+
+    @staticmethod
+    def _project(doc: Dict[str, Any], columns) -> Dict[str, Any]:
+        if columns is None:
+            return dict(doc)
+        row = {}
+        for name, field, is_length in columns:
+            value = doc.get(field)
+            if is_length:
+                if isinstance(value, list):
+                    row[name] = len(value)
+            elif field in doc:
+                row[name] = value
+        return row
@@ -0,0 +1,162 @@
+"""
+Background writes of per-analyte lab metrics to Cosmos.
+
+An analysed report used to be followed by one create_item per flagged
+analyte, in series, before the response went out: 31 round trips for a
+30-analyte panel. The report document is still written in the request;
+its metric documents are handed to MetricWriter, which acknowledges them
+in the background, so the response goes out once the report is durable.
+
+All of a report's metrics share the user_id partition key, so they are
+sent as transactional batches of up to BATCH_LIMIT upserts. A container
+without execute_item_batch (an older SDK) gets concurrent create_item
+calls instead, at most WRITE_CONCURRENCY at a time. Throttled or
+unavailable writes are retried with backoff; a retried create that finds
+its document already there counts as written. Once a report's metrics
+are written, their points are appended to the user's trend series (see
+trends.py).
+
+The executor threads are not daemons, so writes still queued when the
+worker exits are finished first. Until a report's metrics are
+acknowledged, /api/trends does not show them yet.
+
+    METRIC_WRITE_CONCURRENCY   concurrent create_item calls per worker (default 8)
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+from app.auth.trends import invalidate, record_points
+
+BATCH_LIMIT = 100  # operations Cosmos accepts in one transactional batch
+WRITE_CONCURRENCY = int(os.getenv("METRIC_WRITE_CONCURRENCY", "8"))
+RETRIES = 5
+RETRY_STATUSES = {408, 429, 449, 503}  # timeout, throttled, retry-with, unavailable
+CONFLICT = 409
+
+
+def _status(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+class MetricWriter:
+    def __init__(self, concurrency: int = WRITE_CONCURRENCY, retries: int = RETRIES, backoff: float = 0.1):
+        self.retries = retries
+        self.backoff = backoff
+        # One thread per report being written, and a bounded pool for the per-item fallback
+        self._reports = ThreadPoolExecutor(2, thread_name_prefix="metric-writer")
+        self._items = ThreadPoolExecutor(concurrency, thread_name_prefix="metric-item")
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self.submitted = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried = 0
+        self.series_updated = 0
+        self.series_failed = 0
+        self.last_error: Optional[str] = None
+        self._ack_ms_total = 0.0
+        self._acked_reports = 0
+
+    def submit(self, container, user_id: str, docs: List[Dict[str, Any]], trends=None) -> Future:
+        """Queues `docs` (all in `user_id`'s partition), and their trend points if `trends` is given; the future is set once acknowledged."""
+        with self._lock:
+            self.submitted += len(docs)
+        future = self._reports.submit(self._write, container, user_id, docs, trends, time.perf_counter())
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _retry(self, fn, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if _status(e) not in RETRY_STATUSES or attempt == self.retries:
+                    raise
+                with self._lock:
+                    self.retried += 1
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _create(self, container, doc: Dict[str, Any]):
+        try:
+            self._retry(container.create_item, doc)
+        except Exception as e:
+            if _status(e) != CONFLICT:  # already written by an attempt whose reply was lost
+                raise
+
+    def _write(self, container, user_id: str, docs: List[Dict[str, Any]], trends, queued: float):
+        written = 0
+        try:
+            if hasattr(container, "execute_item_batch"):
+                for start in range(0, len(docs), BATCH_LIMIT):
+                    chunk = docs[start:start + BATCH_LIMIT]
+                    # Upserts, so a batch retried after a lost reply is harmless
+                    self._retry(container.execute_item_batch, [("upsert", (doc,)) for doc in chunk], user_id)
+                    written += len(chunk)
+                    with self._lock:
+                        self.batches += 1
+            else:
+                futures = [self._items.submit(self._create, container, doc) for doc in docs]
+                wait(futures)
+                errors = [f.exception() for f in futures if f.exception() is not None]
+                written = len(docs) - len(errors)
+                if errors:
+                    raise errors[0]
+            if trends is not None:
+                series = self._retry(record_points, trends, user_id, docs)
+                with self._lock:
+                    self.series_updated += series
+        except Exception as e:
+            if trends is not None and written == len(docs):
+                # The metrics are in; have the series rebuilt from them on the user's next read
+                with self._lock:
+                    self.series_failed += 1
+                try:
+                    invalidate(trends, user_id)
+                except Exception:
+                    pass
+            with self._lock:
+                self.failed += len(docs) - written
+                self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Metric write for {user_id} failed: {e}")
+        finally:
+            with self._lock:
+                self.written += written
+                self._ack_ms_total += (time.perf_counter() - queued) * 1000
+                self._acked_reports += 1
+        return written
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits for every queued write; False if some were still running after `timeout` seconds."""
+        with self._lock:
+            pending = list(self._pending)
+        return not wait(pending, timeout).not_done
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "pendingReports": len(self._pending),
+                "submitted": self.submitted,
+                "written": self.written,
+                "failed": self.failed,
+                "batches": self.batches,
+                "retried": self.retried,
+                "seriesUpdated": self.series_updated,
+                "seriesFailed": self.series_failed,
+                "avgAckMs": round(self._ack_ms_total / self._acked_reports, 2) if self._acked_reports else 0.0,
+                "lastError": self.last_error,
+            }
+
+
+metric_writer = MetricWriter()
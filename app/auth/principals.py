@@ -0,0 +1,101 @@
+"""
+Cache of authenticated principals.
+
+Without it, every authenticated request decodes its JWT and looks the
+user up again: a cross-partition Cosmos query for accounts, or a patients
+lookup for PAT- tokens. PrincipalCache maps each bearer token to the
+principal it resolved to, for PRINCIPAL_TTL seconds or until the token
+expires, whichever comes first. A token that failed to authenticate is
+remembered for NEGATIVE_TTL seconds, so a client retrying a bad token
+costs no Cosmos query either.
+
+invalidate_user(sub) drops every cached token of a user, e.g. when the
+account is created, changed or deleted. Other workers see the change
+once their entries expire.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.mediconnect.cache import TTLCache
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))  # tokens
+PRINCIPAL_TTL = 300  # seconds another worker may keep accepting a changed or deleted user
+NEGATIVE_TTL = 30  # seconds a rejected token is rejected without a lookup
+
+INVALID = object()  # cached answer for a token that did not authenticate
+
+
+class PrincipalCache:
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_TTL, negative_ttl: float = NEGATIVE_TTL):
+        self._cache = TTLCache(maxsize, ttl)
+        self.negative_ttl = negative_ttl
+        # Bumped by invalidate_user; entries cached under an older generation are stale
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.negative_hits = 0
+        # Cosmos lookups and their request charge, to report the RUs the cache saves
+        self.cosmos_lookups = 0
+        self.cosmos_ru = 0.0
+        self._minute = 0
+        self._cosmos_hits = [0, 0]  # this minute, last minute
+
+    def get(self, token: str) -> Optional[Any]:
+        """The principal cached for `token`, INVALID if it was rejected, or None if unknown."""
+        entry = self._cache.get(token)
+        if entry is None:
+            return None
+        sub, generation, principal, source = entry
+        if sub is not None and generation != self._generations.get(sub, 0):
+            self._cache.invalidate(token)
+            return None
+        if principal is INVALID:
+            self.negative_hits += 1
+        elif source == "cosmos":
+            self._count_cosmos_hit()
+        return principal
+
+    def put(self, token: str, sub: str, principal: Dict[str, Any], expires_at: Optional[float] = None,
+            source: Optional[str] = None, ru: float = 0.0):
+        """Caches a resolved principal, never past the token's own expiry (a Unix time)."""
+        ttl = self._cache.ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if source == "cosmos":
+            self.cosmos_lookups += 1
+            self.cosmos_ru += ru
+        if ttl > 0:
+            self._cache.put(token, (sub, self._generations.get(sub, 0), principal, source), ttl)
+
+    def reject(self, token: str, sub: Optional[str] = None):
+        """Remembers that `token` did not authenticate."""
+        self._cache.put(token, (sub, self._generations.get(sub, 0), INVALID, None), self.negative_ttl)
+
+    def invalidate_user(self, sub: str):
+        with self._lock:
+            self._generations[sub] = self._generations.get(sub, 0) + 1
+
+    def _count_cosmos_hit(self):
+        minute = int(time.time() // 60)
+        with self._lock:
+            if minute != self._minute:
+                self._cosmos_hits = [0, self._cosmos_hits[0] if minute == self._minute + 1 else 0]
+                self._minute = minute
+            self._cosmos_hits[0] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = self._cache.snapshot()
+        ru_per_lookup = self.cosmos_ru / self.cosmos_lookups if self.cosmos_lookups else 0.0
+        minute = int(time.time() // 60)
+        last_minute = self._cosmos_hits[1] if minute == self._minute else self._cosmos_hits[0] if minute == self._minute + 1 else 0
+        snapshot.update({
+            "negativeHits": self.negative_hits,
+            "cosmosLookups": self.cosmos_lookups,
+            "cosmosRuPerLookup": round(ru_per_lookup, 2),
+            "cosmosRuSavedLastMinute": round(last_minute * ru_per_lookup, 1),
+        })
+        return snapshot
+
+
+principal_cache = PrincipalCache()
@@ -3,11 +3,12 @@ from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-import bcrypt
 from jose import JWTError, jwt
 import uuid
 
 from app.auth.cosmos import get_db
+from app.auth.hashing import HashPoolBusy, hasher
+from app.auth.principals import INVALID, principal_cache
 
 # Security config
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "generate_a_secure_random_key_here")
@@ -18,13 +19,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
-def verify_password(plain_password, hashed_password):
-    if isinstance(hashed_password, str):
-        hashed_password = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password)
-
-def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def _busy():
+    # The hashing pool is saturated; shed the request rather than queue it behind the storm
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-ins right now, please retry",
+        headers={"Retry-After": "1"},
+    )
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -32,6 +33,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def _request_charge(container) -> float:
+    """RUs charged for the container's last Cosmos request (0 for the local containers)."""
+    headers = getattr(getattr(container, "client_connection", None), "last_response_headers", None) or {}
+    return float(headers.get("x-ms-request-charge") or 0)
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Validates the JWT and returns the current user_id. Raises 401 if invalid."""
     credentials_exception = HTTPException(
@@ -39,21 +45,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Steady state: a token seen recently resolves without decoding or a lookup
+    cached = principal_cache.get(token)
+    if cached is INVALID:
+        raise credentials_exception
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
+            principal_cache.reject(token)
             raise credentials_exception
     except JWTError:
+        principal_cache.reject(token)
         raise credentials_exception
     
     if username.startswith("PAT-"):
-        from app.mediconnect import database as mediconnect_db
-        patients = mediconnect_db.search_patients(username)
-        if not patients:
+        from app.mediconnect import async_database as async_db
+        patient = await async_db.get_patient_by_unique_id(username)
+        if not patient:
+            principal_cache.reject(token, username)
             raise credentials_exception
         # Mock user object for the frontend
-        return {"username": patients[0]["unique_id"]}
+        user = {"username": patient["unique_id"]}
+        principal_cache.put(token, username, user, payload.get("exp"), "patients")
+        return user
 
     # Check if user exists in CosmosDB
     db = get_db()
@@ -66,8 +84,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     user_list = list(users_container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
 
     if not user_list:
+        principal_cache.reject(token, username)
         raise credentials_exception
-        
+
+    principal_cache.put(token, username, user_list[0], payload.get("exp"), "cosmos", _request_charge(users_container))
     return user_list[0]
 
 @router.post("/register")
@@ -85,7 +105,10 @@ async def register(form_data: OAuth2PasswordRequestForm = Depends()):
     if existing:
         raise HTTPException(status_code=400, detail="Username already registered")
 
-    hashed_password = get_password_hash(form_data.password)
+    try:
+        hashed_password = await hasher.hash(form_data.password)
+    except HashPoolBusy:
+        raise _busy()
     new_user = {
         "id": form_data.username, # Using username as partition key/ID for simplicity
         "username": form_data.username,
@@ -95,6 +118,8 @@ async def register(form_data: OAuth2PasswordRequestForm = Depends()):
     
     try:
         users_container.create_item(body=new_user)
+        # Forget any earlier rejection of this username's tokens
+        principal_cache.invalidate_user(new_user["username"])
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": new_user["username"]}, expires_delta=access_token_expires
@@ -110,12 +135,11 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         if form_data.password != "password":
             raise HTTPException(status_code=401, detail="Incorrect username or password")
         
-        from app.mediconnect import database as mediconnect_db
-        patients = mediconnect_db.search_patients(form_data.username)
-        if not patients:
+        from app.mediconnect import async_database as async_db
+        patient = await async_db.get_patient_by_unique_id(form_data.username)
+        if not patient:
             raise HTTPException(status_code=401, detail="Incorrect username or password")
             
-        patient = patients[0]
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": patient["unique_id"]}, expires_delta=access_token_expires
@@ -131,7 +155,11 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     parameters = [{"name": "@username", "value": form_data.username}]
     user_list = list(users_container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
 
-    if not user_list or not verify_password(form_data.password, user_list[0]["password_hash"]):
+    try:
+        valid = bool(user_list) and await hasher.verify(form_data.password, user_list[0]["password_hash"])
+    except HashPoolBusy:
+        raise _busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -0,0 +1,225 @@
+"""
+Pre-aggregated lab trend series.
+
+/api/trends used to read every metric document a user ever produced and
+group them in Python on each chart load. Each (user, analyte) pair now has
+one series document in LabTrends:
+
+    {"id": ..., "user_id": ..., "metric_name": "HbA1c", "unit": "%",
+     "points": [[timestamp, value], ...], "count": 12, "updated": timestamp}
+
+The metric writer calls record_points() once a report's metrics are
+written. Points are appended with a patch (add /points/-), so two reports
+of the same user written at once cannot drop each other's points. All of
+a report's series are patched in one transactional batch; a series seen
+for the first time costs one create. A retried append whose first attempt
+did land leaves a duplicate point, and duplicates are dropped on read.
+
+LabMetrics remains the source of truth. A user's series are rebuilt from
+it on their first unfiltered trends read (backfill), which covers metrics
+written before LabTrends existed, and again after an append failed. series() serves GET /api/trends. It
+returns only points after `since`, for an incremental chart refresh, and
+downsamples each series to `points` with LTTB (Largest-Triangle-Three-
+Buckets), which keeps the peaks and dips a chart needs to show.
+Downsampled series are cached until their next append.
+"""
+import bisect
+import math
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.mediconnect.cache import TTLCache
+
+BATCH_LIMIT = 100  # operations per transactional batch
+PATCH_LIMIT = 10  # operations per patch
+DEFAULT_POINTS = 500  # per analyte
+BACKFILL_MARKER = "backfilled"  # id of the document recording that a user's series were rebuilt
+BACKFILL_ROUNDS = 3  # rebuilds tried before a backfill racing new metrics gives up until the next read
+_SERIES_NAMESPACE = uuid.UUID("5b0f3c3e-52a4-4c53-9a35-4f1b0cbb8d53")
+
+# Downsampled series by (user, analyte, points, count); an append bumps count, so entries never go stale
+downsampled_cache = TTLCache(int(os.getenv("TRENDS_CACHE_SIZE", "10000")), 600)
+
+
+def series_id(metric_name: str) -> str:
+    # Analyte names may contain '/' or '#', which Cosmos ids may not
+    return uuid.uuid5(_SERIES_NAMESPACE, metric_name).hex
+
+
+def _status(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def _grouped(docs: Sequence[Dict[str, Any]]) -> "OrderedDict[str, Dict[str, Any]]":
+    series = OrderedDict()
+    for doc in docs:
+        entry = series.setdefault(doc["metric_name"], {"unit": doc.get("unit"), "points": [], "updated": ""})
+        entry["points"].append([doc["timestamp"], doc["value"]])
+        entry["updated"] = max(entry["updated"], doc["timestamp"])
+    return series
+
+
+def _patches(entry: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """Patch operation lists appending the entry's points, within Cosmos' limit per patch."""
+    patches = []
+    for start in range(0, len(entry["points"]), PATCH_LIMIT - 3):
+        chunk = entry["points"][start:start + PATCH_LIMIT - 3]
+        patches.append([{"op": "add", "path": "/points/-", "value": point} for point in chunk] + [
+            {"op": "incr", "path": "/count", "value": len(chunk)},
+            {"op": "set", "path": "/unit", "value": entry["unit"]},
+            {"op": "set", "path": "/updated", "value": entry["updated"]},
+        ])
+    return patches
+
+
+def _document(user_id: str, name: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": series_id(name), "user_id": user_id, "metric_name": name, "unit": entry["unit"],
+            "points": entry["points"], "count": len(entry["points"]), "updated": entry["updated"]}
+
+
+def record_points(container, user_id: str, docs: Sequence[Dict[str, Any]]) -> int:
+    """Appends the metric documents `docs` (one report's, all `user_id`'s) to their series; returns the series touched."""
+    series = _grouped(docs)
+    names = list(series)
+    operations = [("patch", (series_id(name), patch)) for name in names for patch in _patches(series[name])]
+    try:
+        for start in range(0, len(operations), BATCH_LIMIT):
+            container.execute_item_batch(operations[start:start + BATCH_LIMIT], user_id)
+        return len(names)
+    except Exception as e:
+        if _status(e) != 404:
+            raise
+    # Some series do not exist yet (the batch that failed changed nothing); patch or create them one at a time
+    for name in names:
+        patches = _patches(series[name])
+        try:
+            container.patch_item(series_id(name), user_id, patches[0])
+        except Exception as e:
+            if _status(e) != 404:
+                raise
+            try:
+                container.create_item(_document(user_id, name, series[name]))
+                continue
+            except Exception as e:
+                if _status(e) != 409:
+                    raise
+                container.patch_item(series_id(name), user_id, patches[0])  # created meanwhile
+        for patch in patches[1:]:
+            container.patch_item(series_id(name), user_id, patch)
+    return len(names)
+
+
+def _metrics(db: Dict[str, Any], user_id: str, columns: str = "*") -> List[Dict[str, Any]]:
+    query = f"SELECT {columns} FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp ASC"
+    params = [{"name": "@user_id", "value": user_id}]
+    return list(db["metrics"].query_items(query=query, parameters=params, partition_key=user_id))
+
+
+def _rebuild(db: Dict[str, Any], user_id: str, docs: Sequence[Dict[str, Any]]):
+    operations = [("upsert", (_document(user_id, name, entry),)) for name, entry in _grouped(docs).items()]
+    for start in range(0, len(operations), BATCH_LIMIT):
+        db["trends"].execute_item_batch(operations[start:start + BATCH_LIMIT], user_id)
+
+
+def backfill(db: Dict[str, Any], user_id: str):
+    """Rebuilds `user_id`'s series from LabMetrics, once.
+
+    The marker is written first, so an invalidate() during the rebuild
+    removes it and the next read rebuilds again. The upserts replace whole
+    series, and would drop a point appended between the metrics query and
+    the upsert. A metric is written before its point is appended, so the
+    metric ids are listed again afterwards. If any metric arrived meanwhile,
+    the rebuild is repeated.
+    """
+    try:
+        db["trends"].read_item(BACKFILL_MARKER, user_id)
+        return
+    except Exception as e:
+        if _status(e) != 404:
+            raise
+    db["trends"].upsert_item({"id": BACKFILL_MARKER, "user_id": user_id, "at": datetime.now().isoformat()})
+    try:
+        docs = _metrics(db, user_id)
+        for _ in range(BACKFILL_ROUNDS):
+            _rebuild(db, user_id, docs)
+            if {m["id"] for m in _metrics(db, user_id, "c.id")} <= {doc["id"] for doc in docs}:
+                return
+            docs = _metrics(db, user_id)
+    except Exception:
+        invalidate(db["trends"], user_id)
+        raise
+    # Metrics kept arriving; leave the series for the next read to rebuild
+    invalidate(db["trends"], user_id)
+
+
+def invalidate(container, user_id: str):
+    """Has `user_id`'s series rebuilt from LabMetrics on their next unfiltered read."""
+    try:
+        container.delete_item(BACKFILL_MARKER, user_id)
+    except Exception as e:
+        if _status(e) != 404:
+            raise
+
+
+def lttb(points: List[List[Any]], threshold: int) -> List[List[Any]]:
+    """Downsamples [timestamp, value] points, in time order, to `threshold` with Largest-Triangle-Three-Buckets."""
+    n = len(points)
+    if threshold >= n or n < 3:
+        return points
+    threshold = max(threshold, 3)
+    parse = datetime.fromisoformat
+    xs = [parse(ts).timestamp() for ts, _ in points]
+    ys = [float(value) for _, value in points]
+    every = (n - 2) / (threshold - 2)
+    sampled = [points[0]]
+    a = 0
+    for i in range(threshold - 2):
+        # The next bucket's average is the third corner of every triangle in this one
+        next_start, next_end = int((i + 1) * every) + 1, min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+        xa, ya = xs[a], ys[a]
+        dx, dy = xa - avg_x, avg_y - ya
+        best, best_area = next_start - 1, -1.0
+        for j in range(int(i * every) + 1, next_start):
+            area = abs(dx * (ys[j] - ya) - (xa - xs[j]) * dy)
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        sampled.append(points[a])
+    sampled.append(points[-1])
+    return sampled
+
+
+def series(db: Dict[str, Any], user_id: str, points: Optional[int] = DEFAULT_POINTS,
+           since: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """{analyte: {"dates", "values", "unit"}} for `user_id`, with only the analytes and points newer than `since`."""
+    if since is None:
+        backfill(db, user_id)
+    query = ("SELECT c.metric_name, c.unit, c.points, c.count FROM c "
+             "WHERE c.user_id = @user_id AND c.updated > @since")
+    params = [{"name": "@user_id", "value": user_id}, {"name": "@since", "value": since or ""}]
+    trends = {}
+    for doc in db["trends"].query_items(query=query, parameters=params, partition_key=user_id):
+        key = (user_id, doc["metric_name"], points, doc.get("count"))
+        cached = downsampled_cache.get(key) if since is None else None
+        if cached is None:
+            ordered = sorted(doc["points"])
+            if since is not None:
+                ordered = ordered[bisect.bisect_right(ordered, [since, math.inf]):]
+            data, last = [], None
+            for point in ordered:
+                if point != last:
+                    data.append(point)
+                last = point
+            if points:
+                data = lttb(data, points)
+            cached = {"dates": [ts for ts, _ in data], "values": [value for _, value in data], "unit": doc["unit"]}
+            if since is None:
+                downsampled_cache.put(key, cached)
+        trends[doc["metric_name"]] = cached
+    return trends
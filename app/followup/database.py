@@ -1,15 +1,26 @@
 import sqlite3
 import os
+import json
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 
 DB_PATH = str(Path(__file__).parent.parent.parent / "data" / "followup.db")
 
+# Recovery trajectory tuning
+EWMA_ALPHA = 0.4          # Weight of the newest pain reading in the moving average
+SLOPE_WINDOW_DAYS = 5     # Trend window used for the pain slope (points per day)
+ALERT_WEIGHT = 1.5        # Score contribution of each alert in the trend window
+MAX_AT_RISK = 200         # Most patients /api/followup/at-risk returns
+
+EXPORT_CHUNK = 500        # Check-ins fetched per step when streaming a patient's record
+
 def init_db():
     """Initializes the SQLite database with required tables."""
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_trajectories'")
+    new_trajectories = cursor.fetchone() is None
 
     # Patients Table
     cursor.execute('''
@@ -38,8 +49,34 @@ def init_db():
         )
     ''')
 
+    # Per-patient recovery aggregates, maintained on every check-in
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patient_trajectories (
+            patient_id INTEGER PRIMARY KEY,
+            checkin_count INTEGER NOT NULL DEFAULT 0,
+            last_checkin TEXT,
+            last_pain_level INTEGER,
+            pain_ewma REAL,
+            pain_slope REAL,
+            days_since_surgery INTEGER,
+            alert_count INTEGER NOT NULL DEFAULT 0,
+            recent_points TEXT, -- JSON list of [date, pain_level, requires_alert] inside the slope window
+            deterioration_score REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(patient_id) REFERENCES patients(id)
+        )
+    ''')
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_trajectories_score ON patient_trajectories(deterioration_score DESC)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trajectories_last_checkin ON patient_trajectories(last_checkin)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trajectories_ewma ON patient_trajectories(pain_ewma DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkins_patient_date ON checkins(patient_id, date)")
+
     conn.commit()
     conn.close()
+    if new_trajectories:
+        # Databases from before the summary table already hold check-ins to fold in
+        rebuild_trajectories()
 
 def add_patient(name, phone_number, surgery_type, surgery_date, doctor_phone):
     """Adds a new patient to the database."""
@@ -76,15 +113,89 @@ def get_all_patients():
     conn.close()
     return [dict(p) for p in patients]
 
+def _pain_slope(points):
+    """Least-squares slope of pain level per calendar day over the given [date, pain, alert] points."""
+    points = [p for p in points if p[1] is not None]
+    if len(points) < 2:
+        return 0.0
+    origin = datetime.fromisoformat(points[0][0]).date()
+    xs = [(datetime.fromisoformat(p[0]).date() - origin).days for p in points]
+    ys = [p[1] for p in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+def _days_since(date_str, now):
+    try:
+        return (now.date() - datetime.fromisoformat(date_str).date()).days
+    except (TypeError, ValueError):
+        return None
+
+def _in_window(points, now):
+    return [p for p in points if (now - datetime.fromisoformat(p[0])).total_seconds() <= SLOPE_WINDOW_DAYS * 86400]
+
+def _score(ewma, points):
+    """(slope, deterioration score) for a pain EWMA and the [date, pain, alert] points inside the window."""
+    slope = _pain_slope(points)
+    recent_alerts = sum(1 for p in points if p[2])
+    # Higher is worse: current pain level, plus a rising trend, plus recent alerts
+    return slope, (ewma or 0.0) + max(slope, 0.0) * SLOPE_WINDOW_DAYS + recent_alerts * ALERT_WEIGHT
+
+def _update_trajectory(cursor, patient_id, now, pain_level, requires_alert):
+    """Folds one check-in into the patient's trajectory row. Runs inside the caller's transaction."""
+    cursor.execute(
+        'SELECT checkin_count, pain_ewma, alert_count, recent_points, last_pain_level FROM patient_trajectories WHERE patient_id = ?',
+        (patient_id,)
+    )
+    row = cursor.fetchone()
+    count, ewma, alerts, points, last_pain = (row[0], row[1], row[2], json.loads(row[3] or "[]"), row[4]) if row else (0, None, 0, [], None)
+
+    # A reply whose pain level could not be read says nothing about pain; it only counts for its alert
+    if pain_level is not None:
+        ewma = pain_level if ewma is None else EWMA_ALPHA * pain_level + (1 - EWMA_ALPHA) * ewma
+        last_pain = pain_level
+    alerts += 1 if requires_alert else 0
+
+    # Keep only the points inside the slope window so each update stays O(window)
+    points.append([now.isoformat(), pain_level, bool(requires_alert)])
+    points = _in_window(points, now)
+    slope, score = _score(ewma, points)
+
+    cursor.execute('SELECT surgery_date FROM patients WHERE id = ?', (patient_id,))
+    patient = cursor.fetchone()
+    days_since_surgery = _days_since(patient[0], now) if patient else None
+
+    cursor.execute('''
+        INSERT INTO patient_trajectories
+            (patient_id, checkin_count, last_checkin, last_pain_level, pain_ewma, pain_slope,
+             days_since_surgery, alert_count, recent_points, deterioration_score)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(patient_id) DO UPDATE SET
+            checkin_count = excluded.checkin_count,
+            last_checkin = excluded.last_checkin,
+            last_pain_level = excluded.last_pain_level,
+            pain_ewma = excluded.pain_ewma,
+            pain_slope = excluded.pain_slope,
+            days_since_surgery = excluded.days_since_surgery,
+            alert_count = excluded.alert_count,
+            recent_points = excluded.recent_points,
+            deterioration_score = excluded.deterioration_score
+    ''', (patient_id, count + 1, now.isoformat(), last_pain, ewma, slope,
+          days_since_surgery, alerts, json.dumps(points), score))
+
 def add_checkin(patient_id, message_sent, patient_response, pain_level, symptoms_flagged, requires_alert):
-    """Records a patient's response and LLM evaluation."""
+    """Records a patient's response and LLM evaluation, and updates the patient's trajectory."""
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    now_str = datetime.now().isoformat()
+    now = datetime.now()
     cursor.execute('''
         INSERT INTO checkins (patient_id, date, message_sent, patient_response, pain_level, symptoms_flagged, requires_alert)
         VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (patient_id, now_str, message_sent, patient_response, pain_level, symptoms_flagged, requires_alert))
+    ''', (patient_id, now.isoformat(), message_sent, patient_response, pain_level, symptoms_flagged, requires_alert))
+    _update_trajectory(cursor, patient_id, now, pain_level, requires_alert)
     conn.commit()
     conn.close()
 
@@ -104,6 +215,116 @@ def get_recent_checkins(limit=50):
     conn.close()
     return [dict(c) for c in checkins]
 
+def get_patients_at_risk(limit=20):
+    """Returns monitored patients ordered by deterioration score, worst first.
+
+    Stored scores are as of each patient's last check-in, so they are aged
+    to now here. Check-ins that have left the slope window no longer count,
+    and a patient silent for longer than the window is ranked by pain EWMA
+    alone.
+    """
+    now = datetime.now()
+    cutoff = (now - timedelta(days=SLOPE_WINDOW_DAYS)).isoformat()
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    columns = '''
+        SELECT t.patient_id, p.name as patient_name, p.phone_number, p.surgery_type, p.surgery_date,
+               t.checkin_count, t.last_checkin, t.last_pain_level, t.pain_ewma, t.pain_slope,
+               t.alert_count, t.recent_points, t.deterioration_score
+        FROM patient_trajectories t
+        JOIN patients p ON t.patient_id = p.id
+    '''
+    # Patients heard from inside the window, whose points may partly have aged out
+    cursor.execute(columns + ' WHERE t.last_checkin >= ?', (cutoff,))
+    active = cursor.fetchall()
+    # Silent patients score their EWMA only, so the best of them come straight from the index
+    cursor.execute(columns + ' WHERE t.last_checkin < ? ORDER BY t.pain_ewma DESC LIMIT ?', (cutoff, limit))
+    silent = cursor.fetchall()
+    conn.close()
+
+    patients = []
+    for row in list(active) + list(silent):
+        patient = dict(row)
+        points = _in_window(json.loads(patient.pop("recent_points") or "[]"), now)
+        patient["pain_slope"], patient["deterioration_score"] = _score(patient["pain_ewma"], points)
+        patient["days_since_surgery"] = _days_since(patient.pop("surgery_date"), now)
+        patients.append(patient)
+    patients.sort(key=lambda p: p["deterioration_score"], reverse=True)
+    return patients[:limit]
+
+def rebuild_trajectories():
+    """Recomputes every trajectory from the raw check-ins (for databases created before the summary table)."""
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM patient_trajectories')
+    cursor.execute('SELECT patient_id, date, pain_level, requires_alert FROM checkins ORDER BY date ASC, id ASC')
+    for patient_id, date, pain_level, requires_alert in cursor.fetchall():
+        _update_trajectory(conn.cursor(), patient_id, datetime.fromisoformat(date), pain_level, requires_alert)
+    conn.commit()
+    conn.close()
+
+def iter_patient_record(phone_number):
+    """Yields ("followup_patient", row), then ("checkin", row) oldest first, for the patient with this phone.
+
+    Check-ins are fetched EXPORT_CHUNK at a time. Yields nothing if the
+    patient is not monitored.
+    """
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, phone_number, surgery_type, surgery_date, doctor_phone, id FROM patients WHERE phone_number = ?', (phone_number,))
+        patient = cursor.fetchone()
+        if not patient:
+            return
+        yield "followup_patient", {k: patient[k] for k in patient.keys() if k != "id"}
+        cursor.execute('''
+            SELECT date, message_sent, patient_response, pain_level, symptoms_flagged, requires_alert
+            FROM checkins WHERE patient_id = ? ORDER BY date ASC, id ASC
+        ''', (patient["id"],))
+        while rows := cursor.fetchmany(EXPORT_CHUNK):
+            for row in rows:
+                yield "checkin", dict(row)
+    finally:
+        conn.close()
+
+def import_patient_record(patient, checkins):
+    """Adds a transferred patient's check-ins in one transaction and replays their trajectory.
+
+    The patient is matched by phone number and created if new. Check-ins
+    already here (same date) are skipped, so a record imported twice is not
+    doubled. Returns the number of check-ins added.
+    """
+    init_db()
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO patients (name, phone_number, surgery_type, surgery_date, doctor_phone)
+        VALUES (?, ?, ?, ?, ?) ON CONFLICT(phone_number) DO NOTHING
+    ''', (patient["name"], patient["phone_number"], patient.get("surgery_type"), patient.get("surgery_date"), patient.get("doctor_phone")))
+    cursor.execute('SELECT id FROM patients WHERE phone_number = ?', (patient["phone_number"],))
+    patient_id = cursor.fetchone()[0]
+    cursor.execute('SELECT date FROM checkins WHERE patient_id = ?', (patient_id,))
+    known = {row[0] for row in cursor.fetchall()}
+    checkins = [c for c in checkins if c["date"] not in known]
+    cursor.executemany('''
+        INSERT INTO checkins (patient_id, date, message_sent, patient_response, pain_level, symptoms_flagged, requires_alert)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(patient_id, c["date"], c.get("message_sent"), c.get("patient_response"), c.get("pain_level"),
+           c.get("symptoms_flagged"), c.get("requires_alert")) for c in checkins])
+    # The imported check-ins may predate ones already here, so fold them all in again in order
+    cursor.execute('DELETE FROM patient_trajectories WHERE patient_id = ?', (patient_id,))
+    cursor.execute('SELECT date, pain_level, requires_alert FROM checkins WHERE patient_id = ? ORDER BY date ASC, id ASC', (patient_id,))
+    for date, pain_level, requires_alert in cursor.fetchall():
+        _update_trajectory(conn.cursor(), patient_id, datetime.fromisoformat(date), pain_level, requires_alert)
+    conn.commit()
+    conn.close()
+    return len(checkins)
+
 if __name__ == "__main__":
     init_db()
+    rebuild_trajectories()
     print("Followup DB initialized.")
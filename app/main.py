@@ -2,6 +2,7 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse, FileResponse
+import asyncio
 import os
 import io
 import datetime
@@ -10,17 +11,23 @@ import json
 import base64
 from dotenv import load_dotenv
 from fastapi import Depends
+from typing import Optional
 
 # Internal module imports
 from app.intelligence.extractor import extract_text_from_file, extract_prescription_text
 from app.intelligence.analyzer import load_benchmarks, flag_values, generate_human_friendly_report, translate_and_simplify
 from app.intelligence.speech import generate_audio
 from app.auth.cosmos import get_db
+from app.auth.history import DEFAULT_PAGE, history_item, history_page
+from app.auth.metric_writer import metric_writer
 from app.auth.routes import router as auth_router, get_current_user_optional, get_current_user
+from app.auth.trends import DEFAULT_POINTS, series as trend_series
 from app.followup import database as followup_db
 from app.followup.analyzer import evaluate_patient_response
 from app.followup.twilio import twilio_agent
 from app.mediconnect import api as mediconnect_api
+from app.mediconnect import database as mediconnect_db
+from app.mediconnect.archive import archiver
 
 app = FastAPI(title="MedSaathi — Lab Report Intelligence API")
 
@@ -33,6 +40,13 @@ os.makedirs("data", exist_ok=True)
 os.makedirs("static", exist_ok=True)
 os.makedirs("static/portal", exist_ok=True)
 
+# Create the MediConnect schema and apply any pending migrations
+mediconnect_db.init_db()
+# Create the follow-up tables (and backfill recovery trajectories on first run)
+followup_db.init_db()
+# Move old completed actions and visits to mediconnect_archive.db in the background
+archiver.start()
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -114,19 +128,18 @@ async def analyze_report(
                 }
                 db["reports"].create_item(body=cosmos_record)
                 
-                # Save discrete metrics for trends
+                # Save discrete metrics for trends, acknowledged in the background
                 if db.get("metrics") and flags:
-                    for flag in flags:
-                        metric_doc = {
-                            "id": str(uuid.uuid4()),
-                            "user_id": current_user["username"],
-                            "report_id": report_id,
-                            "metric_name": flag["item"],
-                            "value": flag["value"],
-                            "unit": flag["unit"],
-                            "timestamp": report_data["timestamp"]
-                        }
-                        db["metrics"].create_item(body=metric_doc)
+                    metric_docs = [{
+                        "id": str(uuid.uuid4()),
+                        "user_id": current_user["username"],
+                        "report_id": report_id,
+                        "metric_name": flag["item"],
+                        "value": flag["value"],
+                        "unit": flag["unit"],
+                        "timestamp": report_data["timestamp"]
+                    } for flag in flags]
+                    metric_writer.submit(db["metrics"], current_user["username"], metric_docs, trends=db.get("trends"))
         else:
             # Guest mode: local history.json
             history = load_json(HISTORY_FILE)
@@ -196,31 +209,23 @@ async def parse_prescription(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/history")
-async def get_history(current_user: dict = Depends(get_current_user_optional)):
+async def get_history(limit: int = DEFAULT_PAGE, continuation: Optional[str] = None,
+                      current_user: dict = Depends(get_current_user_optional)):
     if current_user:
-        db = get_db()
-        history = []
-        if db.get("reports"):
-            query = "SELECT * FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp DESC"
-            params = [{"name": "@user_id", "value": current_user["username"]}]
-            reports = list(db["reports"].query_items(query=query, parameters=params, enable_cross_partition_query=True))
-            for r in reports:
-                r["type"] = "report"
-                history.append(r)
-        
-        if db.get("prescriptions"):
-            query = "SELECT * FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp DESC"
-            params = [{"name": "@user_id", "value": current_user["username"]}]
-            prescriptions = list(db["prescriptions"].query_items(query=query, parameters=params, enable_cross_partition_query=True))
-            for p in prescriptions:
-                p["type"] = "prescription"
-                history.append(p)
-                
-        history.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-        return history
+        try:
+            return await asyncio.to_thread(history_page, get_db(), current_user["username"], limit, continuation)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     else:
-        # Guest mode read local file
-        return load_json(HISTORY_FILE)
+        # Guest mode read local file (at most 50 entries, sent whole)
+        return {"items": load_json(HISTORY_FILE), "continuation": None}
+
+@app.get("/api/history/{kind}/{item_id}")
+async def get_history_item(kind: str, item_id: str, current_user: dict = Depends(get_current_user)):
+    item = await asyncio.to_thread(history_item, get_db(), current_user["username"], kind, item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return item
 
 @app.get("/api/settings")
 async def get_settings():
@@ -232,26 +237,15 @@ async def update_settings(settings: dict):
     return {"status": "success"}
 
 @app.get("/api/trends")
-async def get_trends(current_user: dict = Depends(get_current_user)):
-    """Fetch historical lab metrics for charting."""
+async def get_trends(points: int = DEFAULT_POINTS, since: Optional[str] = None,
+                     current_user: dict = Depends(get_current_user)):
+    """Historical lab metrics for charting, at most `points` per analyte; with `since`, only what is newer."""
     db = get_db()
-    if not db.get("metrics"):
+    if not db.get("metrics") or not db.get("trends"):
         raise HTTPException(status_code=500, detail="Database not configured")
-        
-    query = "SELECT * FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp ASC"
-    params = [{"name": "@user_id", "value": current_user["username"]}]
-    metrics = list(db["metrics"].query_items(query=query, parameters=params, enable_cross_partition_query=True))
-    
-    # Group by metric_name
-    trends = {}
-    for m in metrics:
-        name = m["metric_name"]
-        if name not in trends:
-            trends[name] = {"dates": [], "values": [], "unit": m["unit"]}
-        trends[name]["dates"].append(m["timestamp"])
-        trends[name]["values"].append(m["value"])
-        
-    return trends
+    if points < 3:
+        raise HTTPException(status_code=400, detail="points must be at least 3")
+    return await asyncio.to_thread(trend_series, db, current_user["username"], points, since)
 
 # ─── Autonomous Patient Follow-up Agent Endpoints ─────────────────────────
 
@@ -315,6 +309,11 @@ def get_dashboard():
     """Returns recent patient check-ins for the Doctor's dashboard UI."""
     return followup_db.get_recent_checkins()
 
+@app.get("/api/followup/at-risk")
+def get_at_risk(limit: int = 20):
+    """Returns monitored patients ranked by recovery deterioration score."""
+    return followup_db.get_patients_at_risk(max(1, min(limit, followup_db.MAX_AT_RISK)))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
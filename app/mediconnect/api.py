@@ -1,41 +1,153 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-from app.mediconnect import database as mediconnect_db
+from app.auth.hashing import hasher
+from app.auth.metric_writer import metric_writer
+from app.auth.principals import principal_cache
+from app.auth.trends import downsampled_cache
+from app.mediconnect import async_database as async_db
+from app.mediconnect import importer
+from app.mediconnect import realtime
+from app.mediconnect import serializers
+from app.mediconnect import transfer
+from app.mediconnect.archive import archiver
+from app.mediconnect.cache import TTLCache, VersionedLRU
+from app.mediconnect.database import DEFAULT_PAGE_SIZE, STATS_VERSION_TABLE, BundleAlreadyImported
+from app.mediconnect.events import create_bus
+from app.mediconnect.realtime import ConnectionManager
+from app.mediconnect.serializers import JSONResponse
 from datetime import datetime
-import json
+import asyncio
+import os
 import sqlite3
 
 router = APIRouter()
 
-# --- WebSockets ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+SYNC_RECHECK_SECONDS = 10  # catches writes made by other workers that broadcast nothing
+TIMELINE_CACHE_SIZE = int(os.getenv("MEDICONNECT_TIMELINE_CACHE_SIZE", "1024"))  # patients
+CARE_TEAM_CACHE_SIZE = 10000  # patients
+CARE_TEAM_CACHE_TTL = 30  # seconds another worker may keep routing to a reassigned patient's previous doctor
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def _split(values: Optional[str]) -> Optional[List[str]]:
+    """Parses a comma-separated query parameter such as ?status=pending,in_progress."""
+    if not values:
+        return None
+    return [v.strip() for v in values.split(",") if v.strip()]
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+async def _page_response(mapper, fetch, *args) -> JSONResponse:
+    """Runs a keyset-paginated query and returns its mapped rows, with the next cursor as a response header."""
+    try:
+        rows, next_cursor = await fetch(*args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return JSONResponse(serializers.many(mapper, rows), headers=headers)
 
-manager = ConnectionManager()
+# --- WebSockets ---
+manager = ConnectionManager(create_bus())
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, organizationId: Optional[int] = None, role: Optional[str] = None,
+                             patientId: Optional[int] = None, doctorId: Optional[int] = None):
+    await manager.connect(websocket, realtime.topics(organizationId, [role], patientId, doctorId))
     try:
         while True:
-            data = await websocket.receive_text()
-            # Just keeping connection alive
+            await manager.receive(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
+class ConditionalGetMetrics:
+    """Per-endpoint count of conditional GETs and of those answered with 304."""
+
+    def __init__(self):
+        self.requests: Dict[str, int] = {}
+        self.not_modified: Dict[str, int] = {}
+
+    def record(self, endpoint: str, hit: bool):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if hit:
+            self.not_modified[endpoint] = self.not_modified.get(endpoint, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = {}
+        for endpoint, requests in self.requests.items():
+            hits = self.not_modified.get(endpoint, 0)
+            snapshot[endpoint] = {"requests": requests, "notModified": hits, "hitRatio": round(hits / requests, 3)}
+        return snapshot
+
+conditional_metrics = ConditionalGetMetrics()
+timeline_cache = VersionedLRU(TIMELINE_CACHE_SIZE)
+care_team_cache = TTLCache(CARE_TEAM_CACHE_SIZE, CARE_TEAM_CACHE_TTL)
+
+async def _conditional(request: Request, endpoint: str, tables: List[str], patient_id: Optional[int], build) -> Response:
+    """Answers If-None-Match from the change log's version of `tables`, or calls build(version) and tags the result.
+
+    The version is read before the data, so a write that lands in between
+    gives the client an older tag and it simply refetches next time.
+    """
+    version = await async_db.get_version(tables, patient_id)
+    etag = f'W/"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    hit = bool(if_none_match) and any(tag.strip() in (etag, "*") for tag in if_none_match.split(","))
+    conditional_metrics.record(endpoint, hit)
+    if hit:
+        return Response(status_code=304, headers=headers)
+    response = await build(version)
+    response.headers.update(headers)
+    return response
+
+async def _changes(since: Optional[str], tables: Optional[str], patient_id: Optional[int]) -> Dict[str, Any]:
+    delta = await async_db.get_changes(since, _split(tables), patient_id)
+    delta["changes"] = {table: serializers.many(serializers.SYNC[table], rows) for table, rows in delta["changes"].items()}
+    return delta
+
+@router.websocket("/ws/sync")
+async def sync_socket(websocket: WebSocket, since: Optional[str] = None, tables: Optional[str] = None, patientId: Optional[int] = None):
+    """Pushes the same deltas as GET /api/sync, as soon as there is something new.
+
+    The first frame is sent at once: the current cursor when `since` is
+    omitted, otherwise everything changed after it. Later frames are only
+    sent when rows actually changed.
+    """
+    await websocket.accept()
+    changed = manager.watch()
+    # Reading is the only way to notice the client going away while we wait for changes
+    closed = asyncio.create_task(_drain(websocket))
+    cursor, first = since, True
+    try:
+        while not closed.done():
+            changed.clear()
+            try:
+                delta = await _changes(cursor, tables, patientId)
+            except ValueError as e:
+                await websocket.close(code=1008, reason=str(e))
+                return
+            if first or delta["changes"] or delta["deleted"]:
+                await websocket.send_text(serializers.dumps(delta).decode("utf-8"))
+            cursor, first = delta["cursor"], False
+            if delta["more"]:
+                continue
+            woken = asyncio.create_task(changed.wait())
+            await asyncio.wait({closed, woken}, timeout=SYNC_RECHECK_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        manager.unwatch(changed)
+        closed.cancel()
+
+async def _drain(websocket: WebSocket):
+    try:
+        while True:
+            await websocket.receive_text()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
 # --- Models ---
 class LoginRequest(BaseModel):
     orgCode: str
@@ -98,6 +210,8 @@ class TransferRequest(BaseModel):
     patientId: int
     targetOrgId: int
     fromOrgId: int
+    authorId: int
+    notes: Optional[str] = None
 
 class MessageRequest(BaseModel):
     patientId: int
@@ -111,58 +225,47 @@ async def login(req: LoginRequest):
     orgCode = req.orgCode.strip()
     employeeId = req.employeeId.strip()
     
-    org = mediconnect_db.get_organization_by_code(orgCode)
+    org = await async_db.get_organization_by_code(orgCode)
     if not org:
         raise HTTPException(status_code=401, detail="Invalid Organization Code")
         
-    user = mediconnect_db.get_user_by_credentials(org["id"], employeeId, req.password)
+    user = await async_db.get_user_by_credentials(org["id"], employeeId, req.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid Credentials")
         
-    user_copy = dict(user)
-    user_copy.pop("password", None)
+    user_copy = serializers.user(user)
     user_copy["organization"] = org
-    # Ensure keys match frontend camelCase where expected
-    user_copy["organizationId"] = user_copy.pop("organization_id", None)
-    user_copy["employeeId"] = user_copy.pop("employee_id", None)
-    return user_copy
+    return JSONResponse(user_copy)
 
 # --- Staff ---
 @router.get("/api/staff")
 async def get_staff(organizationId: int):
-    staff = mediconnect_db.get_staff_by_org(organizationId)
-    for s in staff:
-        s["organizationId"] = s.pop("organization_id", None)
-        s["employeeId"] = s.pop("employee_id", None)
-    return staff
+    staff = await async_db.get_staff_by_org(organizationId)
+    return JSONResponse(serializers.many(serializers.user, staff))
 
 @router.post("/api/staff")
 async def create_staff(req: StaffRequest):
     try:
-        user = mediconnect_db.create_user(req.organizationId, req.employeeId, req.name, req.role, req.password)
-        user_copy = dict(user)
-        user_copy.pop("password", None)
-        user_copy["organizationId"] = user_copy.pop("organization_id", None)
-        user_copy["employeeId"] = user_copy.pop("employee_id", None)
-        return user_copy
+        user = await async_db.create_user(req.organizationId, req.employeeId, req.name, req.role, req.password)
+        return JSONResponse(serializers.user(user))
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Employee ID might be taken")
 
 # --- Organizations ---
 @router.get("/api/admin/organizations")
 async def get_all_organizations():
-    return mediconnect_db.get_all_organizations()
+    return JSONResponse(await async_db.get_all_organizations())
 
 @router.get("/api/hospitals")
 async def get_hospitals():
-    orgs = mediconnect_db.get_all_organizations()
-    return [o for o in orgs if o["type"] == "hospital"]
+    orgs = await async_db.get_all_organizations()
+    return JSONResponse([o for o in orgs if o["type"] == "hospital"])
 
 @router.post("/api/admin/organizations")
 async def register_organization(req: OrgRequest):
     try:
-        org = mediconnect_db.create_organization(req.name.strip(), req.type, req.code.strip().upper(), req.address)
-        user = mediconnect_db.create_user(org["id"], req.adminEmployeeId.strip(), f"{req.name.strip()} Admin", "admin", req.adminPassword)
+        org = await async_db.create_organization(req.name.strip(), req.type, req.code.strip().upper(), req.address)
+        user = await async_db.create_user(org["id"], req.adminEmployeeId.strip(), f"{req.name.strip()} Admin", "admin", req.adminPassword)
         user_copy = dict(user)
         user_copy.pop("password", None)
         return {"organization": org, "admin": user_copy}
@@ -174,375 +277,254 @@ async def delete_organization(org_id: int):
     if org_id <= 4:
         raise HTTPException(status_code=403, detail="Cannot delete default demo organizations")
     
-    conn = mediconnect_db.get_db()
-    c = conn.cursor()
     try:
-        # We should use transaction manually here
-        c.execute("BEGIN TRANSACTION")
-        c.execute("DELETE FROM users WHERE organization_id = ?", (org_id,))
-        c.execute("DELETE FROM organizations WHERE id = ?", (org_id,))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
+        await async_db.delete_organization(org_id)
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to delete organization")
-    finally:
-        conn.close()
     return {"message": "Organization deleted successfully"}
 
+@router.post("/api/admin/organizations/{org_id}/import")
+async def import_registry(org_id: int, request: Request, format: Optional[str] = None):
+    """Bulk-loads a joining hospital's patients and visits from a streamed CSV or NDJSON body."""
+    fmt = format or ("ndjson" if "json" in request.headers.get("content-type", "") else "csv")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if not any(o["id"] == org_id for o in await async_db.get_all_organizations()):
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    summary = await importer.import_stream(org_id, request.stream(), fmt)
+    # One event for the whole import instead of a NEW_PATIENT per row
+    await manager.broadcast({
+        "type": "PATIENTS_IMPORTED", "organizationId": org_id,
+        "patients": summary["patients"], "visits": summary["visits"]
+    }, realtime.topics(roles=["doctor", "nurse", "admin"]))
+    return JSONResponse(summary)
+
 # --- Patients ---
 @router.get("/api/patients/search")
 async def search_patients(query: str):
-    patients = mediconnect_db.search_patients(query)
-    for p in patients:
-        p["uniqueId"] = p.pop("unique_id", None)
-        p["bloodGroup"] = p.pop("blood_group", None)
-    return patients
+    patients = await async_db.search_patients(query)
+    return JSONResponse(serializers.many(serializers.patient, patients))
 
 @router.post("/api/patients")
 async def create_patient(req: PatientRequest):
     import random
     unique_id = f"PAT-{random.randint(100000, 999999)}"
-    patient = mediconnect_db.create_patient(unique_id, req.name, req.dob, req.gender, req.contact, req.bloodGroup)
-    patient_copy = dict(patient)
-    patient_copy["uniqueId"] = patient_copy.pop("unique_id", None)
-    patient_copy["bloodGroup"] = patient_copy.pop("blood_group", None)
+    patient = await async_db.create_patient(unique_id, req.name, req.dob, req.gender, req.contact, req.bloodGroup)
+    patient_copy = serializers.patient(patient)
     
-    await manager.broadcast({"type": "NEW_PATIENT", "patient": patient_copy})
-    return patient_copy
+    await manager.broadcast({"type": "NEW_PATIENT", "patient": patient_copy}, realtime.topics(roles=["doctor", "nurse", "admin"]))
+    return JSONResponse(patient_copy)
 
 @router.get("/api/patients")
-async def get_all_patients():
-    patients = mediconnect_db.get_all_patients()
-    for p in patients:
-        p["uniqueId"] = p.pop("unique_id", None)
-        p["bloodGroup"] = p.pop("blood_group", None)
-    return patients
+async def get_all_patients(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    return await _page_response(serializers.patient, async_db.get_all_patients, limit, cursor)
 
 @router.put("/api/patients/{patient_id}")
 async def update_patient(patient_id: int, req: PatientRequest):
-    conn = mediconnect_db.get_db()
-    c = conn.cursor()
-    c.execute(
-        "UPDATE patients SET name=?, dob=?, gender=?, contact=?, blood_group=? WHERE id=? RETURNING *",
-        (req.name, req.dob, req.gender, req.contact, req.bloodGroup, patient_id)
-    )
-    patient = c.fetchone()
-    conn.commit()
-    conn.close()
-    
+    patient = await async_db.update_patient(patient_id, req.name, req.dob, req.gender, req.contact, req.bloodGroup)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
         
-    patient_copy = dict(patient)
-    patient_copy["uniqueId"] = patient_copy.pop("unique_id", None)
-    patient_copy["bloodGroup"] = patient_copy.pop("blood_group", None)
-    return patient_copy
+    return JSONResponse(serializers.patient(patient))
 
 @router.delete("/api/patients/{patient_id}")
 async def delete_patient(patient_id: int):
-    conn = mediconnect_db.get_db()
-    c = conn.cursor()
+    patient = await async_db.get_patient_by_id(patient_id)
     try:
-        c.execute("BEGIN TRANSACTION")
-        c.execute("DELETE FROM clinical_actions WHERE patient_id = ?", (patient_id,))
-        c.execute("DELETE FROM clinical_visits WHERE patient_id = ?", (patient_id,))
-        c.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
+        await async_db.delete_patient(patient_id)
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to delete patient")
-    finally:
-        conn.close()
+    care_team_cache.invalidate(patient_id)
+    if patient:
+        # The patient's portal sessions stop authenticating now rather than when their cache entries expire
+        principal_cache.invalidate_user(patient["unique_id"])
     return {"message": "Patient deleted successfully"}
 
 @router.get("/api/patients/{patient_id}")
 async def get_patient(patient_id: int):
-    patient = mediconnect_db.get_patient_by_id(patient_id)
+    patient = await async_db.get_patient_by_id(patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    patient_copy = dict(patient)
-    patient_copy["uniqueId"] = patient_copy.pop("unique_id", None)
-    patient_copy["bloodGroup"] = patient_copy.pop("blood_group", None)
-    return patient_copy
+    return JSONResponse(serializers.patient(patient))
 
 @router.get("/api/patients/{patient_id}/details")
-async def get_patient_details(patient_id: int):
-    details = mediconnect_db.get_patient_details(patient_id)
-    
-    # Format visits
-    visits = []
-    for v in details["visits"]:
-        v_copy = dict(v)
-        v_copy["patientId"] = v_copy.pop("patient_id", None)
-        v_copy["organizationId"] = v_copy.pop("organization_id", None)
-        v_copy["attendedBy"] = v_copy.pop("attended_by", None)
-        if v_copy.get("vitals") and isinstance(v_copy["vitals"], str):
-            v_copy["vitals"] = json.loads(v_copy["vitals"])
-        visits.append({
-            "visit": v_copy,
-            "orgName": v_copy.pop("orgName", None),
-            "staffName": v_copy.pop("staffName", None)
-        })
-        
-    # Format actions
-    flat_actions = []
-    for a in details["actions"]:
-        a_copy = dict(a)
-        if a_copy.get("payload") and isinstance(a_copy["payload"], str):
-            a_copy["payload"] = json.loads(a_copy["payload"])
-            
-        flat_actions.append({
-            "id": a_copy["id"],
-            "patientId": a_copy.pop("patient_id", None),
-            "type": a_copy["type"],
-            "status": a_copy["status"],
-            "description": a_copy["description"],
-            "payload": a_copy.pop("payload", None),
-            "createdAt": a_copy.pop("created_at", None),
-            "updatedAt": a_copy.pop("updated_at", None),
-            "completedAt": a_copy.pop("completed_at", None),
-            "notes": a_copy.get("notes"),
-            "authorName": a_copy.pop("authorName", "Unknown"),
-            "orgName": a_copy.pop("orgName", "Unknown")
-        })
-        
-    return {"visits": visits, "actions": flat_actions}
+async def get_patient_details(patient_id: int, request: Request):
+    async def build(version):
+        # The encoded timeline is cached per patient until the next write to their visits or actions
+        body = timeline_cache.get(patient_id, version)
+        if body is None:
+            details = await async_db.get_patient_details(patient_id)
+            body = serializers.dumps({
+                "visits": serializers.many(serializers.timeline_visit, details["visits"]),
+                "actions": serializers.many(serializers.timeline_action, details["actions"])
+            })
+            timeline_cache.put(patient_id, version, body)
+        return Response(body, media_type=JSONResponse.media_type)
+    return await _conditional(request, "patientDetails", ["visits", "actions"], patient_id, build)
 
 # --- Visits ---
 @router.post("/api/visits")
 async def create_visit(req: VisitRequest):
     now = datetime.utcnow().isoformat()
-    visit = mediconnect_db.create_visit(
+    visit = await async_db.create_visit(
         req.patientId, req.organizationId, now, 
-        req.vitals, req.symptoms, req.priority
+        req.vitals, req.symptoms, req.priority, req.attendedBy or None
     )
-    if req.attendedBy:
-        conn = mediconnect_db.get_db()
-        c = conn.cursor()
-        c.execute("UPDATE clinical_visits SET attended_by = ? WHERE id = ? RETURNING *", (req.attendedBy, visit["id"]))
-        visit = c.fetchone()
-        conn.commit()
-        conn.close()
-        
-    v_copy = dict(visit)
-    v_copy["patientId"] = v_copy.pop("patient_id", None)
-    v_copy["organizationId"] = v_copy.pop("organization_id", None)
-    v_copy["attendedBy"] = v_copy.pop("attended_by", None)
-    if v_copy.get("vitals") and isinstance(v_copy["vitals"], str):
-        v_copy["vitals"] = json.loads(v_copy["vitals"])
-    return v_copy
+    # The latest visit decides who the patient's messages go to
+    care_team_cache.invalidate(req.patientId)
+    return JSONResponse(serializers.visit(visit))
 
 @router.get("/api/visits/active-emergencies")
-async def get_active_emergencies():
-    emergencies = mediconnect_db.get_active_emergencies()
-    results = []
-    for e in emergencies:
-        visit_obj = dict(e)
-        visit_obj["patientId"] = visit_obj.pop("patient_id", None)
-        visit_obj["organizationId"] = visit_obj.pop("organization_id", None)
-        visit_obj["attendedBy"] = visit_obj.pop("attended_by", None)
-        if visit_obj.get("vitals") and isinstance(visit_obj["vitals"], str):
-            visit_obj["vitals"] = json.loads(visit_obj["vitals"])
-            
-        patient_obj = {
-            "id": visit_obj["patientId"],
-            "name": visit_obj.pop("patient_name", None),
-            "uniqueId": visit_obj.pop("unique_id", None)
-        }
-        
-        results.append({
-            "visit": visit_obj,
-            "patient": patient_obj,
-            "attendedBy": visit_obj.pop("attended_by_name", None)
-        })
-    return results
+async def get_active_emergencies(priority: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    return await _page_response(serializers.emergency, async_db.get_active_emergencies, _split(priority), limit, cursor)
 
 @router.patch("/api/visits/{visit_id}")
 async def patch_visit(visit_id: int, req: VisitPatchRequest):
-    visit = mediconnect_db.update_visit(visit_id, req.diagnosis, req.symptoms, req.priority)
+    visit = await async_db.update_visit(visit_id, req.diagnosis, req.symptoms, req.priority)
     if not visit:
         raise HTTPException(status_code=404, detail="Visit not found")
         
-    v_copy = dict(visit)
-    v_copy["patientId"] = v_copy.pop("patient_id", None)
-    v_copy["organizationId"] = v_copy.pop("organization_id", None)
-    v_copy["attendedBy"] = v_copy.pop("attended_by", None)
-    if v_copy.get("vitals") and isinstance(v_copy["vitals"], str):
-        v_copy["vitals"] = json.loads(v_copy["vitals"])
-        
-    await manager.broadcast({"type": "UPDATE_VISIT", "visit": v_copy})
-    return v_copy
+    v_copy = serializers.visit(visit)
+    await manager.broadcast({"type": "UPDATE_VISIT", "visit": v_copy}, realtime.topics(v_copy["organizationId"], patient_id=v_copy["patientId"]))
+    return JSONResponse(v_copy)
 
 # --- Actions ---
 @router.post("/api/actions")
 async def create_action(req: ActionRequest):
-    action = mediconnect_db.create_action(
+    action = await async_db.create_action(
         req.patientId, req.visitId, req.authorId, req.fromOrganizationId,
-        req.type, req.description, req.payload
+        req.type, req.description, req.payload, req.notes or None
     )
-    if req.notes:
-        conn = mediconnect_db.get_db()
-        c = conn.cursor()
-        c.execute("UPDATE clinical_actions SET notes = ? WHERE id = ? RETURNING *", (req.notes, action["id"]))
-        action = c.fetchone()
-        conn.commit()
-        conn.close()
-        
-    a_copy = dict(action)
-    a_copy["patientId"] = a_copy.pop("patient_id", None)
-    a_copy["visitId"] = a_copy.pop("visit_id", None)
-    a_copy["authorId"] = a_copy.pop("author_id", None)
-    a_copy["fromOrganizationId"] = a_copy.pop("from_organization_id", None)
-    a_copy["createdAt"] = a_copy.pop("created_at", None)
-    a_copy["updatedAt"] = a_copy.pop("updated_at", None)
-    a_copy["completedAt"] = a_copy.pop("completed_at", None)
-    a_copy["completedBy"] = a_copy.pop("completed_by", None)
-    a_copy["completedByOrganizationId"] = a_copy.pop("completed_by_organization_id", None)
-    if a_copy.get("payload") and isinstance(a_copy["payload"], str):
-        a_copy["payload"] = json.loads(a_copy["payload"])
-        
-    await manager.broadcast({"type": "NEW_ACTION", "action": a_copy})
-    return a_copy
+    a_copy = serializers.action(action)
+    await manager.broadcast({"type": "NEW_ACTION", "action": a_copy}, realtime.action_topics(a_copy))
+    return JSONResponse(a_copy)
 
 @router.patch("/api/actions/{action_id}")
 async def patch_action(action_id: int, req: ActionPatchRequest):
-    action = mediconnect_db.update_action(
+    action = await async_db.update_action(
         action_id, req.status, req.notes, req.completedBy, req.completedByOrganizationId
     )
     if not action:
         raise HTTPException(status_code=404, detail="Action not found")
         
-    a_copy = dict(action)
-    a_copy["patientId"] = a_copy.pop("patient_id", None)
-    a_copy["visitId"] = a_copy.pop("visit_id", None)
-    a_copy["authorId"] = a_copy.pop("author_id", None)
-    a_copy["fromOrganizationId"] = a_copy.pop("from_organization_id", None)
-    a_copy["createdAt"] = a_copy.pop("created_at", None)
-    a_copy["updatedAt"] = a_copy.pop("updated_at", None)
-    a_copy["completedAt"] = a_copy.pop("completed_at", None)
-    a_copy["completedBy"] = a_copy.pop("completed_by", None)
-    a_copy["completedByOrganizationId"] = a_copy.pop("completed_by_organization_id", None)
-    if a_copy.get("payload") and isinstance(a_copy["payload"], str):
-        a_copy["payload"] = json.loads(a_copy["payload"])
-        
-    await manager.broadcast({"type": "UPDATE_ACTION", "action": a_copy})
-    return a_copy
+    a_copy = serializers.action(action)
+    await manager.broadcast({"type": "UPDATE_ACTION", "action": a_copy}, realtime.action_topics(a_copy))
+    return JSONResponse(a_copy)
 
 # --- Departments ---
 @router.get("/api/departments/{role}/queue")
-async def get_department_queue(role: str):
-    actions = mediconnect_db.get_department_queue([role])
-    flat = []
-    for a in actions:
-        a_copy = dict(a)
-        if a_copy.get("payload") and isinstance(a_copy["payload"], str):
-            a_copy["payload"] = json.loads(a_copy["payload"])
-            
-        flat.append({
-            "id": a_copy["id"],
-            "patientId": a_copy.pop("patient_id", None),
-            "type": a_copy["type"],
-            "status": a_copy["status"],
-            "description": a_copy["description"],
-            "payload": a_copy.pop("payload", None),
-            "createdAt": a_copy.pop("created_at", None),
-            "updatedAt": a_copy.pop("updated_at", None),
-            "completedAt": a_copy.pop("completed_at", None),
-            "notes": a_copy.get("notes"),
-            "patientName": a_copy.pop("patientName", "Unknown"),
-            "uniqueId": a_copy.pop("uniqueId", "N/A"),
-            "authorName": a_copy.pop("authorName", "Unknown"),
-            "orgName": a_copy.pop("orgName", "Unknown")
-        })
-    return flat
+async def get_department_queue(role: str, request: Request, status: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
+    # Queue rows show patient names, so patient edits change the queue too
+    return await _conditional(request, "departmentQueue", ["actions", "patients"], None, lambda version: _page_response(
+        serializers.queue_action, async_db.get_department_queue, [role], _split(status), limit, cursor))
 
 # --- Transfers ---
 @router.post("/api/transfers")
 async def create_transfer(req: TransferRequest):
-    payload = {"targetOrgId": req.targetOrgId}
-    action = mediconnect_db.create_action(
+    # The receiving hospital pulls the full record from exportUrl and applies it with /api/transfers/import
+    payload = {"targetOrgId": req.targetOrgId, "exportUrl": f"/api/patients/{req.patientId}/export"}
+    action = await async_db.create_action(
         req.patientId, None, req.authorId, req.fromOrgId,
-        "transfer", "Patient Transfer Request", payload
+        "transfer", "Patient Transfer Request", payload, req.notes or None
+    )
+    a_copy = serializers.action(action)
+    await manager.broadcast({"type": "NEW_ACTION", "action": a_copy}, realtime.action_topics(a_copy))
+    return JSONResponse(a_copy)
+
+@router.get("/api/patients/{patient_id}/export")
+async def export_patient(patient_id: int, format: str = "ndjson"):
+    """Streams the patient's full record as a transfer bundle (see transfer.py); format=gzip compresses it."""
+    if format not in ("ndjson", "gzip"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or gzip")
+    patient = await async_db.get_patient_by_id(patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    compress = format == "gzip"
+    filename = f"{patient['unique_id']}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        transfer.export_bundle(patient_id, compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
-    if req.notes:
-        conn = mediconnect_db.get_db()
-        c = conn.cursor()
-        c.execute("UPDATE clinical_actions SET notes = ? WHERE id = ? RETURNING *", (req.notes, action["id"]))
-        action = c.fetchone()
-        conn.commit()
-        conn.close()
-        
-    a_copy = dict(action)
-    a_copy["patientId"] = a_copy.pop("patient_id", None)
-    a_copy["visitId"] = a_copy.pop("visit_id", None)
-    a_copy["authorId"] = a_copy.pop("author_id", None)
-    a_copy["fromOrganizationId"] = a_copy.pop("from_organization_id", None)
-    a_copy["createdAt"] = a_copy.pop("created_at", None)
-    a_copy["updatedAt"] = a_copy.pop("updated_at", None)
-    a_copy["completedAt"] = a_copy.pop("completed_at", None)
-    a_copy["completedBy"] = a_copy.pop("completed_by", None)
-    a_copy["completedByOrganizationId"] = a_copy.pop("completed_by_organization_id", None)
-    if a_copy.get("payload") and isinstance(a_copy["payload"], str):
-        a_copy["payload"] = json.loads(a_copy["payload"])
-        
-    await manager.broadcast({"type": "NEW_ACTION", "action": a_copy})
-    return a_copy
+
+@router.post("/api/transfers/import")
+async def import_transfer(organizationId: int, authorId: int, request: Request):
+    """Applies a transfer bundle, plain or gzipped, at the receiving organization in one transaction."""
+    try:
+        result = await transfer.import_bundle(organizationId, authorId, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BundleAlreadyImported:
+        raise HTTPException(status_code=409, detail="This transfer bundle has already been imported")
+    except sqlite3.IntegrityError as e:
+        # A record the checks in read_bundle let through, but the schema does not
+        raise HTTPException(status_code=400, detail=f"Bundle has an invalid record: {e}")
+    result["patient"] = serializers.patient(result["patient"])
+    care_team_cache.invalidate(result["patient"]["id"])
+    if result["createdPatient"]:
+        await manager.broadcast({"type": "NEW_PATIENT", "patient": result["patient"]}, realtime.topics(roles=["doctor", "nurse", "admin"]))
+    return JSONResponse(result)
+
+# --- Sync ---
+@router.get("/api/sync")
+async def sync(since: Optional[str] = None, tables: Optional[str] = None, patientId: Optional[int] = None):
+    """Rows changed since `since` (patients, visits, actions, messages), plus the cursor to send next time."""
+    try:
+        return JSONResponse(await _changes(since, tables, patientId))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # --- Stats ---
 @router.get("/api/stats")
-async def get_stats():
-    return mediconnect_db.get_stats()
+async def get_stats(request: Request, organizationId: Optional[int] = None, breakdown: bool = False):
+    async def build(version):
+        return JSONResponse(await async_db.get_stats(organizationId, breakdown))
+    return await _conditional(request, "stats", ["patients", "visits", "actions", STATS_VERSION_TABLE], None, build)
+
+@router.get("/api/admin/metrics")
+async def get_metrics():
+    return JSONResponse({
+        "writer": async_db.get_writer_metrics(),
+        "websocket": manager.snapshot(),
+        "conditionalGet": conditional_metrics.snapshot(),
+        "timelineCache": timeline_cache.snapshot(),
+        "careTeamCache": care_team_cache.snapshot(),
+        "archiver": archiver.snapshot(),
+        "passwordHashing": hasher.snapshot(),
+        "principalCache": principal_cache.snapshot(),
+        "metricWrites": metric_writer.snapshot(),
+        "trendsCache": downsampled_cache.snapshot()
+    })
 
 # --- Messages ---
 @router.get("/api/messages/{patient_id}")
-async def get_messages(patient_id: int):
-    messages = mediconnect_db.get_messages_by_patient(patient_id)
-    return messages
+async def get_messages(patient_id: int, request: Request):
+    async def build(version):
+        return JSONResponse(await async_db.get_messages_by_patient(patient_id))
+    return await _conditional(request, "patientMessages", ["messages"], patient_id, build)
 
 @router.post("/api/messages")
 async def send_message(req: MessageRequest):
     doctor_id = req.doctorId
     # If doctor_id is not provided, infer from the patient's latest visit
     if not doctor_id:
-        conn = mediconnect_db.get_db()
-        conn.row_factory = mediconnect_db.dict_factory
-        c = conn.cursor()
-        # Get the attending staff from the latest visit
-        c.execute(
-            "SELECT attended_by, organization_id FROM clinical_visits WHERE patient_id = ? ORDER BY id DESC LIMIT 1",
-            (req.patientId,)
-        )
-        row = c.fetchone()
-        if row and row.get("attended_by"):
-            # Check if the attended_by user is actually a doctor
-            c.execute("SELECT id, role, organization_id FROM users WHERE id = ?", (row["attended_by"],))
-            staff = c.fetchone()
-            if staff and staff["role"] == "doctor":
-                doctor_id = staff["id"]
-            else:
-                # Find a doctor in the same organization
-                org_id = row.get("organization_id") or (staff["organization_id"] if staff else None)
-                if org_id:
-                    c.execute("SELECT id FROM users WHERE role = 'doctor' AND organization_id = ? LIMIT 1", (org_id,))
-                    doc = c.fetchone()
-                    doctor_id = doc["id"] if doc else None
-        if not doctor_id:
-            # Ultimate fallback: first doctor in the system
-            c.execute("SELECT id FROM users WHERE role = 'doctor' LIMIT 1")
-            doc = c.fetchone()
-            doctor_id = doc["id"] if doc else 1
-        conn.close()
-
-    msg = mediconnect_db.create_message(req.patientId, doctor_id, req.sender, req.content)
-    await manager.broadcast({"type": "NEW_MESSAGE", "message": msg})
-    return msg
+        doctor_id = care_team_cache.get(req.patientId)
+        if doctor_id is None:
+            doctor_id = await async_db.find_doctor_for_patient(req.patientId)
+            care_team_cache.put(req.patientId, doctor_id)
+
+    msg = await async_db.create_message(req.patientId, doctor_id, req.sender, req.content)
+    await manager.broadcast({"type": "NEW_MESSAGE", "message": msg}, realtime.topics(patient_id=msg["patient_id"], doctor_id=msg["doctor_id"]))
+    return JSONResponse(msg)
 
 @router.post("/api/messages/read")
 async def mark_read(patientId: int, doctorId: int, reader: str):
-    mediconnect_db.mark_messages_read(patientId, doctorId, reader)
+    await async_db.mark_messages_read(patientId, doctorId, reader)
     return {"status": "ok"}
 
 @router.get("/api/doctor/messages")
-async def get_doctor_messages(doctorId: int):
-    messages = mediconnect_db.get_messages_for_doctor(doctorId)
-    return messages
+async def get_doctor_messages(doctorId: int, request: Request):
+    async def build(version):
+        return JSONResponse(await async_db.get_messages_for_doctor(doctorId))
+    return await _conditional(request, "doctorInbox", ["messages", "patients"], None, build)
@@ -0,0 +1,132 @@
+"""
+Background hot/cold archival for mediconnect.db.
+
+Completed and cancelled actions, and visits with none of their actions
+left, move to an attached archive database (mediconnect_archive.db) once
+they are older than ARCHIVE_AFTER_DAYS. Queue and stats queries then only
+walk recent data. get_patient_details reads the `all_visits` and
+`all_actions` views, so a patient's timeline still shows everything.
+
+Each batch is copied to the archive and committed first. The hot rows are
+then deleted in a second transaction, so a crash in between leaves a row
+in both files, never in neither. Deleted patients are purged the same way:
+delete_patient only removes the patient row, takes their visits and
+actions out of the stats and records a tombstone, and the archiver deletes
+those rows a batch at a time. It purges deleted patients even when
+archiving is disabled. After every pass, freed pages are handed back with
+PRAGMA incremental_vacuum.
+
+    python -m app.mediconnect.archive [--older-than DAYS] [--enable-incremental-vacuum]
+
+runs a single pass; the app runs one every ARCHIVE_INTERVAL seconds.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from app.mediconnect import database as mediconnect_db
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("MEDICONNECT_ARCHIVE_AFTER_DAYS", "180"))  # 0 disables archiving (not the purge)
+ARCHIVE_INTERVAL = 600  # seconds between passes
+VACUUM_PAGES = 2000  # pages returned to the OS per pass, per file
+
+# Actions first: a visit is only eligible once its actions have moved
+ARCHIVE_ORDER = ("clinical_actions", "clinical_visits")
+
+
+class Archiver:
+    def __init__(self, after_days: int = ARCHIVE_AFTER_DAYS, interval: float = ARCHIVE_INTERVAL,
+                 batch: int = mediconnect_db.ARCHIVE_BATCH, vacuum_pages: int = VACUUM_PAGES):
+        self.after_days = after_days
+        self.interval = interval
+        self.batch = batch
+        self.vacuum_pages = vacuum_pages
+        self.counters = {"passes": 0, "archivedActions": 0, "archivedVisits": 0, "purgedRows": 0, "vacuumedPages": 0}
+        self.last_pass_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> Dict[str, int]:
+        """One full pass: archive everything eligible (unless after_days is 0), purge deleted patients, vacuum. Returns rows moved per kind."""
+        start = time.perf_counter()
+        cutoff = (datetime.utcnow() - timedelta(days=self.after_days)).isoformat()
+        moved = {"clinical_actions": 0, "clinical_visits": 0, "purged": 0}
+        for table in ARCHIVE_ORDER if self.after_days > 0 else ():
+            after = None
+            while not self._stop.is_set():
+                ids, after = mediconnect_db.find_archivable(table, cutoff, after, self.batch)
+                if not ids:
+                    break
+                mediconnect_db.copy_to_archive(table, ids, cutoff)
+                moved[table] += mediconnect_db.purge_archived(table, ids, cutoff)
+        for patient_id in mediconnect_db.get_deleted_patients():
+            while not self._stop.is_set():
+                purged = mediconnect_db.purge_deleted_patient(patient_id, self.batch)
+                if not purged:
+                    break
+                moved["purged"] += purged
+        self.counters["passes"] += 1
+        self.counters["archivedActions"] += moved["clinical_actions"]
+        self.counters["archivedVisits"] += moved["clinical_visits"]
+        self.counters["purgedRows"] += moved["purged"]
+        self.counters["vacuumedPages"] += mediconnect_db.incremental_vacuum(self.vacuum_pages)
+        self.last_pass_ms = round((time.perf_counter() - start) * 1000, 1)
+        return moved
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mediconnect-archiver", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": self._thread is not None,
+            "afterDays": self.after_days,
+            **self.counters,
+            "lastPassMs": self.last_pass_ms,
+            "lastError": self.last_error,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                # Keep archiving on the next pass; a failed batch leaves its rows where they were
+                self.last_error = f"{type(e).__name__}: {e}"
+            self._stop.wait(self.interval)
+
+
+archiver = Archiver()
+
+
+def enable_incremental_vacuum():
+    """Switches existing database files to auto_vacuum=INCREMENTAL. Rewrites each file, so run it offline."""
+    for path in (mediconnect_db.DATABASE_URL, mediconnect_db.archive_path(mediconnect_db.DATABASE_URL)):
+        conn = mediconnect_db.connect(path, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    mediconnect_db.init_db()
+    if "--enable-incremental-vacuum" in sys.argv:
+        enable_incremental_vacuum()
+        print("Enabled incremental vacuum on mediconnect.db and its archive.")
+    days = int(sys.argv[sys.argv.index("--older-than") + 1]) if "--older-than" in sys.argv else ARCHIVE_AFTER_DAYS
+    moved = Archiver(after_days=days).run_once()
+    print(f"Archived {moved['clinical_actions']} actions and {moved['clinical_visits']} visits older than {days} days; "
+          f"purged {moved['purged']} rows of deleted patients.")
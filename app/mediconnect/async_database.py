@@ -0,0 +1,92 @@
+"""
+Awaitable access to the MediConnect database.
+
+The functions in `database` are blocking sqlite3 calls. Calling them from an
+`async def` route stalls the event loop, and every WebSocket with it, for as
+long as the query runs. This module exposes the same functions as coroutines:
+reads run on a bounded pool of reader threads (WAL lets them proceed while a
+write is in flight) and writes are queued to the database's group-commit
+writer thread, so writers never contend for SQLite's single write lock.
+
+    from app.mediconnect import async_database as async_db
+    patient = await async_db.get_patient_by_id(patient_id)
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from app.mediconnect import database as mediconnect_db
+
+READER_THREADS = int(os.getenv("MEDICONNECT_READER_THREADS", "4"))
+
+_read_pool = ThreadPoolExecutor(max_workers=READER_THREADS, thread_name_prefix="mediconnect-reader")
+
+def _reader(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Look the function up at call time so patches to `database` are honoured
+        target = getattr(mediconnect_db, fn.__name__)
+        return await loop.run_in_executor(_read_pool, functools.partial(target, *args, **kwargs))
+    return wrapper
+
+def _writer(fn):
+    intent = fn.intent
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.wrap_future(mediconnect_db.get_writer().submit(intent, *args, **kwargs))
+    return wrapper
+
+def get_writer_metrics():
+    return mediconnect_db.get_writer().metrics.snapshot()
+
+# --- Messages ---
+create_message = _writer(mediconnect_db.create_message)
+get_messages_by_patient = _reader(mediconnect_db.get_messages_by_patient)
+get_messages_for_doctor = _reader(mediconnect_db.get_messages_for_doctor)
+mark_messages_read = _writer(mediconnect_db.mark_messages_read)
+find_doctor_for_patient = _reader(mediconnect_db.find_doctor_for_patient)
+
+# --- Organizations ---
+create_organization = _writer(mediconnect_db.create_organization)
+get_organization_by_code = _reader(mediconnect_db.get_organization_by_code)
+get_all_organizations = _reader(mediconnect_db.get_all_organizations)
+delete_organization = _writer(mediconnect_db.delete_organization)
+
+# --- Users ---
+create_user = _writer(mediconnect_db.create_user)
+get_user_by_credentials = _reader(mediconnect_db.get_user_by_credentials)
+get_staff_by_org = _reader(mediconnect_db.get_staff_by_org)
+
+# --- Patients ---
+create_patient = _writer(mediconnect_db.create_patient)
+search_patients = _reader(mediconnect_db.search_patients)
+get_patient_by_unique_id = _reader(mediconnect_db.get_patient_by_unique_id)
+get_patient_by_id = _reader(mediconnect_db.get_patient_by_id)
+get_all_patients = _reader(mediconnect_db.get_all_patients)
+update_patient = _writer(mediconnect_db.update_patient)
+delete_patient = _writer(mediconnect_db.delete_patient)
+
+# --- Visits ---
+create_visit = _writer(mediconnect_db.create_visit)
+update_visit = _writer(mediconnect_db.update_visit)
+get_active_emergencies = _reader(mediconnect_db.get_active_emergencies)
+get_patient_details = _reader(mediconnect_db.get_patient_details)
+
+# --- Actions ---
+create_action = _writer(mediconnect_db.create_action)
+update_action = _writer(mediconnect_db.update_action)
+get_department_queue = _reader(mediconnect_db.get_department_queue)
+get_stats = _reader(mediconnect_db.get_stats)
+check_stats = _writer(mediconnect_db.check_stats)
+
+# --- Bulk import ---
+import_records = _writer(mediconnect_db.import_records)
+
+# --- Transfer bundles ---
+apply_transfer_bundle = _writer(mediconnect_db.apply_transfer_bundle)
+
+# --- Delta sync ---
+get_changes = _reader(mediconnect_db.get_changes)
+get_version = _reader(mediconnect_db.get_version)
@@ -0,0 +1,1014 @@
+"""
+Throughput benchmarks for the MediConnect API.
+
+Runs the route handlers directly against a throwaway, seeded SQLite file so
+the numbers reflect database and serialization cost rather than HTTP
+overhead. Usage:
+
+    python -m app.mediconnect.bench [--patients N] [--requests N] [--search-patients N] [--inbox-messages N]
+
+Use --search-patients 5000000 for the full-size patient search benchmark and
+--inbox-messages 10000000 for the full-size doctor inbox benchmark.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse as StarletteJSONResponse
+
+from app.mediconnect import database as mediconnect_db
+from app.mediconnect import async_database as async_db
+from app.mediconnect import api as mediconnect_api
+from app.mediconnect import events, importer, serializers, transfer
+from app.mediconnect.cache import TTLCache, VersionedLRU
+
+ACTION_TYPES = ["prescription", "lab_test", "radiology", "procedure", "observation", "transfer"]
+ACTION_STATUSES = ["pending", "in_progress", "completed", "completed", "completed", "cancelled"]
+
+
+def seed(path, patients=2000, visits_per_patient=3, actions_per_visit=2, messages_per_patient=4):
+    """Creates a database at `path` with a synthetic, realistically skewed workload."""
+    mediconnect_db.DATABASE_URL = path
+    mediconnect_db.init_db()
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("INSERT INTO organizations (name, type, code, address) VALUES ('Bench Hospital', 'hospital', 'BENCH', NULL)")
+    org_id = c.lastrowid
+    c.executemany(
+        "INSERT INTO users (organization_id, employee_id, name, role, password) VALUES (?, ?, ?, ?, 'password')",
+        [(org_id, f"{role[:3].upper()}{i:03d}", f"{role} {i}", role)
+         for role in ("doctor", "nurse", "pharmacy", "diagnostic") for i in range(5)]
+    )
+    c.execute("SELECT id FROM users WHERE role = 'doctor'")
+    doctors = [r[0] for r in c.fetchall()]
+
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    for p in range(patients):
+        c.execute(
+            "INSERT INTO patients (unique_id, name, dob, gender, contact, blood_group) VALUES (?, ?, '1980-01-01', 'Female', ?, 'O+')",
+            (f"PAT-{p:07d}", f"Patient {p}", f"+1555{p:07d}")
+        )
+        patient_id = c.lastrowid
+        for v in range(visits_per_patient):
+            ts = (start + timedelta(minutes=rng.randint(0, 500000))).isoformat()
+            c.execute(
+                "INSERT INTO clinical_visits (patient_id, organization_id, date, vitals, symptoms, priority, attended_by) VALUES (?, ?, ?, ?, 'cough', ?, ?)",
+                (patient_id, org_id, ts, json.dumps({"bp": "120/80", "pulse": 72}),
+                 rng.choice(["normal"] * 8 + ["emergency", "critical"]), rng.choice(doctors))
+            )
+            visit_id = c.lastrowid
+            c.executemany(
+                '''INSERT INTO clinical_actions
+                   (patient_id, visit_id, author_id, from_organization_id, type, status, description, payload, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, 'bench action', ?, ?, ?)''',
+                [(patient_id, visit_id, doctors[0], org_id, rng.choice(ACTION_TYPES), rng.choice(ACTION_STATUSES),
+                  json.dumps({"dose": "5mg"}), ts, ts) for _ in range(actions_per_visit)]
+            )
+        c.executemany(
+            "INSERT INTO messages (patient_id, doctor_id, sender, content, created_at) VALUES (?, ?, ?, 'hello', ?)",
+            [(patient_id, doctors[p % len(doctors)], rng.choice(["patient", "doctor"]),
+              (start + timedelta(minutes=rng.randint(0, 500000))).isoformat() + "Z") for _ in range(messages_per_patient)]
+        )
+    conn.commit()
+    conn.close()
+    return {"org_id": org_id, "doctors": doctors, "patients": patients}
+
+
+def _unpooled_get_db():
+    """The original connection path: a fresh, untuned connection per call."""
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    conn.row_factory = mediconnect_db.dict_factory
+    return conn
+
+
+def _request(etag=None):
+    """A bare GET request, optionally conditional on `etag`."""
+    headers = [(b"if-none-match", etag.encode("latin-1"))] if etag else []
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+def hot_endpoints(ctx):
+    """(label, coroutine factory) pairs for the endpoints the dashboards hit hardest."""
+    rng = random.Random(7)
+    pick = lambda: rng.randint(1, ctx["patients"])
+    return [
+        ("GET  /api/departments/pharmacy/queue", lambda: mediconnect_api.get_department_queue("pharmacy", _request(), "pending,in_progress")),
+        ("GET  /api/patients/{id}/details", lambda: mediconnect_api.get_patient_details(pick(), _request())),
+        ("GET  /api/messages/{patient_id}", lambda: mediconnect_api.get_messages(pick(), _request())),
+        ("GET  /api/doctor/messages", lambda: mediconnect_api.get_doctor_messages(ctx["doctors"][0], _request())),
+        ("GET  /api/stats", lambda: mediconnect_api.get_stats(_request())),
+        ("POST /api/messages", lambda: mediconnect_api.send_message(
+            mediconnect_api.MessageRequest(patientId=pick(), sender="patient", content="bench"))),
+    ]
+
+
+async def _run(factory, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        await factory()
+    return requests / (time.perf_counter() - start)
+
+
+def run(requests, ctx, label):
+    results = {}
+    for name, factory in hot_endpoints(ctx):
+        results[name] = asyncio.run(_run(factory, requests))
+    print(f"\n{label}")
+    for name, rps in results.items():
+        print(f"  {name:<40} {rps:>10.1f} req/s")
+    return results
+
+
+def bench_connection_pool(requests, ctx):
+    """Compares the original per-call connection against the pooled, pragma-tuned one."""
+    pooled_get_db = mediconnect_db.get_db
+    mediconnect_db.get_db = _unpooled_get_db
+    try:
+        before = run(requests, ctx, "Before: new connection per call")
+    finally:
+        mediconnect_db.get_db = pooled_get_db
+    after = run(requests, ctx, "After: pooled connections (WAL, synchronous=NORMAL, mmap)")
+    print("\n  Speedup")
+    for name in before:
+        print(f"  {name:<40} {after[name] / before[name]:>9.2f}x")
+
+
+async def _load(db, ctx, pollers, writers, seconds):
+    """Dashboard pollers and message writers sharing one event loop, as in the server."""
+    rng = random.Random(11)
+    counts = {"reads": 0, "writes": 0}
+    max_stall = 0.0
+    deadline = time.perf_counter() + seconds
+
+    async def call(fn, *args):
+        result = fn(*args)
+        return await result if asyncio.iscoroutine(result) else result
+
+    async def poller():
+        while time.perf_counter() < deadline:
+            await call(db.get_department_queue, ["nurse"], ["pending", "in_progress"])
+            await call(db.get_patient_details, rng.randint(1, ctx["patients"]))
+            counts["reads"] += 2
+            await asyncio.sleep(0)
+
+    async def writer():
+        while time.perf_counter() < deadline:
+            await call(db.create_message, rng.randint(1, ctx["patients"]), ctx["doctors"][0], "patient", "load")
+            counts["writes"] += 1
+            await asyncio.sleep(0)
+
+    async def heartbeat():
+        # Stands in for a WebSocket: measures how long the loop goes without servicing it
+        nonlocal max_stall
+        while time.perf_counter() < deadline:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - tick - 0.001)
+
+    await asyncio.gather(heartbeat(), *[poller() for _ in range(pollers)], *[writer() for _ in range(writers)])
+    return counts["reads"] / seconds, counts["writes"] / seconds, max_stall * 1000
+
+
+def bench_async_access(ctx, seconds=3.0):
+    """Blocking calls on the event loop vs. the reader pool + single writer thread."""
+    print("\nConcurrent dashboard polling + writes (reads/s, writes/s, worst event-loop stall)")
+    for pollers, writers in [(1, 1), (4, 2), (16, 4)]:
+        for label, db in [("blocking", mediconnect_db), ("async", async_db)]:
+            reads, writes, stall = asyncio.run(_load(db, ctx, pollers, writers, seconds))
+            print(f"  {pollers:>2} pollers / {writers} writers  {label:<8} {reads:>9.1f} {writes:>9.1f} {stall:>9.1f} ms")
+
+
+def bench_group_commit(ctx, burst=2000):
+    """A burst of concurrent writes, as during a shift-change rush, through the group-commit writer."""
+    writer = mediconnect_db.get_writer()
+    before = writer.metrics.snapshot()
+
+    async def burst_writes():
+        rng = random.Random(5)
+        await asyncio.gather(*[
+            async_db.create_message(rng.randint(1, ctx["patients"]), ctx["doctors"][0], "doctor", "burst")
+            for _ in range(burst)
+        ])
+
+    start = time.perf_counter()
+    asyncio.run(burst_writes())
+    elapsed = time.perf_counter() - start
+    after = writer.metrics.snapshot()
+    batches = after["batches"] - before["batches"]
+    print(f"\nGroup commit: {burst} concurrent writes in {elapsed:.2f}s ({burst / elapsed:.0f} writes/s)")
+    print(f"  commits: {batches}, avg batch: {burst / max(batches, 1):.1f}, max batch: {after['maxBatchSize']}, "
+          f"commit latency p50/p99: {after['commitLatencyMs']['p50']}/{after['commitLatencyMs']['p99']} ms")
+
+
+FIRST_NAMES = ["John", "Emily", "Priya", "Rahul", "Sarah", "Mike", "Ananya", "Wei", "Fatima", "Carlos"]
+LAST_NAMES = ["Smith", "Davis", "Sharma", "Chen", "Patel", "Ross", "Reddy", "Garcia", "Khan", "Iyer"]
+
+
+def seed_patients(path, count, chunk=50000):
+    """A patients-only registry of `count` rows, for search benchmarks."""
+    mediconnect_db.DATABASE_URL = path
+    mediconnect_db.init_db()
+    conn = sqlite3.connect(path)
+    rng = random.Random(3)
+    for start in range(0, count, chunk):
+        conn.executemany(
+            "INSERT INTO patients (unique_id, name, dob, gender, contact, blood_group) VALUES (?, ?, '1990-01-01', 'Male', ?, 'B+')",
+            [(f"PAT-{i:08d}", f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{i % 997}", f"+91{rng.randint(10**9, 10**10 - 1)}")
+             for i in range(start, min(start + chunk, count))]
+        )
+        conn.commit()
+    conn.close()
+
+
+def _legacy_search(query):
+    """The original full-scan search, kept for comparison."""
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    like_q = f"%{query}%"
+    rows = conn.execute(
+        "SELECT * FROM patients WHERE unique_id = ? OR name LIKE ? OR unique_id LIKE ?", (query, like_q, like_q)
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def bench_patient_search(count, repeat=20):
+    """Legacy LIKE scan vs. the exact-ID fast path and the FTS5 trigram index."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        start = time.perf_counter()
+        seed_patients(path, count)
+        print(f"\nPatient search over {count} patients (seeded in {time.perf_counter() - start:.1f}s)")
+        queries = [("exact unique_id", f"PAT-{count // 2:08d}"), ("name substring", "Sharma12"),
+                   ("contact substring", "98765"), ("rare miss", "Zyxw")]
+        for label, query in queries:
+            timings = {}
+            for name, fn in [("legacy LIKE", _legacy_search), ("indexed", mediconnect_db.search_patients)]:
+                t = time.perf_counter()
+                for _ in range(repeat):
+                    fn(query)
+                timings[name] = (time.perf_counter() - t) / repeat * 1000
+            print(f"  {label:<18} legacy {timings['legacy LIKE']:>9.2f} ms   indexed {timings['indexed']:>7.2f} ms")
+
+
+def seed_messages(path, count, per_thread=50, doctors=50, chunk=100000):
+    """`count` messages in threads of about `per_thread`, spread over `doctors` doctors, for inbox benchmarks."""
+    patients = max(1, count // per_thread)
+    seed_patients(path, patients)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO organizations (name, type, code, address) VALUES ('Inbox Hospital', 'hospital', 'INBOX', NULL)")
+    conn.executemany(
+        "INSERT INTO users (organization_id, employee_id, name, role, password) VALUES (1, ?, ?, 'doctor', 'password')",
+        [(f"DOC{i:03d}", f"doctor {i}") for i in range(doctors)]
+    )
+    rng = random.Random(17)
+    start = datetime(2024, 1, 1)
+    for offset in range(0, count, chunk):
+        conn.executemany(
+            "INSERT INTO messages (patient_id, doctor_id, sender, content, created_at, is_read) VALUES (?, ?, ?, 'how are you feeling today?', ?, ?)",
+            [(patient_id, patient_id % doctors + 1, rng.choice(("patient", "doctor")),
+              (start + timedelta(seconds=i * 3)).isoformat() + "Z", rng.random() < 0.9)
+             for i in range(offset, min(offset + chunk, count)) for patient_id in (rng.randint(1, patients),)]
+        )
+        conn.commit()
+    conn.close()
+    return patients, doctors
+
+
+def _legacy_inbox(doctor_id):
+    """The original inbox query: latest message id per patient, sorted on a parsed timestamp."""
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    rows = conn.execute('''
+        SELECT m.*, p.name as patient_name, p.unique_id as patient_unique_id
+        FROM messages m
+        JOIN patients p ON m.patient_id = p.id
+        WHERE m.id IN (SELECT MAX(id) FROM messages WHERE doctor_id = ? GROUP BY patient_id)
+        ORDER BY datetime(m.created_at) DESC
+    ''', (doctor_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+def _legacy_mark_read(patient_id, doctor_id):
+    """The original read mark, which rewrites every patient message in the thread."""
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    conn.execute("UPDATE messages SET is_read = 1 WHERE patient_id = ? AND doctor_id = ? AND sender = 'patient'", (patient_id, doctor_id))
+    conn.commit()
+    conn.close()
+
+
+def bench_doctor_inbox(count, repeat=20):
+    """Doctor inbox and read marks over `count` messages: scanning messages vs. the conversations table."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inbox.db")
+        start = time.perf_counter()
+        patients, doctors = seed_messages(path, count)
+        print(f"\nDoctor inbox over {count} messages, {patients} threads, {doctors} doctors (seeded in {time.perf_counter() - start:.1f}s)")
+        rng = random.Random(19)
+        threads = [(p, p % doctors + 1) for p in (rng.randint(1, patients) for _ in range(repeat))]
+        cases = [
+            ("inbox", lambda t: _legacy_inbox(t[1]), lambda t: mediconnect_db.get_messages_for_doctor(t[1])),
+            ("mark thread read", lambda t: _legacy_mark_read(*t), lambda t: mediconnect_db.mark_messages_read(t[0], t[1], "doctor")),
+        ]
+        for label, legacy, current in cases:
+            timings = {}
+            for name, fn in [("legacy", legacy), ("conversations", current)]:
+                t = time.perf_counter()
+                for thread in threads:
+                    fn(thread)
+                timings[name] = (time.perf_counter() - t) / repeat * 1000
+            print(f"  {label:<18} legacy {timings['legacy']:>9.2f} ms   conversations {timings['conversations']:>7.2f} ms")
+
+
+def _legacy_delete_patient(patient_id):
+    """The original delete_patient: every visit and action removed in the request's transaction."""
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    conn.execute("DELETE FROM clinical_actions WHERE patient_id = ?", (patient_id,))
+    conn.execute("DELETE FROM clinical_visits WHERE patient_id = ?", (patient_id,))
+    conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+    conn.commit()
+    conn.close()
+
+
+def _add_long_history(ctx, actions):
+    """A patient with `actions` closed actions on one visit, as a long-stay patient accumulates."""
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    c = conn.cursor()
+    c.execute("INSERT INTO patients (unique_id, name, dob, gender) VALUES (?, 'Long Stay', '1950-01-01', 'Male')",
+              (f"PAT-L{actions:07d}{random.randint(0, 10 ** 6)}",))
+    patient_id = c.lastrowid
+    c.execute("INSERT INTO clinical_visits (patient_id, organization_id, date, priority) VALUES (?, ?, '2024-01-01T08:00:00', 'normal')",
+              (patient_id, ctx["org_id"]))
+    visit_id = c.lastrowid
+    c.executemany(
+        """INSERT INTO clinical_actions (patient_id, visit_id, author_id, from_organization_id, type, status, description, created_at, updated_at)
+           VALUES (?, ?, ?, ?, 'diagnostic', 'completed', 'bench action', '2024-01-01T08:00:00', '2024-01-01T08:00:00')""",
+        [(patient_id, visit_id, ctx["doctors"][0], ctx["org_id"])] * actions
+    )
+    conn.commit()
+    conn.close()
+    return patient_id
+
+
+def bench_archive(ctx, requests=200, long_history=20000):
+    """Queue and timeline reads before and after archiving all but the newest few weeks, and the cost of deleting a patient."""
+    from app.mediconnect.archive import Archiver
+
+    rng = random.Random(23)
+    picks = [rng.randint(1, ctx["patients"]) for _ in range(requests)]
+    reads = [
+        ("completed queue, first page", lambda i: mediconnect_db.get_department_queue(["diagnostic", "pharmacy"], ["completed"], 50)),
+        ("patient details", lambda i: mediconnect_db.get_patient_details(picks[i])),
+        ("stats", lambda i: mediconnect_db.get_stats(breakdown=True)),
+    ]
+
+    def time_reads():
+        timings = []
+        for _, fn in reads:
+            start = time.perf_counter()
+            for i in range(requests):
+                fn(i)
+            timings.append((time.perf_counter() - start) / requests * 1000)
+        return timings
+
+    def time_delete(delete):
+        patient_id = _add_long_history(ctx, long_history)
+        start = time.perf_counter()
+        delete(patient_id)
+        return (time.perf_counter() - start) * 1000
+
+    hot = time_reads()
+    legacy_delete = time_delete(_legacy_delete_patient)
+    # The seeded visits span 2024; keep the last month of them hot
+    days = (datetime.utcnow() - datetime(2024, 12, 1)).days
+    archiver = Archiver(after_days=days)
+    start = time.perf_counter()
+    moved = archiver.run_once()
+    elapsed = time.perf_counter() - start
+    rows = moved["clinical_actions"] + moved["clinical_visits"]
+    archived = time_reads()
+    soft_delete = time_delete(mediconnect_db.delete_patient)
+    start = time.perf_counter()
+    purged = archiver.run_once()["purged"]
+    purge_elapsed = time.perf_counter() - start
+
+    print(f"\nHot/cold archival: {rows} rows archived in {elapsed * 1000:.0f} ms ({rows / elapsed:,.0f} rows/s)")
+    for (label, _), before, after in zip(reads, hot, archived):
+        print(f"  {label:<28} all hot {before:>7.3f} ms   archived {after:>7.3f} ms")
+    print(f"  delete patient with {long_history} actions: in-request {legacy_delete:.1f} ms, tombstone {soft_delete:.1f} ms "
+          f"(+{purged} rows purged in the background in {purge_elapsed * 1000:.0f} ms)")
+    print(f"  stats drift after archiving: {mediconnect_db.check_stats() or 'none'}")
+
+
+def _legacy_queue_item(a):
+    """The per-route remapping the queue handler used to do, kept for comparison."""
+    a_copy = dict(a)
+    if a_copy.get("payload") and isinstance(a_copy["payload"], str):
+        a_copy["payload"] = json.loads(a_copy["payload"])
+    return {
+        "id": a_copy["id"],
+        "patientId": a_copy.pop("patient_id", None),
+        "type": a_copy["type"],
+        "status": a_copy["status"],
+        "description": a_copy["description"],
+        "payload": a_copy.pop("payload", None),
+        "createdAt": a_copy.pop("created_at", None),
+        "updatedAt": a_copy.pop("updated_at", None),
+        "completedAt": a_copy.pop("completed_at", None),
+        "notes": a_copy.get("notes"),
+        "patientName": a_copy.pop("patientName", "Unknown"),
+        "uniqueId": a_copy.pop("uniqueId", "N/A"),
+        "authorName": a_copy.pop("authorName", "Unknown"),
+        "orgName": a_copy.pop("orgName", "Unknown")
+    }
+
+
+def bench_serializers(rows=10000, repeat=10):
+    """Cost of turning `rows` department-queue rows into a response body."""
+    rng = random.Random(11)
+    queue = [{
+        "id": i, "patient_id": rng.randint(1, 5000), "visit_id": i, "author_id": 2, "from_organization_id": 1,
+        "type": rng.choice(ACTION_TYPES), "status": rng.choice(ACTION_STATUSES), "description": f"Action {i}",
+        "payload": json.dumps({"medication": "Amoxicillin", "dosage": "500mg", "frequency": "TID", "days": 7}),
+        "created_at": "2024-05-01T10:00:00", "updated_at": "2024-05-01T10:00:00", "completed_at": None,
+        "completed_by": None, "completed_by_organization_id": None, "notes": None,
+        "patientName": "John Smith", "uniqueId": f"PAT-{i:06d}", "authorName": "Dr. Sarah Chen", "orgName": "City General Hospital",
+    } for i in range(rows)]
+
+    def legacy():
+        # FastAPI runs jsonable_encoder over a returned list before rendering it
+        return StarletteJSONResponse(jsonable_encoder([_legacy_queue_item(a) for a in queue])).body
+
+    def compiled():
+        return serializers.JSONResponse(serializers.many(serializers.queue_action, queue)).body
+
+    assert json.loads(legacy()) == json.loads(compiled())
+    encoder = "orjson" if serializers.ORJSON_AVAILABLE else "json"
+    print(f"\nSerializing {rows} queue rows (ms per response)")
+    timings = {}
+    for label, fn in [("per-route dicts + jsonable_encoder + json", legacy), (f"compiled mapper + {encoder}", compiled)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        timings[label] = (time.perf_counter() - start) / repeat * 1000
+        print(f"  {label:<42} {timings[label]:>8.1f} ms")
+    before, after = timings.values()
+    print(f"  {'speedup':<42} {before / after:>8.1f}x")
+
+
+def bench_delta_sync(ctx, requests=500):
+    """Steady-state cost of one dashboard refresh: re-polling the views vs. asking the change log."""
+    rng = random.Random(5)
+    polls = [
+        lambda: mediconnect_db.get_department_queue(["pharmacy"], ["pending", "in_progress"], 500),
+        lambda: mediconnect_db.get_patient_details(rng.randint(1, ctx["patients"])),
+        lambda: mediconnect_db.get_messages_by_patient(rng.randint(1, ctx["patients"])),
+    ]
+    cursor = mediconnect_db.get_changes()["cursor"]
+    print("\nDashboard refresh with no new data (ms per refresh)")
+    for label, fn in [("poll queue + details + messages", lambda: [poll() for poll in polls]),
+                      ("GET /api/sync?since=<cursor>", lambda: mediconnect_db.get_changes(cursor))]:
+        start = time.perf_counter()
+        for _ in range(requests):
+            fn()
+        print(f"  {label:<34} {(time.perf_counter() - start) / requests * 1000:>8.3f} ms")
+
+
+def bench_conditional_get(ctx, polls=500, write_every=50):
+    """Polling with If-None-Match while a message and a pharmacy order are written every `write_every` polls."""
+    patient_id = ctx["patients"] // 2
+    endpoints = [
+        ("GET  /api/departments/pharmacy/queue", lambda req: mediconnect_api.get_department_queue("pharmacy", req, "pending,in_progress")),
+        ("GET  /api/patients/{id}/details", lambda req: mediconnect_api.get_patient_details(patient_id, req)),
+        ("GET  /api/messages/{patient_id}", lambda req: mediconnect_api.get_messages(patient_id, req)),
+        ("GET  /api/doctor/messages", lambda req: mediconnect_api.get_doctor_messages(ctx["doctors"][0], req)),
+        ("GET  /api/stats", lambda req: mediconnect_api.get_stats(req)),
+    ]
+
+    async def poll(call, conditional):
+        etag, hits, sent = None, 0, 0
+        start = time.perf_counter()
+        for i in range(polls):
+            if i and i % write_every == 0:
+                await async_db.create_message(patient_id, ctx["doctors"][0], "patient", "bench")
+                await async_db.create_action(patient_id, None, ctx["doctors"][0], ctx["org_id"], "prescription", "bench", None)
+            response = await call(_request(etag if conditional else None))
+            etag = response.headers.get("etag")
+            hits += response.status_code == 304
+            sent += len(response.body)
+        return (time.perf_counter() - start) / polls * 1000, hits / polls, sent / polls
+
+    print(f"\nConditional GET polling, writes every {write_every} polls (ms per poll, 304 ratio, bytes per poll)")
+    for label, call in endpoints:
+        full_ms, _, full_bytes = asyncio.run(poll(call, False))
+        cond_ms, ratio, cond_bytes = asyncio.run(poll(call, True))
+        print(f"  {label:<40} {full_ms:>7.3f} -> {cond_ms:>7.3f} ms   {ratio:>5.0%} 304   "
+              f"{full_bytes:>9.0f} -> {cond_bytes:>7.0f} B")
+
+
+def bench_timeline_cache(ctx, requests=2000, open_patients=50, write_every=100):
+    """Unconditional /details requests across `open_patients` patients, with and without the timeline cache."""
+    original = mediconnect_api.timeline_cache
+
+    async def load():
+        rng = random.Random(11)
+        start = time.perf_counter()
+        for i in range(requests):
+            patient_id = rng.randint(1, open_patients)
+            if i and i % write_every == 0:
+                await async_db.create_action(patient_id, None, ctx["doctors"][0], ctx["org_id"], "observation", "bench", None)
+            await mediconnect_api.get_patient_details(patient_id, _request())
+        return (time.perf_counter() - start) / requests * 1000
+
+    print(f"\nPatient timeline, {open_patients} open patients, a write every {write_every} requests (ms per request)")
+    try:
+        for label, cache in [("no cache", VersionedLRU(0)), (f"VersionedLRU({original.maxsize})", VersionedLRU(original.maxsize))]:
+            mediconnect_api.timeline_cache = cache
+            ms = asyncio.run(load())
+            print(f"  {label:<34} {ms:>8.3f} ms   hit ratio {cache.snapshot()['hitRatio']:.0%}")
+    finally:
+        mediconnect_api.timeline_cache = original
+
+
+def _registry_csv(rows, seed=29):
+    """A hospital registry export: one row per visit, about two visits per patient."""
+    rng = random.Random(seed)
+    lines = ["name,dob,gender,contact,bloodGroup,mrn,visitDate,symptoms,priority"]
+    for i in range(rows):
+        mrn = i // 2
+        lines.append(f"Imported {mrn},19{rng.randint(30, 99)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)},{rng.choice('MF')},"
+                     f"+1666{mrn:07d},{rng.choice(['A+', 'O+', 'B-'])},MRN{mrn},2023-0{rng.randint(1, 9)}-15T09:30:00,"
+                     f"cough,{rng.choice(['normal'] * 8 + ['emergency'])}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def bench_bulk_import(ctx, rows=50000, per_row_sample=2000):
+    """Onboarding a registry: one POST /api/patients + POST /api/visits per row vs. the streaming bulk import."""
+    body = _registry_csv(rows)
+    sample = [line.split(",") for line in body.decode().splitlines()[1:per_row_sample + 1]]
+
+    async def per_row():
+        seen = {}
+        for name, dob, gender, contact, blood_group, mrn, visit_date, symptoms, priority in sample:
+            if mrn not in seen:
+                patient = await mediconnect_api.create_patient(
+                    mediconnect_api.PatientRequest(name=name, dob=dob, gender=gender, contact=contact, bloodGroup=blood_group))
+                seen[mrn] = json.loads(patient.body)["id"]
+            await mediconnect_api.create_visit(mediconnect_api.VisitRequest(
+                patientId=seen[mrn], organizationId=ctx["org_id"], symptoms=symptoms, priority=priority))
+
+    async def chunks():
+        for i in range(0, len(body), 64 * 1024):
+            yield body[i:i + 64 * 1024]
+
+    start = time.perf_counter()
+    asyncio.run(per_row())
+    per_row_rate = per_row_sample / (time.perf_counter() - start)
+    summary = asyncio.run(importer.import_stream(ctx["org_id"], chunks(), "csv"))
+    print(f"\nBulk registry import ({rows} CSV rows, {summary['patients']} patients, {summary['visits']} visits)")
+    print(f"  {'per-row POSTs':<28} {per_row_rate:>10,.0f} rows/s   (first {per_row_sample} rows)")
+    print(f"  {'streaming import':<28} {summary['rowsPerSecond']:>10,} rows/s   ({summary['seconds']:.2f} s, {summary['rejected']} rejected)")
+
+
+def bench_transfer_export(ctx, actions=100000):
+    """Exporting a long-stay patient: building the whole record in memory vs. streaming the transfer bundle."""
+    import tracemalloc
+
+    patient_id = _add_long_history(ctx, actions)
+
+    def in_memory():
+        return [json.dumps(mediconnect_db.get_patient_details(patient_id)).encode()]
+
+    print(f"\nTransfer export of a patient with {actions} actions")
+    for label, export in [("details + json.dumps", in_memory),
+                          ("streamed bundle", lambda: transfer.export_bundle(patient_id)),
+                          ("streamed bundle, gzip", lambda: transfer.export_bundle(patient_id, compress=True))]:
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in export())
+        elapsed = time.perf_counter() - start
+        # A second run under tracemalloc, which would distort the timing
+        tracemalloc.start()
+        sum(len(chunk) for chunk in export())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {label:<24} {elapsed * 1000:>7.0f} ms   {size / 2 ** 20:>6.1f} MiB sent   peak {peak / 2 ** 20:>6.1f} MiB")
+
+
+def bench_login_storm(logins=200, concurrency=50, rounds=10, probe_every=0.02):
+    """Event-loop latency of GET /api/stats during a login storm: bcrypt inline vs. on the hashing pool."""
+    import bcrypt
+    from app.auth.hashing import HashPoolBusy, PasswordHasher
+
+    hashed = bcrypt.hashpw(b"password", bcrypt.gensalt(rounds=rounds))
+    pool = PasswordHasher(rounds=rounds)
+
+    async def inline_verify():
+        # What the login route used to do
+        return bcrypt.checkpw(b"password", hashed)
+
+    async def storm(verify):
+        done = shed = 0
+        latencies = []
+        stop = asyncio.Event()
+
+        async def probe():
+            while not stop.is_set():
+                start = time.perf_counter()
+                await mediconnect_api.get_stats(_request())
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(probe_every)
+
+        async def client():
+            nonlocal done, shed
+            while done + shed < logins:
+                try:
+                    await verify()
+                    done += 1
+                except HashPoolBusy:
+                    shed += 1
+                    await asyncio.sleep(0.05)  # the client honours Retry-After, shortened
+
+        prober = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await prober
+        latencies.sort()
+        pct = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+        return done / elapsed, shed, pct(0.5), pct(0.99), latencies[-1]
+
+    asyncio.run(pool.verify("password", hashed.decode()))  # start the worker processes outside the timing
+    print(f"\nLogin storm: {logins} bcrypt checks (cost {rounds}), {concurrency} concurrent clients, /api/stats probed every {probe_every * 1000:.0f} ms")
+    for label, verify in [("bcrypt in the handler", inline_verify),
+                          (f"hashing pool ({pool.workers} processes)", lambda: pool.verify("password", hashed.decode()))]:
+        rate, shed, p50, p99, worst = asyncio.run(storm(verify))
+        print(f"  {label:<30} {rate:>6.1f} logins/s   shed {shed:>4}   /api/stats p50 {p50:>7.2f} ms  p99 {p99:>7.2f} ms  max {worst:>7.2f} ms")
+    pool.shutdown()
+
+
+def bench_principal_cache(ctx, requests=5000, sessions=200):
+    """Authenticating portal requests from `sessions` patients: resolving every token vs. the principal cache."""
+    from app.auth import routes
+    from app.auth.principals import PrincipalCache
+
+    rng = random.Random(31)
+    tokens = [routes.create_access_token({"sub": f"PAT-{p:07d}"}, timedelta(minutes=30)) for p in range(sessions)]
+    calls = [rng.choice(tokens) for _ in range(requests)]
+
+    async def authenticate():
+        start = time.perf_counter()
+        for token in calls:
+            await routes.get_current_user(token)
+        return (time.perf_counter() - start) / requests * 1e6
+
+    cached = routes.principal_cache
+    print(f"\nAuthenticating {requests} requests from {sessions} patient sessions (us per request)")
+    try:
+        for label, cache in [("decode + lookup every time", PrincipalCache(maxsize=0)), ("principal cache", PrincipalCache())]:
+            routes.principal_cache = cache
+            print(f"  {label:<28} {asyncio.run(authenticate()):>8.1f} us   hit ratio {cache.snapshot()['hitRatio']:.3f}")
+    finally:
+        routes.principal_cache = cached
+
+
+class _RemoteContainer:
+    """A Cosmos container stand-in where every call costs one `rtt` round trip."""
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.items = []
+
+    def create_item(self, body):
+        time.sleep(self.rtt)
+        self.items.append(body)
+        return body
+
+
+class _BatchingRemoteContainer(_RemoteContainer):
+    def execute_item_batch(self, batch_operations, partition_key):
+        time.sleep(self.rtt)
+        self.items.extend(args[0] for _, args in batch_operations)
+        return [{"statusCode": 200}] * len(batch_operations)
+
+
+def bench_metric_writes(reports=20, analytes=30, rtt=0.01):
+    """Saving an analysed report with `analytes` flagged values, `rtt` seconds per Cosmos round trip."""
+    from app.auth.metric_writer import MetricWriter
+
+    docs = lambda: [{"id": str(i), "user_id": "bench", "metric_name": f"A{i}", "value": i} for i in range(analytes)]
+
+    def sequential(container):
+        container.create_item({"id": "report", "user_id": "bench"})
+        for doc in docs():
+            container.create_item(doc)
+
+    print(f"\nSaving {reports} reports with {analytes} metrics each, {rtt * 1000:.0f} ms per round trip")
+    for label, batches in [("sequential create_item", None), ("concurrent create_item", False), ("transactional batch", True)]:
+        container = _BatchingRemoteContainer(rtt) if batches else _RemoteContainer(rtt)
+        writer = MetricWriter()
+        start = time.perf_counter()
+        response = 0.0
+        for _ in range(reports):
+            begin = time.perf_counter()
+            if batches is None:
+                sequential(container)
+            else:
+                container.create_item({"id": "report", "user_id": "bench"})
+                writer.submit(container, "bench", docs())
+            response += time.perf_counter() - begin
+        writer.flush()
+        elapsed = time.perf_counter() - start
+        assert len(container.items) == reports * (analytes + 1)
+        print(f"  {label:<24} response {response / reports * 1000:>7.1f} ms   all acknowledged in {elapsed * 1000:>7.0f} ms")
+
+
+def bench_history(reports=2000, prescriptions=500, page=20):
+    """First page of a long-time user's history: every full document, sorted in Python, vs. the projected page."""
+    from app.auth.history import history_page
+    from app.auth.local_container import LocalContainer
+
+    rng = random.Random(17)
+    db = {"reports": LocalContainer(sorted_fields=("timestamp",)), "prescriptions": LocalContainer(sorted_fields=("timestamp",))}
+    for i in range(reports):
+        flags = [{"item": f"Analyte {a}", "value": rng.random() * 100, "unit": "mg/dL"} for a in range(30)]
+        db["reports"].create_item({"id": f"r{i}", "user_id": "bench", "timestamp": f"2025-{i:06d}", "filename": "panel.pdf",
+                                   "flags": flags, "ai_report": "Summary. " * 300, "extracted_data": {"tables": flags * 4}})
+    for i in range(prescriptions):
+        db["prescriptions"].create_item({"id": f"p{i}", "user_id": "bench", "timestamp": f"2025-{i * 4:06d}", "filename": "rx.jpg",
+                                         "language": "hi", "translated_text": "Dose. " * 200})
+
+    def everything():
+        # What /api/history used to do
+        history = []
+        for name, kind in [("reports", "report"), ("prescriptions", "prescription")]:
+            query = "SELECT * FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp DESC"
+            for item in db[name].query_items(query=query, parameters=[{"name": "@user_id", "value": "bench"}], enable_cross_partition_query=True):
+                history.append(dict(item, type=kind))
+        history.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        return history
+
+    print(f"\nHistory of {reports} reports + {prescriptions} prescriptions (local containers)")
+    for label, fetch in [("all documents, SELECT *", everything), (f"projected page of {page}", lambda: history_page(db, "bench", page))]:
+        start = time.perf_counter()
+        body = serializers.dumps(fetch())
+        print(f"  {label:<26} {(time.perf_counter() - start) * 1000:>8.1f} ms   {len(body) / 1024:>9.1f} KiB response")
+
+
+def bench_local_containers(users=5000, metrics=1000000, lookups=2000):
+    """Auth, history and trends queries on the local Cosmos containers at `metrics` documents, vs. scanning a list."""
+    from app.auth.history import history_page
+    from app.auth.local_container import LocalContainer
+
+    rng = random.Random(23)
+    per_user = metrics // users
+    db = {
+        "users": LocalContainer("Users", partition_key="id", indexed=("username",)),
+        "reports": LocalContainer("LabReports", sorted_fields=("timestamp",)),
+        "prescriptions": LocalContainer("Prescriptions", sorted_fields=("timestamp",)),
+        "metrics": LocalContainer("LabMetrics", indexed=("report_id", "metric_name"), sorted_fields=("timestamp",)),
+    }
+    start = time.perf_counter()
+    for u in range(users):
+        user_id = f"user{u}"
+        db["users"].create_item({"id": user_id, "username": user_id, "password_hash": "x"})
+        reports = [{"id": f"{user_id}-r{r}", "user_id": user_id, "timestamp": f"2025-{r:04d}", "filename": "panel.pdf",
+                    "flags": [], "ai_report": ""} for r in range(per_user // 10)]
+        db["reports"].execute_item_batch([("create", (doc,)) for doc in reports], user_id)
+        docs = [{"id": f"{user_id}-m{m}", "user_id": user_id, "report_id": f"{user_id}-r{m // 10}", "metric_name": f"A{m % 10}",
+                 "value": rng.random(), "unit": "mg/dL", "timestamp": f"2025-{m // 10:04d}"} for m in range(per_user)]
+        db["metrics"].execute_item_batch([("create", (doc,)) for doc in docs], user_id)
+    print(f"\nLocal containers: {users} users, {db['reports'].count()} reports, {db['metrics'].count()} metrics "
+          f"(loaded in {time.perf_counter() - start:.1f} s)")
+
+    scan = {name: container.items for name, container in db.items()}
+    sample = [f"user{rng.randrange(users)}" for _ in range(lookups)]
+    trends = "SELECT * FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp ASC"
+
+    def scanned(name, field, user_id):
+        # What MockContainer did: every document compared on every query
+        return [doc for doc in scan[name] if doc.get(field) == user_id]
+
+    cases = [
+        ("auth lookup", lambda u: list(db["users"].query_items("SELECT * FROM c WHERE c.id=@username", [{"name": "@username", "value": u}])),
+         lambda u: scanned("users", "id", u)),
+        ("history page", lambda u: history_page(db, u),
+         lambda u: sorted(scanned("reports", "user_id", u), key=lambda d: d["timestamp"], reverse=True)[:20]),
+        ("trends series", lambda u: list(db["metrics"].query_items(trends, [{"name": "@user_id", "value": u}])),
+         lambda u: sorted(scanned("metrics", "user_id", u), key=lambda d: d["timestamp"])),
+    ]
+    for label, indexed, linear in cases:
+        timings = []
+        for fn, count in [(indexed, lookups), (linear, max(1, lookups // 200))]:
+            begin = time.perf_counter()
+            for user_id in sample[:count]:
+                fn(user_id)
+            timings.append((time.perf_counter() - begin) / count * 1000)
+        print(f"  {label:<16} indexed {timings[0]:>9.3f} ms   list scan {timings[1]:>9.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cosmos.db")
+        start = time.perf_counter()
+        persisted = LocalContainer("LabMetrics", path=path, sorted_fields=("timestamp",))
+        for user_id in (doc["id"] for doc in scan["users"]):
+            persisted.execute_item_batch([("create", (doc,)) for doc in db["metrics"].query_items(trends, [{"name": "@user_id", "value": user_id}])], user_id)
+        written = time.perf_counter() - start
+        start = time.perf_counter()
+        reloaded = LocalContainer("LabMetrics", path=path, sorted_fields=("timestamp",))
+        print(f"  SQLite persistence: {reloaded.count()} metrics written in {written:.1f} s, reloaded in {time.perf_counter() - start:.1f} s")
+
+
+def bench_trends(reports=2000, analytes=30, points=200, repeat=20):
+    """Loading the trends page of a user with `reports` analysed reports: grouping every metric vs. the series documents."""
+    from app.auth import trends
+    from app.auth.local_container import LocalContainer
+
+    rng = random.Random(29)
+    db = {"metrics": LocalContainer("LabMetrics", sorted_fields=("timestamp",)), "trends": LocalContainer("LabTrends")}
+    start_day = datetime(2020, 1, 1)
+    for r in range(reports):
+        timestamp = (start_day + timedelta(hours=12 * r)).isoformat()
+        docs = [{"id": f"r{r}-{a}", "user_id": "bench", "report_id": f"r{r}", "metric_name": f"Analyte {a}",
+                 "value": round(rng.gauss(100, 15), 1), "unit": "mg/dL", "timestamp": timestamp} for a in range(analytes)]
+        db["metrics"].execute_item_batch([("create", (doc,)) for doc in docs], "bench")
+        trends.record_points(db["trends"], "bench", docs)
+    trends.backfill(db, "bench")
+    last = (start_day + timedelta(hours=12 * (reports - 2))).isoformat()
+
+    def grouped():
+        # What /api/trends used to do
+        query = "SELECT * FROM c WHERE c.user_id=@user_id ORDER BY c.timestamp ASC"
+        series = {}
+        for m in db["metrics"].query_items(query=query, parameters=[{"name": "@user_id", "value": "bench"}]):
+            entry = series.setdefault(m["metric_name"], {"dates": [], "values": [], "unit": m["unit"]})
+            entry["dates"].append(m["timestamp"])
+            entry["values"].append(m["value"])
+        return series
+
+    print(f"\nTrends page: {reports} reports x {analytes} analytes")
+    def cold():
+        trends.downsampled_cache.clear()
+        return trends.series(db, "bench", points)
+
+    for label, fetch in [("every metric, grouped", grouped),
+                         (f"series, LTTB to {points}", cold),
+                         ("series, LTTB cached", lambda: trends.series(db, "bench", points)),
+                         ("series since last load", lambda: trends.series(db, "bench", points, since=last))]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            body = serializers.dumps(fetch())
+        print(f"  {label:<26} {(time.perf_counter() - start) / repeat * 1000:>8.1f} ms   {len(body) / 1024:>8.1f} KiB response")
+
+
+def bench_message_routing(ctx, requests=2000, chatting=200):
+    """Picking the doctor for messages from `chatting` patients: visit/user lookups vs. care_team vs. the in-process cache."""
+    rng = random.Random(13)
+    patient_ids = [rng.randint(1, min(chatting, ctx["patients"])) for _ in range(requests)]
+    conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+    conn.execute("DELETE FROM care_team")
+    conn.commit()
+    conn.close()
+
+    def timed(fn):
+        start = time.perf_counter()
+        for patient_id in patient_ids:
+            fn(patient_id)
+        return (time.perf_counter() - start) / requests * 1000
+
+    print("\nMessage routing without a doctorId (ms per message)")
+    print(f"  {'latest visit + staff lookups':<34} {timed(mediconnect_db.find_doctor_for_patient):>8.4f} ms")
+    start = time.perf_counter()
+    assigned = mediconnect_db.backfill_care_team()
+    print(f"  {f'backfill_care_team ({assigned} patients)':<34} {(time.perf_counter() - start) * 1000:>8.1f} ms total")
+    print(f"  {'care_team lookup':<34} {timed(mediconnect_db.find_doctor_for_patient):>8.4f} ms")
+    cache = TTLCache(len(patient_ids), 30)
+
+    def cached(patient_id):
+        if cache.get(patient_id) is None:
+            cache.put(patient_id, mediconnect_db.find_doctor_for_patient(patient_id))
+    print(f"  {'care_team + TTLCache':<34} {timed(cached):>8.4f} ms   hit ratio {cache.snapshot()['hitRatio']:.0%}")
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def _bus_subscriber(path, expected, ready, results):
+    """Worker process: tails the journal and reports per-event latency once `expected` events arrive."""
+    async def main():
+        done = asyncio.Event()
+        latencies = []
+
+        def deliver(text, topics):
+            latencies.append(time.monotonic() - json.loads(text)["sent"])
+            if len(latencies) == expected:
+                done.set()
+
+        bus = events.JournalBus(path)
+        await bus.start(deliver)
+        ready.put(True)
+        await asyncio.wait_for(done.wait(), timeout=120)
+        bus.close()
+        results.put(latencies)
+    asyncio.run(main())
+
+
+def _publish(bus, count, rate):
+    """Publishes `count` timestamped events, `rate` per second (0 = as fast as possible)."""
+    async def main():
+        start = time.monotonic()
+        for i in range(count):
+            bus.publish(json.dumps({"type": "BENCH", "seq": i, "sent": time.monotonic()}), ["org:1"])
+            if rate:
+                await asyncio.sleep(max(0.0, start + (i + 1) / rate - time.monotonic()))
+            elif i % 500 == 0:
+                await asyncio.sleep(0)
+        return time.monotonic() - start
+    return main
+
+
+def bench_event_bus(count=5000, workers=3):
+    """Publish-to-deliver latency and throughput of each event bus backend."""
+    print(f"\nEvent bus: {count} events (latency p50 / p99, throughput)")
+
+    latencies = []
+    local = events.LocalBus()
+    asyncio.run(local.start(lambda text, topics: latencies.append(time.monotonic() - json.loads(text)["sent"])))
+    elapsed = asyncio.run(_publish(local, count, 0)())
+    print(f"  {'local, same process':<34} {_percentile(latencies, 0.5) * 1e3:>7.3f} / {_percentile(latencies, 0.99) * 1e3:>7.3f} ms"
+          f"   {count / elapsed:>9.0f} events/s")
+
+    ctx = multiprocessing.get_context("spawn")
+    for label, rate in [("journal, burst", 0), ("journal, 500 events/s", 500)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "events.db")
+            ready, results = ctx.Queue(), ctx.Queue()
+            procs = [ctx.Process(target=_bus_subscriber, args=(path, count, ready, results)) for _ in range(workers)]
+            for proc in procs:
+                proc.start()
+            for _ in procs:
+                ready.get(timeout=60)
+
+            async def publish():
+                bus = events.JournalBus(path)
+                await bus.start(lambda text, topics: None)
+                start = time.monotonic()
+                await _publish(bus, count, rate)()
+                received = [results.get(timeout=120) for _ in procs]
+                elapsed = time.monotonic() - start
+                bus.close()
+                return received, elapsed
+            received, elapsed = asyncio.run(publish())
+            for proc in procs:
+                proc.join()
+            merged = [x for r in received for x in r]
+            print(f"  {f'{label}, {workers} workers':<34} {_percentile(merged, 0.5) * 1e3:>7.3f} / {_percentile(merged, 0.99) * 1e3:>7.3f} ms"
+                  f"   {count / elapsed:>9.0f} events/s delivered to every worker")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MediConnect API throughput benchmarks")
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--search-patients", type=int, default=200000)
+    parser.add_argument("--inbox-messages", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"Seeding {args.patients} patients into {path}...")
+        ctx = seed(path, patients=args.patients)
+        bench_connection_pool(args.requests, ctx)
+        bench_async_access(ctx)
+        bench_group_commit(ctx)
+        bench_delta_sync(ctx, args.requests)
+        bench_conditional_get(ctx, args.requests)
+        bench_timeline_cache(ctx)
+        bench_message_routing(ctx)
+        bench_archive(ctx)
+        bench_bulk_import(ctx)
+        bench_transfer_export(ctx)
+        bench_principal_cache(ctx)
+        bench_login_storm()
+    bench_metric_writes()
+    bench_history()
+    bench_local_containers()
+    bench_trends()
+    bench_serializers()
+    bench_event_bus()
+    bench_patient_search(args.search_patients)
+    bench_doctor_inbox(args.inbox_messages)
+
+
+if __name__ == "__main__":
+    main()
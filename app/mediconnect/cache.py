@@ -0,0 +1,96 @@
+"""
+In-process caches for MediConnect read models.
+
+Both caches are LRUs: once one holds `maxsize` entries, the least recently
+used entry is evicted.
+
+A VersionedLRU maps a key to a (version, value) pair and returns the value
+only while the caller's current version still matches. MediConnect's
+versions come from the change log, which every worker shares. An entry is
+therefore superseded by the first write to the rows it covers, whichever
+process made that write, and never needs to be invalidated explicitly.
+
+A TTLCache is for values that cost a query to validate. An entry is served
+until it expires. The process that changes the underlying rows invalidates
+the entry right away; other workers see the change within `ttl` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _LRU:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _get(self, key: Hashable, fresh: Callable[[Any], bool]) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and fresh(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.stale += 1
+                del self._entries[key]
+            return None
+
+    def _put(self, key: Hashable, tag: Any, value: Any):
+        with self._lock:
+            self._entries[key] = (tag, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "hitRatio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class VersionedLRU(_LRU):
+    def get(self, key: Hashable, version: Any) -> Optional[Any]:
+        """The value cached for `key` at `version`, or None."""
+        return self._get(key, lambda tag: tag == version)
+
+    def put(self, key: Hashable, version: Any, value: Any):
+        self._put(key, version, value)
+
+
+class TTLCache(_LRU):
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """The value cached for `key` if it has not expired, or None."""
+        now = time.monotonic()
+        return self._get(key, lambda expires: expires > now)
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Caches `value` for `ttl` seconds, or the cache's default TTL."""
+        self._put(key, time.monotonic() + (self.ttl if ttl is None else ttl), value)
@@ -1,13 +1,126 @@
 import sqlite3
 import json
+import random
+import base64
+import queue
+import threading
+import functools
+import time
+from collections import deque
+from concurrent.futures import Future
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, Iterator, List, Optional, Any, Tuple
+from app.mediconnect.migrations import migrate, stat_counters_sql, CARE_TEAM_SQL
 
 DATABASE_URL = str(Path(__file__).parent.parent.parent / "data" / "mediconnect.db")
 
+# Connection tuning, applied to every pooled connection
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+MAX_IDLE_PER_THREAD = 4
+MAX_WRITE_BATCH = 256
+
+# Keyset pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Action statuses, split the same way as the partial indexes on clinical_actions
+ACTIVE_STATUSES = ('pending', 'in_progress')
+CLOSED_STATUSES = ('completed', 'cancelled')
+EMERGENCY_PRIORITIES = ('emergency', 'critical')
+
+# Which action types land in each department's queue
+DEPARTMENT_ACTION_TYPES = {
+    'pharmacy': ['prescription'],
+    'diagnostic': ['lab_test', 'radiology'],
+    'nurse': ['observation', 'procedure', 'transfer']
+}
+
+# Delta sync: API table name -> SQL returning the current rows for a list of ids
+SYNC_LIMIT = 500
+SYNC_QUERIES = {
+    'patients': "SELECT * FROM patients WHERE id IN ({ids})",
+    # Visits and actions read through the archive views: an archived row is still a live row to a client
+    'visits': '''
+        SELECT v.*, p.name as patient_name, p.unique_id, o.name as orgName, u.name as staffName
+        FROM all_visits v
+        LEFT JOIN patients p ON v.patient_id = p.id
+        LEFT JOIN organizations o ON v.organization_id = o.id
+        LEFT JOIN users u ON v.attended_by = u.id
+        WHERE v.id IN ({ids})
+    ''',
+    'actions': '''
+        SELECT a.*, p.name as patientName, p.unique_id as uniqueId, u.name as authorName, o.name as orgName
+        FROM all_actions a
+        LEFT JOIN patients p ON a.patient_id = p.id
+        LEFT JOIN users u ON a.author_id = u.id
+        LEFT JOIN organizations o ON a.from_organization_id = o.id
+        WHERE a.id IN ({ids})
+    ''',
+    'messages': "SELECT * FROM messages WHERE id IN ({ids})",
+}
+
+# Cold storage: tables whose old rows move to the attached archive database, the
+# temp view that unions each with its archive, and which of their rows may move
+ARCHIVE_VIEWS = {'clinical_actions': 'all_actions', 'clinical_visits': 'all_visits'}
+# change_log.table_name of each archived table
+CHANGE_LOG_NAMES = {'clinical_actions': 'actions', 'clinical_visits': 'visits'}
+ARCHIVE_RULES = {
+    'clinical_actions': ("updated_at", "status IN ('completed', 'cancelled') AND updated_at < ?"),
+    # A visit moves once all its actions have, unless it is the patient's latest (find_doctor_for_patient reads
+    # it from the hot table) or the one care_team routes messages by
+    'clinical_visits': ("date", "date < ? AND NOT EXISTS (SELECT 1 FROM main.clinical_actions a WHERE a.visit_id = clinical_visits.id) "
+                                "AND id != (SELECT MAX(v.id) FROM main.clinical_visits v WHERE v.patient_id = clinical_visits.patient_id) "
+                                "AND id != COALESCE((SELECT visit_id FROM care_team WHERE patient_id = clinical_visits.patient_id), 0)"),
+}
+# stat_counters rows that count each archived table, scaled by {sign}
+ARCHIVE_COUNTERS = {
+    'clinical_actions': "SELECT 'actions', from_organization_id, type, status, {sign} * COUNT(*) FROM {source} WHERE {where} GROUP BY from_organization_id, type, status",
+    'clinical_visits': "SELECT 'visits', organization_id, '', '', {sign} * COUNT(*) FROM {source} WHERE {where} GROUP BY organization_id",
+}
+ARCHIVE_BATCH = 1000
+
+# change_log pseudo-table whose entry moves when stat_counters change outside the triggers
+STATS_VERSION_TABLE = "stats"
+
+# Patients per transaction when backfilling care_team
+CARE_TEAM_BATCH = 5000
+
+# Patients plus visits per write intent in a bulk import
+IMPORT_BATCH = 5000
+
+# A transfer bundle: what export_patient reads, in the order apply_transfer_bundle needs it.
+# Organizations and users are exported as references only, to be matched by code and employee ID.
+EXPORT_QUERIES = [
+    ("patient", "SELECT * FROM patients WHERE id = :patient_id"),
+    ("organization", '''SELECT id, name, type, code FROM organizations WHERE id IN (
+        SELECT organization_id FROM all_visits WHERE patient_id = :patient_id
+        UNION SELECT from_organization_id FROM all_actions WHERE patient_id = :patient_id
+        UNION SELECT completed_by_organization_id FROM all_actions WHERE patient_id = :patient_id)'''),
+    ("user", '''SELECT id, organization_id, employee_id, name, role FROM users WHERE id IN (
+        SELECT attended_by FROM all_visits WHERE patient_id = :patient_id
+        UNION SELECT author_id FROM all_actions WHERE patient_id = :patient_id
+        UNION SELECT completed_by FROM all_actions WHERE patient_id = :patient_id
+        UNION SELECT doctor_id FROM messages WHERE patient_id = :patient_id)'''),
+    ("visit", "SELECT * FROM all_visits WHERE patient_id = :patient_id"),
+    ("action", "SELECT * FROM all_actions WHERE patient_id = :patient_id"),
+    ("message", "SELECT * FROM messages WHERE patient_id = :patient_id ORDER BY id"),
+]
+EXPORT_CHUNK = 500  # rows fetched per step while streaming an export
+
+# Patient search
+SEARCH_LIMIT = 20
+MIN_TRIGRAM_QUERY = 3  # FTS5 trigram matching needs at least three characters
+
 def init_db():
     conn = sqlite3.connect(DATABASE_URL)
+    # Lets the archiver hand freed pages back with PRAGMA incremental_vacuum. Only
+    # takes effect on a new file; `python -m app.mediconnect.archive --enable-incremental-vacuum` converts an old one.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL is persistent in the database file, so it only needs setting once
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
 
     # Enum constraints in SQLite are usually managed by application logic, 
@@ -112,32 +225,320 @@ def init_db():
     ''')
 
     conn.commit()
+
+    # Indexes and later schema changes are versioned migrations
+    migrate(conn)
+    init_archive(conn)
     conn.close()
 
-# Helper dict factory for SQL rows
+def archive_path(path: str) -> str:
+    """The cold-storage file kept next to a MediConnect database: mediconnect.db -> mediconnect_archive.db."""
+    p = Path(path)
+    return str(p.with_name(f"{p.stem}_archive{p.suffix}"))
+
+def init_archive(conn: sqlite3.Connection):
+    """Creates the archive database with a copy of each archived table's schema."""
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(DATABASE_URL),))
+    try:
+        conn.execute("PRAGMA archive.auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA archive.journal_mode=WAL")
+        for table in ARCHIVE_VIEWS:
+            (sql,) = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            conn.execute(sql.replace(f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS archive.{table}", 1))
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_visits_patient ON clinical_visits(patient_id, date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_actions_patient ON clinical_actions(patient_id, created_at)")
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE archive")
+
+def attach_archive(conn: sqlite3.Connection, path: str):
+    """Attaches `path`'s archive and defines the temp views that read hot and archived rows as one table.
+
+    Rows are copied to the archive before they are deleted here, so for a
+    moment one can be in both; the view then shows the hot copy.
+    """
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(path),))
+    for table, view in ARCHIVE_VIEWS.items():
+        conn.execute(f'''
+            CREATE TEMP VIEW IF NOT EXISTS {view} AS
+            SELECT * FROM main.{table}
+            UNION ALL
+            SELECT * FROM archive.{table} a WHERE NOT EXISTS (SELECT 1 FROM main.{table} m WHERE m.id = a.id)
+        ''')
+
+# Helper dict factory for SQL rows.
+# cursor.description is the same tuple for every row of a statement, so the
+# column names are computed once per statement instead of once per row.
+_last_columns = (None, ())
+
 def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+    global _last_columns
+    description, columns = _last_columns
+    if cursor.description is not description:
+        description = cursor.description
+        columns = tuple(col[0] for col in description)
+        _last_columns = (description, columns)
+    return dict(zip(columns, row))
 
-def get_db():
-    conn = sqlite3.connect(DATABASE_URL)
-    conn.row_factory = dict_factory
+def connect(path: str, **kwargs) -> sqlite3.Connection:
+    """Opens a connection with the tuning pragmas every MediConnect connection uses."""
+    conn = sqlite3.connect(path, **kwargs)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
+class PooledConnection:
+    """A pooled sqlite3 connection. close() hands it back to its thread's pool instead of closing it."""
+
+    def __init__(self, conn: sqlite3.Connection, pool: "ConnectionPool"):
+        self._conn = conn
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ("_conn", "_pool"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+class ConnectionPool:
+    """Per-thread pool of tuned connections to a single SQLite file.
+
+    sqlite3 connections may only be used by the thread that created them, so
+    every thread keeps its own stack of idle connections. Nested get_db()
+    calls on one thread get separate connections, so an inner commit or
+    rollback never touches the outer caller's transaction.
+    """
+
+    def __init__(self, path: str, max_idle: int = MAX_IDLE_PER_THREAD):
+        self.path = path
+        self.max_idle = max_idle
+        self._local = threading.local()
+
+    def _idle(self) -> List[sqlite3.Connection]:
+        idle = getattr(self._local, "idle", None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def acquire(self) -> PooledConnection:
+        idle = self._idle()
+        if idle:
+            conn = idle.pop()
+        else:
+            conn = connect(self.path)
+            attach_archive(conn, self.path)
+        conn.row_factory = dict_factory
+        return PooledConnection(conn, self)
+
+    def release(self, conn: sqlite3.Connection):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        idle = self._idle()
+        if len(idle) < self.max_idle:
+            idle.append(conn)
+        else:
+            conn.close()
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    pool = _pools.get(DATABASE_URL)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(DATABASE_URL, ConnectionPool(DATABASE_URL))
+    return pool
+
+def get_db():
+    return get_pool().acquire()
+
+class WriterMetrics:
+    """Batch size and commit latency of the group-commit writer."""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.intents = 0
+        self.failed_commits = 0
+        self.max_batch = 0
+        self._batch_sizes = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+
+    def record(self, batch_size: int, seconds: float):
+        with self._lock:
+            self.batches += 1
+            self.intents += batch_size
+            self.max_batch = max(self.max_batch, batch_size)
+            self._batch_sizes.append(batch_size)
+            self._latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            sizes = list(self._batch_sizes)
+        pct = lambda q: round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 3) if latencies else None
+        return {
+            "batches": self.batches,
+            "intents": self.intents,
+            "failedCommits": self.failed_commits,
+            "maxBatchSize": self.max_batch,
+            "avgBatchSize": round(sum(sizes) / len(sizes), 2) if sizes else None,
+            "commitLatencyMs": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)},
+        }
+
+class GroupCommitWriter:
+    """The only thread that writes to the database.
+
+    Callers submit write intents (functions of a cursor) and get a Future. The
+    writer drains everything queued, runs each intent inside its own SAVEPOINT
+    and commits the whole group at once, so a burst of N writes costs one
+    fsync instead of N and writers never fight over SQLite's write lock. A
+    failing intent only rolls back its own savepoint; futures resolve after
+    the group's COMMIT, so a returned row is always durable.
+    """
+
+    def __init__(self, path: str, max_batch: int = MAX_WRITE_BATCH):
+        self.path = path
+        self.max_batch = max_batch
+        self.metrics = WriterMetrics()
+        # Called on the writer thread after every successful commit
+        self.commit_listeners: List[Callable[[], None]] = []
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="mediconnect-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, intent, *args, **kwargs) -> Future:
+        future = Future()
+        self._queue.put((intent, args, kwargs, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = connect(self.path, isolation_level=None)
+        attach_archive(conn, self.path)
+        conn.row_factory = dict_factory
+        c = conn.cursor()
+        while True:
+            batch = [item for item in self._next_batch() if item[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            outcomes = []
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                for intent, args, kwargs, future in batch:
+                    c.execute("SAVEPOINT intent")
+                    try:
+                        outcomes.append((future, intent(c, *args, **kwargs), None))
+                        c.execute("RELEASE intent")
+                    except Exception as e:
+                        c.execute("ROLLBACK TO intent")
+                        c.execute("RELEASE intent")
+                        outcomes.append((future, None, e))
+                c.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    c.execute("ROLLBACK")
+                self.metrics.failed_commits += 1
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.metrics.record(len(batch), time.perf_counter() - start)
+            for future, result, error in outcomes:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            for listener in self.commit_listeners:
+                try:
+                    listener()
+                except Exception:
+                    pass  # e.g. the listener's event loop has closed; never let it stop the writer
+
+_writers: Dict[str, GroupCommitWriter] = {}
+
+def get_writer() -> GroupCommitWriter:
+    writer = _writers.get(DATABASE_URL)
+    if writer is None:
+        with _pools_lock:
+            writer = _writers.get(DATABASE_URL)
+            if writer is None:
+                writer = _writers[DATABASE_URL] = GroupCommitWriter(DATABASE_URL)
+    return writer
+
+def queued_write(intent):
+    """Turns a write intent, a function of a cursor, into a write function.
+
+    The decorated function drops the cursor argument, runs the intent on the
+    group-commit writer and blocks until it is committed. The async layer
+    uses `.intent` to await the same write without blocking.
+    """
+    @functools.wraps(intent)
+    def write(*args, **kwargs):
+        return get_writer().submit(intent, *args, **kwargs).result()
+    write.intent = intent
+    return write
+
+# --- Pagination ---
+def encode_cursor(*values) -> str:
+    """Opaque keyset cursor: the sort key of the last row on a page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+def _page_size(limit: int) -> int:
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def _page(rows: List[Dict], limit: int, sort_key) -> Tuple[List[Dict], Optional[str]]:
+    """Trims the extra look-ahead row and returns (rows, next_cursor)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*sort_key(rows[-1]))
+
 # --- Messages ---
-def create_message(patient_id: int, doctor_id: int, sender: str, content: str) -> Dict:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def create_message(c: sqlite3.Cursor, patient_id: int, doctor_id: int, sender: str, content: str) -> Dict:
     created_at = datetime.utcnow().isoformat() + "Z"
     c.execute(
         "INSERT INTO messages (patient_id, doctor_id, sender, content, created_at) VALUES (?, ?, ?, ?, ?) RETURNING *",
         (patient_id, doctor_id, sender, content, created_at)
     )
     row = c.fetchone()
-    conn.commit()
-    conn.close()
     return row
 
 def get_messages_by_patient(patient_id: int) -> List[Dict]:
@@ -154,43 +555,104 @@ def get_messages_by_patient(patient_id: int) -> List[Dict]:
 def get_messages_for_doctor(doctor_id: int) -> List[Dict]:
     conn = get_db()
     c = conn.cursor()
-    # Fetch latest message per patient for the doctor's inbox view
+    # One row per conversation, newest first, shaped like that conversation's latest message
     c.execute('''
-        SELECT m.*, p.name as patient_name, p.unique_id as patient_unique_id 
-        FROM messages m
-        JOIN patients p ON m.patient_id = p.id
-        WHERE m.id IN (
-            SELECT MAX(id) FROM messages WHERE doctor_id = ? GROUP BY patient_id
-        )
-        ORDER BY datetime(m.created_at) DESC
+        SELECT c.last_message_id as id, c.patient_id, c.doctor_id, c.last_sender as sender, c.preview as content,
+               strftime('%Y-%m-%dT%H:%M:%fZ', c.last_activity / 1000.0, 'unixepoch') as created_at,
+               CASE WHEN c.last_sender = 'patient' THEN c.unread_by_doctor = 0 ELSE c.unread_by_patient = 0 END as is_read,
+               c.unread_by_doctor as unread_count,
+               p.name as patient_name, p.unique_id as patient_unique_id
+        FROM conversations c
+        JOIN patients p ON c.patient_id = p.id
+        WHERE c.doctor_id = ?
+        ORDER BY c.last_activity DESC, c.last_message_id DESC
     ''', (doctor_id,))
     rows = c.fetchall()
     conn.close()
     return rows
 
-def mark_messages_read(patient_id: int, doctor_id: int, reader: str):
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def mark_messages_read(c: sqlite3.Cursor, patient_id: int, doctor_id: int, reader: str):
     # If doctor reads, mark patient's messages as read. And vice versa.
     sender_to_mark = 'patient' if reader == 'doctor' else 'doctor'
+    # Only the unread tail is rewritten (idx_messages_unread); a trigger zeroes the conversation's count
     c.execute(
-        "UPDATE messages SET is_read = 1 WHERE patient_id = ? AND doctor_id = ? AND sender = ?",
+        "UPDATE messages SET is_read = 1 WHERE patient_id = ? AND doctor_id = ? AND sender = ? AND is_read = 0",
         (patient_id, doctor_id, sender_to_mark)
     )
-    conn.commit()
-    conn.close()
 
-# --- Organizations ---
-def create_organization(name: str, type: str, code: str, address: Optional[str] = None) -> Dict:
+def find_doctor_for_patient(patient_id: int) -> int:
+    """Picks the doctor a patient's message should go to when none is given."""
     conn = get_db()
     c = conn.cursor()
+    # One lookup for every patient with a care_team row (see migration 7 and backfill_care_team)
+    c.execute('''
+        SELECT ct.doctor_id FROM care_team ct
+        JOIN users u ON u.id = ct.doctor_id AND u.role = 'doctor'
+        WHERE ct.patient_id = ?
+    ''', (patient_id,))
+    row = c.fetchone()
+    if row:
+        conn.close()
+        return row["doctor_id"]
+    doctor_id = None
+    # Not assigned yet, or the assigned doctor has left: work it out from the latest visit
+    c.execute(
+        "SELECT attended_by, organization_id FROM clinical_visits WHERE patient_id = ? ORDER BY id DESC LIMIT 1",
+        (patient_id,)
+    )
+    row = c.fetchone()
+    if row and row.get("attended_by"):
+        # Check if the attended_by user is actually a doctor
+        c.execute("SELECT id, role, organization_id FROM users WHERE id = ?", (row["attended_by"],))
+        staff = c.fetchone()
+        if staff and staff["role"] == "doctor":
+            doctor_id = staff["id"]
+        else:
+            # Find a doctor in the same organization
+            org_id = row.get("organization_id") or (staff["organization_id"] if staff else None)
+            if org_id:
+                c.execute("SELECT id FROM users WHERE role = 'doctor' AND organization_id = ? LIMIT 1", (org_id,))
+                doc = c.fetchone()
+                doctor_id = doc["id"] if doc else None
+    if not doctor_id:
+        # Ultimate fallback: first doctor in the system
+        c.execute("SELECT id FROM users WHERE role = 'doctor' LIMIT 1")
+        doc = c.fetchone()
+        doctor_id = doc["id"] if doc else 1
+    conn.close()
+    return doctor_id
+
+@queued_write
+def assign_care_teams(c: sqlite3.Cursor, after_patient_id: int, up_to_patient_id: int) -> int:
+    """Recomputes care_team for patients with ids in (after_patient_id, up_to_patient_id]."""
+    c.execute(f"INSERT OR REPLACE INTO care_team (patient_id, visit_id, doctor_id) {CARE_TEAM_SQL}",
+              (after_patient_id, up_to_patient_id))
+    return c.rowcount
+
+def backfill_care_team(batch: int = CARE_TEAM_BATCH) -> int:
+    """Fills care_team for every existing patient, one short write transaction per batch of patient ids.
+
+    Safe to run while the app is serving: each batch goes through the
+    group-commit writer, so it serializes with the triggers that keep
+    care_team current.
+    """
+    conn = get_db()
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) as max_id FROM patients").fetchone()["max_id"]
+    conn.close()
+    assigned = 0
+    for start in range(0, max_id, batch):
+        assigned += assign_care_teams(start, start + batch)
+    return assigned
+
+# --- Organizations ---
+@queued_write
+def create_organization(c: sqlite3.Cursor, name: str, type: str, code: str, address: Optional[str] = None) -> Dict:
     c.execute(
         "INSERT INTO organizations (name, type, code, address) VALUES (?, ?, ?, ?) RETURNING *",
         (name, type, code, address)
     )
     org = c.fetchone()
-    conn.commit()
-    conn.close()
     return org
 
 def get_organization_by_code(code: str) -> Optional[Dict]:
@@ -209,17 +671,19 @@ def get_all_organizations() -> List[Dict]:
     conn.close()
     return orgs
 
+@queued_write
+def delete_organization(c: sqlite3.Cursor, org_id: int):
+    c.execute("DELETE FROM users WHERE organization_id = ?", (org_id,))
+    c.execute("DELETE FROM organizations WHERE id = ?", (org_id,))
+
 # --- Users ---
-def create_user(org_id: int, employee_id: str, name: str, role: str, password: str) -> Dict:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def create_user(c: sqlite3.Cursor, org_id: int, employee_id: str, name: str, role: str, password: str) -> Dict:
     c.execute(
         "INSERT INTO users (organization_id, employee_id, name, role, password) VALUES (?, ?, ?, ?, ?) RETURNING *",
         (org_id, employee_id, name, role, password)
     )
     user = c.fetchone()
-    conn.commit()
-    conn.close()
     return user
 
 def get_user_by_credentials(org_id: int, employee_id: str, password: str) -> Optional[Dict]:
@@ -242,30 +706,60 @@ def get_staff_by_org(org_id: int) -> List[Dict]:
     return users
 
 # --- Patients ---
-def create_patient(unique_id: str, name: str, dob: str, gender: str, contact: str, blood_group: str) -> Dict:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def create_patient(c: sqlite3.Cursor, unique_id: str, name: str, dob: str, gender: str, contact: str, blood_group: str) -> Dict:
     c.execute(
         "INSERT INTO patients (unique_id, name, dob, gender, contact, blood_group) VALUES (?, ?, ?, ?, ?, ?) RETURNING *",
         (unique_id, name, dob, gender, contact, blood_group)
     )
     patient = c.fetchone()
-    conn.commit()
-    conn.close()
     return patient
 
-def search_patients(query: str) -> List[Dict]:
+def search_patients(query: str, limit: int = SEARCH_LIMIT) -> List[Dict]:
+    """Substring search over name, unique_id and contact, best matches first.
+
+    An exact unique_id hit is returned on its own via the UNIQUE index.
+    Otherwise the patients_fts trigram index answers the substring match and
+    ranks it with bm25. Queries shorter than a trigram fall back to a LIKE
+    that stops at `limit` rows.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    exact = get_patient_by_unique_id(query)
+    if exact:
+        return [exact]
+
     conn = get_db()
     c = conn.cursor()
-    like_q = f"%{query}%"
-    c.execute(
-        "SELECT * FROM patients WHERE unique_id = ? OR name LIKE ? OR unique_id LIKE ?",
-        (query, like_q, like_q)
-    )
+    if len(query) >= MIN_TRIGRAM_QUERY:
+        # Quote the query as one FTS5 phrase so user input is never parsed as query syntax
+        phrase = '"' + query.replace('"', '""') + '"'
+        c.execute('''
+            SELECT p.* FROM patients_fts
+            JOIN patients p ON p.id = patients_fts.rowid
+            WHERE patients_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (phrase, limit))
+    else:
+        like_q = f"%{query}%"
+        c.execute(
+            "SELECT * FROM patients WHERE name LIKE ? OR unique_id LIKE ? OR contact LIKE ? LIMIT ?",
+            (like_q, like_q, like_q, limit)
+        )
     patients = c.fetchall()
     conn.close()
     return patients
 
+def get_patient_by_unique_id(unique_id: str) -> Optional[Dict]:
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT * FROM patients WHERE unique_id = ?", (unique_id,))
+    p = c.fetchone()
+    conn.close()
+    return p
+
 def get_patient_by_id(patient_id: int) -> Optional[Dict]:
     conn = get_db()
     c = conn.cursor()
@@ -274,30 +768,53 @@ def get_patient_by_id(patient_id: int) -> Optional[Dict]:
     conn.close()
     return p
 
-def get_all_patients() -> List[Dict]:
+def get_all_patients(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Newest patients first, one keyset page at a time. Returns (patients, next_cursor)."""
+    limit = _page_size(limit)
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM patients ORDER BY id DESC")
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        c.execute("SELECT * FROM patients WHERE id < ? ORDER BY id DESC LIMIT ?", (last_id, limit + 1))
+    else:
+        c.execute("SELECT * FROM patients ORDER BY id DESC LIMIT ?", (limit + 1,))
     patients = c.fetchall()
     conn.close()
-    return patients
+    return _page(patients, limit, lambda p: (p["id"],))
+
+@queued_write
+def update_patient(c: sqlite3.Cursor, patient_id: int, name: str, dob: str, gender: str, contact: str, blood_group: str) -> Optional[Dict]:
+    c.execute(
+        "UPDATE patients SET name=?, dob=?, gender=?, contact=?, blood_group=? WHERE id=? RETURNING *",
+        (name, dob, gender, contact, blood_group, patient_id)
+    )
+    patient = c.fetchone()
+    return patient
+
+@queued_write
+def delete_patient(c: sqlite3.Cursor, patient_id: int):
+    # The patient's visits and actions are purged in batches by the archiver (see purge_deleted_patient)
+    c.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+    c.execute("INSERT OR IGNORE INTO deleted_patients (patient_id, deleted_at) VALUES (?, ?)",
+              (patient_id, datetime.utcnow().isoformat()))
+    if c.rowcount:
+        # Stats stop counting them now, not once they are purged
+        for table in ARCHIVE_VIEWS:
+            for source in (f"main.{table}", f"archive.{table}"):
+                _keep_counters(c, table, source, f"patient_id = {int(patient_id)}", -1)
 
 # --- Visits ---
-def create_visit(patient_id: int, org_id: int, date: str, vitals: dict, symptoms: str, priority: str = 'normal') -> Dict:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def create_visit(c: sqlite3.Cursor, patient_id: int, org_id: int, date: str, vitals: dict, symptoms: str, priority: str = 'normal', attended_by: Optional[int] = None) -> Dict:
     c.execute(
-        "INSERT INTO clinical_visits (patient_id, organization_id, date, vitals, symptoms, priority) VALUES (?, ?, ?, ?, ?, ?) RETURNING *",
-        (patient_id, org_id, date, json.dumps(vitals) if vitals else None, symptoms, priority)
+        "INSERT INTO clinical_visits (patient_id, organization_id, date, vitals, symptoms, priority, attended_by) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
+        (patient_id, org_id, date, json.dumps(vitals) if vitals else None, symptoms, priority, attended_by)
     )
     visit = c.fetchone()
-    conn.commit()
-    conn.close()
     return visit
 
-def update_visit(visit_id: int, diagnosis: str, symptoms: str, priority: str) -> Optional[Dict]:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def update_visit(c: sqlite3.Cursor, visit_id: int, diagnosis: str, symptoms: str, priority: str) -> Optional[Dict]:
     updates = []
     params = []
     if diagnosis is not None:
@@ -317,24 +834,35 @@ def update_visit(visit_id: int, diagnosis: str, symptoms: str, priority: str) ->
     query = f"UPDATE clinical_visits SET {', '.join(updates)} WHERE id = ? RETURNING *"
     c.execute(query, tuple(params))
     visit = c.fetchone()
-    conn.commit()
-    conn.close()
     return visit
 
-def get_active_emergencies() -> List[Dict]:
+def get_active_emergencies(priorities: Optional[List[str]] = None, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Emergency/critical visits, newest first. Returns (visits, next_cursor)."""
+    priorities = list(priorities or EMERGENCY_PRIORITIES)
+    if not set(priorities) <= set(EMERGENCY_PRIORITIES):
+        raise ValueError(f"priority must be one of {', '.join(EMERGENCY_PRIORITIES)}")
+    limit = _page_size(limit)
+    # The literal priority IN (...) term lets SQLite use the partial index idx_visits_emergencies
+    where = ["v.priority IN ('emergency', 'critical')", f"v.priority IN ({','.join('?' * len(priorities))})"]
+    params: List[Any] = list(priorities)
+    if cursor:
+        where.append("(v.date, v.id) < (?, ?)")
+        params.extend(decode_cursor(cursor, 2))
+    params.append(limit + 1)
     conn = get_db()
     c = conn.cursor()
-    c.execute('''
+    c.execute(f'''
         SELECT v.*, p.name as patient_name, p.unique_id, u.name as attended_by_name
         FROM clinical_visits v
         JOIN patients p ON v.patient_id = p.id
         LEFT JOIN users u ON v.attended_by = u.id
-        WHERE v.priority IN ('emergency', 'critical')
-        ORDER BY v.date DESC
-    ''')
+        WHERE {' AND '.join(where)}
+        ORDER BY v.date DESC, v.id DESC
+        LIMIT ?
+    ''', params)
     results = c.fetchall()
     conn.close()
-    return results
+    return _page(results, limit, lambda v: (v["date"], v["id"]))
 
 def get_patient_details(patient_id: int) -> Dict:
     conn = get_db()
@@ -342,7 +870,7 @@ def get_patient_details(patient_id: int) -> Dict:
     
     c.execute('''
         SELECT v.*, o.name as orgName, u.name as staffName
-        FROM clinical_visits v
+        FROM all_visits v
         LEFT JOIN organizations o ON v.organization_id = o.id
         LEFT JOIN users u ON v.attended_by = u.id
         WHERE v.patient_id = ?
@@ -352,7 +880,7 @@ def get_patient_details(patient_id: int) -> Dict:
     
     c.execute('''
         SELECT a.*, u.name as authorName, o.name as orgName
-        FROM clinical_actions a
+        FROM all_actions a
         LEFT JOIN users u ON a.author_id = u.id
         LEFT JOIN organizations o ON a.from_organization_id = o.id
         WHERE a.patient_id = ?
@@ -364,24 +892,20 @@ def get_patient_details(patient_id: int) -> Dict:
     return {"visits": visits, "actions": actions}
 
 # --- Actions ---
-def create_action(patient_id: int, visit_id: int, author_id: int, from_org_id: int, type: str, description: str, payload: dict) -> Dict:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def create_action(c: sqlite3.Cursor, patient_id: int, visit_id: int, author_id: int, from_org_id: int, type: str, description: str, payload: dict, notes: Optional[str] = None) -> Dict:
     now = datetime.utcnow().isoformat()
     c.execute(
         '''INSERT INTO clinical_actions 
-           (patient_id, visit_id, author_id, from_organization_id, type, description, payload, created_at, updated_at) 
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING *''',
-        (patient_id, visit_id, author_id, from_org_id, type, description, json.dumps(payload) if payload else None, now, now)
+           (patient_id, visit_id, author_id, from_organization_id, type, description, payload, created_at, updated_at, notes) 
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING *''',
+        (patient_id, visit_id, author_id, from_org_id, type, description, json.dumps(payload) if payload else None, now, now, notes)
     )
     action = c.fetchone()
-    conn.commit()
-    conn.close()
     return action
 
-def update_action(action_id: int, status: str, notes: str, completed_by: int, completed_by_org_id: int) -> Optional[Dict]:
-    conn = get_db()
-    c = conn.cursor()
+@queued_write
+def update_action(c: sqlite3.Cursor, action_id: int, status: str, notes: str, completed_by: int, completed_by_org_id: int) -> Optional[Dict]:
     now = datetime.utcnow().isoformat()
     completed_at = now if status == 'completed' else None
     
@@ -392,60 +916,512 @@ def update_action(action_id: int, status: str, notes: str, completed_by: int, co
         (status, notes, completed_by, completed_by_org_id, completed_at, now, action_id)
     )
     action = c.fetchone()
-    conn.commit()
-    conn.close()
     return action
 
-def get_department_queue(roles: List[str]) -> List[Dict]:
-    role_map = {
-        'pharmacy': ['prescription'],
-        'diagnostic': ['lab_test', 'radiology'],
-        'nurse': ['observation', 'procedure', 'transfer']
-    }
-    
+def get_department_queue(roles: List[str], statuses: Optional[List[str]] = None, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """A department's actions, newest first, one keyset page at a time. Returns (actions, next_cursor).
+
+    Each (type, status) pair is read as its own index range that stops after
+    `limit` rows, and the ranges are merged. A page therefore costs the same
+    whether the table holds a thousand or ten million historical actions.
+    """
     action_types = []
     for role in roles:
-        action_types.extend(role_map.get(role, []))
+        action_types.extend(DEPARTMENT_ACTION_TYPES.get(role, []))
         
     if not action_types:
-        return []
-        
+        return [], None
+
+    statuses = list(statuses or ACTIVE_STATUSES + CLOSED_STATUSES)
+    unknown = set(statuses) - set(ACTIVE_STATUSES + CLOSED_STATUSES)
+    if unknown:
+        raise ValueError(f"Unknown status: {', '.join(sorted(unknown))}")
+    limit = _page_size(limit)
+    after = decode_cursor(cursor, 2) if cursor else None
+
+    ranges = []
+    params: List[Any] = []
+    for action_type in action_types:
+        for status in statuses:
+            # The literal status IN (...) term selects the matching partial index
+            group = ACTIVE_STATUSES if status in ACTIVE_STATUSES else CLOSED_STATUSES
+            where = (f"type = ? AND status = ? AND status IN ('{group[0]}', '{group[1]}')"
+                     " AND NOT EXISTS (SELECT 1 FROM deleted_patients d WHERE d.patient_id = clinical_actions.patient_id)")
+            params.extend([action_type, status])
+            if after:
+                where += " AND (created_at, id) < (?, ?)"
+                params.extend(after)
+            ranges.append(f"SELECT * FROM (SELECT * FROM clinical_actions WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ?)")
+            params.append(limit + 1)
+    params.append(limit + 1)
+
     conn = get_db()
     c = conn.cursor()
-    placeholders = ','.join('?' * len(action_types))
     query = f'''
+        WITH page AS (
+            {' UNION ALL '.join(ranges)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        )
         SELECT a.*, p.name as patientName, p.unique_id as uniqueId, u.name as authorName, o.name as orgName
-        FROM clinical_actions a
+        FROM page a
         LEFT JOIN patients p ON a.patient_id = p.id
         LEFT JOIN users u ON a.author_id = u.id
         LEFT JOIN organizations o ON a.from_organization_id = o.id
-        WHERE a.type IN ({placeholders})
-        ORDER BY a.created_at DESC
+        ORDER BY a.created_at DESC, a.id DESC
     '''
-    c.execute(query, action_types)
+    c.execute(query, params)
     actions = c.fetchall()
     conn.close()
-    return actions
+    return _page(actions, limit, lambda a: (a["created_at"], a["id"]))
 
-def get_stats() -> Dict:
+def get_stats(organization_id: Optional[int] = None, breakdown: bool = False) -> Dict:
+    """Dashboard counters, read from the trigger-maintained stat_counters table.
+
+    Scoping to an organization filters visits and actions; the patient
+    registry is global. `breakdown` adds per-organization visit counts and
+    per-type action counts by status.
+    """
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT COUNT(*) as count FROM patients")
-    patients = c.fetchone()['count']
-    c.execute("SELECT COUNT(*) as count FROM clinical_visits")
-    visits = c.fetchone()['count']
-    c.execute("SELECT COUNT(*) as count FROM clinical_actions WHERE status = 'pending'")
-    pending = c.fetchone()['count']
-    c.execute("SELECT COUNT(*) as count FROM clinical_actions WHERE status = 'completed'")
-    completed = c.fetchone()['count']
+    if organization_id is None:
+        c.execute("SELECT metric, organization_id, action_type, status, value FROM stat_counters WHERE value != 0")
+    else:
+        c.execute(
+            "SELECT metric, organization_id, action_type, status, value FROM stat_counters WHERE value != 0 AND (metric = 'patients' OR organization_id = ?)",
+            (organization_id,)
+        )
+    counters = c.fetchall()
+    conn.close()
+
+    totals = {"patients": 0, "visits": 0}
+    actions_by_status: Dict[str, int] = {}
+    visits_by_org: Dict[int, int] = {}
+    actions_by_type: Dict[str, Dict[str, int]] = {}
+    for row in counters:
+        metric, value = row["metric"], row["value"]
+        if metric == "actions":
+            actions_by_status[row["status"]] = actions_by_status.get(row["status"], 0) + value
+            by_status = actions_by_type.setdefault(row["action_type"], {})
+            by_status[row["status"]] = by_status.get(row["status"], 0) + value
+        else:
+            totals[metric] += value
+            if metric == "visits":
+                visits_by_org[row["organization_id"]] = visits_by_org.get(row["organization_id"], 0) + value
+
+    stats = {
+        "totalPatients": totals["patients"],
+        "totalVisits": totals["visits"],
+        "pendingActions": actions_by_status.get("pending", 0),
+        "completedActions": actions_by_status.get("completed", 0)
+    }
+    if breakdown:
+        stats["visitsByOrganization"] = visits_by_org
+        stats["actionsByType"] = actions_by_type
+    return stats
+
+@queued_write
+def check_stats(c: sqlite3.Cursor, repair: bool = False) -> List[Dict]:
+    """Recomputes the counters from the base tables and returns every row that disagrees.
+
+    Archived visits and actions still count; those of deleted patients do
+    not. Runs on the writer so no write can land between the recount and the
+    repair. With `repair`, the stored counters are replaced by the recount.
+    """
+    recount = stat_counters_sql("all_visits", "all_actions", live_only=True)
+    c.execute(f'''
+        WITH actual(metric, organization_id, action_type, status, value) AS ({recount}),
+        keys AS (
+            SELECT metric, organization_id, action_type, status FROM actual
+            UNION
+            SELECT metric, organization_id, action_type, status FROM stat_counters
+        )
+        SELECT k.metric, k.organization_id, k.action_type, k.status,
+               COALESCE(s.value, 0) as stored, COALESCE(a.value, 0) as actual
+        FROM keys k
+        LEFT JOIN stat_counters s USING (metric, organization_id, action_type, status)
+        LEFT JOIN actual a USING (metric, organization_id, action_type, status)
+        WHERE COALESCE(s.value, 0) != COALESCE(a.value, 0)
+    ''')
+    drift = c.fetchall()
+    if drift and repair:
+        c.execute("DELETE FROM stat_counters")
+        c.execute(f"INSERT INTO stat_counters (metric, organization_id, action_type, status, value) {recount}")
+        # No trigger saw this change; move the version the /api/stats ETag is checked against
+        c.execute("INSERT OR REPLACE INTO change_log (table_name, row_id, patient_id, deleted) VALUES (?, 0, NULL, 0)",
+                  (STATS_VERSION_TABLE,))
+    return drift
+
+# --- Bulk import ---
+def _new_unique_ids(c: sqlite3.Cursor, count: int) -> List[str]:
+    """`count` distinct PAT-NNNNNN ids that no patient has yet.
+
+    Runs inside a write intent, so no other insert can take an id between
+    the check and the caller's INSERT.
+    """
+    chosen = set()
+    for _ in range(100):
+        if len(chosen) == count:
+            return list(chosen)
+        draw = {f"PAT-{random.randint(100000, 999999)}" for _ in range(count - len(chosen))} - chosen
+        for chunk in [list(draw)[i:i + 500] for i in range(0, len(draw), 500)]:
+            c.execute(f"SELECT unique_id FROM patients WHERE unique_id IN ({','.join('?' * len(chunk))})", chunk)
+            draw -= {r["unique_id"] for r in c.fetchall()}
+        chosen |= draw
+    raise ValueError("Patient ID space is exhausted")
+
+@queued_write
+def import_records(c: sqlite3.Cursor, org_id: int, patients: List[tuple], visits: List[tuple], known: Dict[str, int]) -> Dict[str, Any]:
+    """Inserts one batch of a bulk import.
+
+    `patients` are (key, name, dob, gender, contact, blood_group) and
+    `visits` are (key, date, vitals, symptoms, diagnosis, priority). A
+    visit's key names a patient in this batch or, via `known`, one written
+    by an earlier batch. Returns the counts written and the new patients'
+    ids by key, for keys that are mrns.
+    """
+    unique_ids = _new_unique_ids(c, len(patients))
+    c.executemany(
+        "INSERT INTO patients (unique_id, name, dob, gender, contact, blood_group) VALUES (?, ?, ?, ?, ?, ?)",
+        [(unique_id, *p[1:]) for unique_id, p in zip(unique_ids, patients)]
+    )
+    by_unique_id = {}
+    for i in range(0, len(unique_ids), 500):
+        chunk = unique_ids[i:i + 500]
+        c.execute(f"SELECT id, unique_id FROM patients WHERE unique_id IN ({','.join('?' * len(chunk))})", chunk)
+        by_unique_id.update((r["unique_id"], r["id"]) for r in c.fetchall())
+    ids = {p[0]: by_unique_id[unique_id] for unique_id, p in zip(unique_ids, patients)}
+    c.executemany(
+        "INSERT INTO clinical_visits (patient_id, organization_id, date, vitals, symptoms, diagnosis, priority) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(ids.get(v[0]) or known[v[0]], org_id, *v[1:]) for v in visits]
+    )
+    return {
+        "patients": len(patients),
+        "visits": len(visits),
+        "mrns": {key: patient_id for key, patient_id in ids.items() if key.startswith("mrn:")},
+    }
+
+# --- Transfer bundles ---
+def export_patient(patient_id: int) -> Iterator[Tuple[str, Dict]]:
+    """A patient's full record as (kind, row) pairs, in EXPORT_QUERIES order.
+
+    Every query runs in one read transaction on a connection of its own, so
+    the record is a consistent snapshot even while the patient is being
+    treated. Rows are fetched EXPORT_CHUNK at a time, so memory stays flat
+    however long the history is. The connection is not tied to a thread,
+    so a streaming response may resume the generator from any worker
+    thread.
+    """
+    conn = connect(DATABASE_URL, check_same_thread=False)
+    try:
+        attach_archive(conn, DATABASE_URL)
+        conn.row_factory = dict_factory
+        conn.execute("BEGIN")
+        for kind, sql in EXPORT_QUERIES:
+            c = conn.execute(sql, {"patient_id": patient_id})
+            while rows := c.fetchmany(EXPORT_CHUNK):
+                for row in rows:
+                    yield kind, row
+    finally:
+        conn.close()
+
+class BundleAlreadyImported(Exception):
+    """Raised by apply_transfer_bundle for a bundle id it has applied before."""
+
+@queued_write
+def apply_transfer_bundle(c: sqlite3.Cursor, bundle_id: str, org_id: int, author_id: int, records: Dict[str, List[Dict]]) -> Dict[str, Any]:
+    """Applies a transfer bundle received by `org_id`, all or nothing.
+
+    Organizations are matched by code and users by (organization, employee
+    ID). Rows whose organization is unknown here are attributed to
+    `org_id`. Rows whose author or doctor is unknown are attributed to
+    `author_id`, the staff member importing the bundle; unknown optional
+    references are cleared. An existing patient with the same unique ID
+    and date of birth is reused. Otherwise the patient is created, under a
+    new unique ID if theirs is taken. Applying the same bundle twice
+    raises BundleAlreadyImported.
+
+    For a reused patient only rows not already here are added. A transfer
+    keeps each row's timestamp, so visits are matched on their date, actions
+    on (type, created_at) and messages on (sender, created_at). Imported
+    visits are older history, so they never take over the patient's
+    care_team from the visit that set it.
+    """
+    # The writer applies one intent at a time, so nothing can record this bundle between the check and the insert
+    c.execute("SELECT 1 FROM transfer_imports WHERE bundle_id = ?", (bundle_id,))
+    if c.fetchone():
+        raise BundleAlreadyImported(bundle_id)
+    c.execute("INSERT INTO transfer_imports (bundle_id, patient_id, organization_id, imported_at) VALUES (?, 0, ?, ?)",
+              (bundle_id, org_id, datetime.utcnow().isoformat()))
+
+    orgs, org_codes = {}, {}
+    for o in records.get("organization", []):
+        c.execute("SELECT id FROM organizations WHERE code = ?", (o["code"],))
+        local = c.fetchone()
+        if local:
+            orgs[o["id"]] = local["id"]
+            org_codes[o["id"]] = o["code"]
+    users = {}
+    for u in records.get("user", []):
+        if u["organization_id"] in orgs:
+            c.execute("SELECT id FROM users WHERE organization_id = ? AND employee_id = ?", (orgs[u["organization_id"]], u["employee_id"]))
+            local = c.fetchone()
+            if local:
+                users[u["id"]] = local["id"]
+
+    (p,) = records["patient"]
+    c.execute("SELECT * FROM patients WHERE unique_id = ?", (p["unique_id"],))
+    patient = c.fetchone()
+    created = patient is None or patient["dob"] != p["dob"]
+    if created:
+        unique_id = p["unique_id"] if patient is None else _new_unique_ids(c, 1)[0]
+        c.execute(
+            "INSERT INTO patients (unique_id, name, dob, gender, contact, blood_group) VALUES (?, ?, ?, ?, ?, ?) RETURNING *",
+            (unique_id, p["name"], p["dob"], p["gender"], p.get("contact"), p.get("blood_group"))
+        )
+        patient = c.fetchone()
+    patient_id = patient["id"]
+
+    known_visits: Dict[str, int] = {}
+    known_actions, known_messages, care_team = set(), set(), None
+    if not created:
+        c.execute("SELECT id, date FROM all_visits WHERE patient_id = ?", (patient_id,))
+        known_visits = {r["date"]: r["id"] for r in c.fetchall()}
+        c.execute("SELECT type, created_at FROM all_actions WHERE patient_id = ?", (patient_id,))
+        known_actions = {(r["type"], r["created_at"]) for r in c.fetchall()}
+        c.execute("SELECT sender, created_at FROM messages WHERE patient_id = ?", (patient_id,))
+        known_messages = {(r["sender"], r["created_at"]) for r in c.fetchall()}
+        c.execute("SELECT patient_id, visit_id, doctor_id FROM care_team WHERE patient_id = ?", (patient_id,))
+        care_team = c.fetchone()
+
+    visits, added_visits = {}, 0
+    for v in records.get("visit", []):
+        if v["date"] in known_visits:
+            visits[v["id"]] = known_visits[v["date"]]
+            continue
+        c.execute(
+            "INSERT INTO clinical_visits (patient_id, organization_id, date, vitals, symptoms, diagnosis, priority, attended_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (patient_id, orgs.get(v["organization_id"], org_id), v["date"], v.get("vitals"), v.get("symptoms"),
+             v.get("diagnosis"), v.get("priority") or "normal", users.get(v.get("attended_by")))
+        )
+        visits[v["id"]] = c.lastrowid
+        added_visits += 1
+    if care_team:
+        # The insert trigger hands care_team to each new visit id; give it back
+        c.execute("INSERT OR REPLACE INTO care_team (patient_id, visit_id, doctor_id) VALUES (?, ?, ?)",
+                  (care_team["patient_id"], care_team["visit_id"], care_team["doctor_id"]))
+    actions = [a for a in records.get("action", []) if (a["type"], a["created_at"]) not in known_actions]
+    messages = [m for m in records.get("message", []) if (m["sender"], m["created_at"]) not in known_messages]
+    c.executemany(
+        '''INSERT INTO clinical_actions
+           (patient_id, visit_id, author_id, from_organization_id, type, status, description, payload,
+            created_at, updated_at, completed_at, completed_by, completed_by_organization_id, notes)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        [(patient_id, visits.get(a.get("visit_id")), users.get(a["author_id"], author_id), orgs.get(a["from_organization_id"], org_id),
+          a["type"], a["status"], a["description"], a.get("payload"), a["created_at"], a["updated_at"], a.get("completed_at"),
+          users.get(a.get("completed_by")), orgs.get(a.get("completed_by_organization_id")), a.get("notes"))
+         for a in actions]
+    )
+    c.executemany(
+        "INSERT INTO messages (patient_id, doctor_id, sender, content, created_at, is_read) VALUES (?, ?, ?, ?, ?, ?)",
+        [(patient_id, users.get(m["doctor_id"], author_id), m["sender"], m["content"], m["created_at"], m.get("is_read") or 0)
+         for m in messages]
+    )
+    c.execute("UPDATE transfer_imports SET patient_id = ? WHERE bundle_id = ?", (patient_id, bundle_id))
+    return {
+        "patient": patient,
+        "createdPatient": created,
+        "visits": added_visits,
+        "actions": len(actions),
+        "messages": len(messages),
+        "matchedOrganizations": sorted(org_codes.values()),
+    }
+
+# --- Archive ---
+def _ids(ids: List[int]) -> str:
+    return ",".join(str(int(i)) for i in ids)
+
+def _keep_counters(c: sqlite3.Cursor, table: str, source: str, where: str, sign: int):
+    """Adds `sign` times the stat_counters contribution of the rows of `source` matching `where`."""
+    select = ARCHIVE_COUNTERS[table].format(sign=sign, source=source, where=where)
+    c.execute(f"INSERT INTO stat_counters (metric, organization_id, action_type, status, value) {select} "
+              "ON CONFLICT DO UPDATE SET value = value + excluded.value")
+
+def find_archivable(table: str, cutoff: str, after: Optional[Tuple[str, int]] = None, limit: int = ARCHIVE_BATCH) -> Tuple[List[int], Optional[Tuple[str, int]]]:
+    """Ids of up to `limit` rows of `table` that may move to the archive, oldest first, and the key to continue after."""
+    column, rule = ARCHIVE_RULES[table]
+    where, params = [rule], [cutoff]
+    if after:
+        where.append(f"({column}, id) > (?, ?)")
+        params.extend(after)
+    conn = get_db()
+    c = conn.cursor()
+    c.execute(f"SELECT id, {column} as key FROM main.{table} WHERE {' AND '.join(where)} ORDER BY {column}, id LIMIT ?",
+              params + [limit])
+    rows = c.fetchall()
+    conn.close()
+    return [r["id"] for r in rows], ((rows[-1]["key"], rows[-1]["id"]) if rows else None)
+
+@queued_write
+def copy_to_archive(c: sqlite3.Cursor, table: str, ids: List[int], cutoff: str) -> int:
+    """Copies rows to the archive. The hot rows stay until purge_archived, so readers never miss them."""
+    c.execute(f"INSERT OR REPLACE INTO archive.{table} SELECT * FROM main.{table} WHERE id IN ({_ids(ids)}) AND {ARCHIVE_RULES[table][1]}",
+              (cutoff,))
+    return c.rowcount
+
+@queued_write
+def purge_archived(c: sqlite3.Cursor, table: str, ids: List[int], cutoff: str) -> int:
+    """Deletes the hot copy of rows that are safely in the archive and still eligible to be there.
+
+    The delete triggers count these rows out of stat_counters and log them
+    as deleted. They are counted back in, since an archived visit or action
+    still happened, and logged as changed instead, so /api/sync keeps them.
+    """
+    c.execute(f'''
+        SELECT id FROM main.{table}
+        WHERE id IN ({_ids(ids)}) AND {ARCHIVE_RULES[table][1]}
+          AND EXISTS (SELECT 1 FROM archive.{table} x WHERE x.id = main.{table}.id)
+    ''', (cutoff,))
+    confirmed = [r["id"] for r in c.fetchall()]
+    if confirmed:
+        _keep_counters(c, table, f"main.{table}", f"id IN ({_ids(confirmed)})", 1)
+        c.execute(f"DELETE FROM main.{table} WHERE id IN ({_ids(confirmed)})")
+        c.execute(f"UPDATE change_log SET deleted = 0 WHERE table_name = ? AND row_id IN ({_ids(confirmed)})",
+                  (CHANGE_LOG_NAMES[table],))
+    return len(confirmed)
+
+def get_deleted_patients() -> List[int]:
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT patient_id FROM deleted_patients ORDER BY deleted_at")
+    rows = c.fetchall()
+    conn.close()
+    return [r["patient_id"] for r in rows]
+
+@queued_write
+def purge_deleted_patient(c: sqlite3.Cursor, patient_id: int, limit: int = ARCHIVE_BATCH) -> int:
+    """Deletes up to `limit` of a deleted patient's hot or archived rows; returns 0 once nothing is left."""
+    for source, table in (("main", "clinical_actions"), ("main", "clinical_visits"),
+                          ("archive", "clinical_actions"), ("archive", "clinical_visits")):
+        c.execute(f"SELECT id FROM {source}.{table} WHERE patient_id = ? LIMIT ?", (patient_id, limit))
+        ids = [r["id"] for r in c.fetchall()]
+        if ids:
+            if source == "main":
+                # delete_patient already took these rows out of the counters; undo the delete triggers' decrement
+                _keep_counters(c, table, f"main.{table}", f"id IN ({_ids(ids)})", 1)
+            else:
+                # No triggers on the archive: log the deletion here, which also moves the version /api/sync and /api/stats check
+                c.execute(f"INSERT OR REPLACE INTO change_log (table_name, row_id, patient_id, deleted) "
+                          f"SELECT ?, id, patient_id, 1 FROM archive.{table} WHERE id IN ({_ids(ids)})",
+                          (CHANGE_LOG_NAMES[table],))
+            c.execute(f"DELETE FROM {source}.{table} WHERE id IN ({_ids(ids)})")
+            return len(ids)
+    c.execute("DELETE FROM deleted_patients WHERE patient_id = ?", (patient_id,))
+    return 0
+
+@queued_write
+def incremental_vacuum(c: sqlite3.Cursor, pages: int) -> int:
+    """Returns up to `pages` free pages of each database file to the OS; returns how many were freed."""
+    freed = 0
+    for schema in ("main", "archive"):
+        before = c.execute(f"PRAGMA {schema}.freelist_count").fetchone()["freelist_count"]
+        c.execute(f"PRAGMA {schema}.incremental_vacuum({int(pages)})").fetchall()
+        freed += before - c.execute(f"PRAGMA {schema}.freelist_count").fetchone()["freelist_count"]
+    return freed
+
+# --- Delta sync ---
+def get_changes(since: Optional[str] = None, tables: Optional[List[str]] = None, patient_id: Optional[int] = None, limit: int = SYNC_LIMIT) -> Dict:
+    """Rows changed after the `since` cursor, read through the change log.
+
+    Returns {"cursor", "changes": {table: [rows]}, "deleted": {table: [ids]},
+    "more"}. Without `since` nothing is returned but the current cursor, which
+    a client takes before its initial full load. When nothing has changed
+    this is one index probe per table. Unless there is more to read, the
+    returned cursor is the newest entry of any table, so entries of tables
+    the caller does not follow are never examined again.
+    """
+    tables = list(tables or SYNC_QUERIES)
+    unknown = set(tables) - set(SYNC_QUERIES)
+    if unknown:
+        raise ValueError(f"Unknown table: {', '.join(sorted(unknown))}")
+    conn = get_db()
+    c = conn.cursor()
+    c.execute("SELECT COALESCE(MAX(seq), 0) as seq FROM change_log")
+    newest = c.fetchone()["seq"]
+    if since is None:
+        conn.close()
+        return {"cursor": encode_cursor(newest), "changes": {}, "deleted": {}, "more": False}
+
+    (after,) = decode_cursor(since, 1)
+    limit = _page_size(limit)
+    if patient_id is not None:
+        # The unary + keeps SQLite on the patient's seq range instead of scanning the (table_name, ...) indexes
+        c.execute(f'''
+            SELECT seq, table_name, row_id, deleted FROM change_log
+            WHERE patient_id = ? AND seq > ? AND seq <= ? AND +table_name IN ({','.join('?' * len(tables))})
+            ORDER BY seq LIMIT ?
+        ''', [patient_id, after, newest, *tables, limit + 1])
+        entries = c.fetchall()
+    else:
+        # One (table_name, seq) range per table, merged by seq
+        entries = []
+        for table in tables:
+            c.execute("SELECT seq, table_name, row_id, deleted FROM change_log WHERE table_name = ? AND seq > ? AND seq <= ? ORDER BY seq LIMIT ?",
+                      (table, after, newest, limit + 1))
+            entries.extend(c.fetchall())
+        entries.sort(key=lambda entry: entry["seq"])
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    live: Dict[str, List[int]] = {}
+    deleted: Dict[str, List[int]] = {}
+    for entry in entries:
+        (deleted if entry["deleted"] else live).setdefault(entry["table_name"], []).append(entry["row_id"])
+    changes = {}
+    for table, ids in live.items():
+        c.execute(SYNC_QUERIES[table].format(ids=",".join("?" * len(ids))), ids)
+        changes[table] = c.fetchall()
     conn.close()
     return {
-        "totalPatients": patients,
-        "totalVisits": visits,
-        "pendingActions": pending,
-        "completedActions": completed
+        "cursor": encode_cursor(entries[-1]["seq"] if more else max(newest, after)),
+        "changes": changes,
+        "deleted": deleted,
+        "more": more
     }
 
+def get_version(tables: List[str], patient_id: Optional[int] = None) -> int:
+    """The change_log seq of the latest change to `tables` (optionally one patient's rows), 0 if none.
+
+    Any write to a row a view reads moves this number, so it is a cheap
+    validator for that view: one probe of the (table_name, seq) index per
+    table, or one walk down the top of the patient's entries.
+    """
+    conn = get_db()
+    c = conn.cursor()
+    if patient_id is None:
+        c.execute(" UNION ALL ".join(["SELECT MAX(seq) as seq FROM change_log WHERE table_name = ?"] * len(tables)), tables)
+        versions = [row["seq"] for row in c.fetchall() if row["seq"] is not None]
+        conn.close()
+        return max(versions, default=0)
+    c.execute(f"SELECT seq FROM change_log WHERE patient_id = ? AND +table_name IN ({','.join('?' * len(tables))}) ORDER BY seq DESC LIMIT 1",
+              [patient_id, *tables])
+    row = c.fetchone()
+    conn.close()
+    return row["seq"] if row else 0
+
 if __name__ == "__main__":
+    import sys
+
     init_db()
-    print("mediconnect.db initialized successfully.")
+    if "--check-stats" in sys.argv:
+        repair = "--repair" in sys.argv
+        drift = check_stats(repair)
+        for row in drift:
+            print(f"{row['metric']} org={row['organization_id']} type={row['action_type'] or '-'} "
+                  f"status={row['status'] or '-'}: stored {row['stored']}, actual {row['actual']}")
+        if drift:
+            print(f"{len(drift)} counters were out of date" + (" and have been repaired." if repair else "; rerun with --repair to fix them."))
+            sys.exit(0 if repair else 1)
+        print("Stats counters are consistent.")
+    else:
+        print("mediconnect.db initialized successfully.")
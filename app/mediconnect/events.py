@@ -0,0 +1,229 @@
+"""
+Pub/sub backends behind the WebSocket ConnectionManager.
+
+A bus carries already-serialized events, each with its topics, to every
+worker process. The manager publishes to the bus. The bus calls the
+manager's deliver(text, topics) on the event loop of every process that
+should see the event, including the publisher's own process.
+
+Backends:
+
+* LocalBus delivers within the current process. It is the default and
+  all a single-worker deployment needs.
+* JournalBus appends events to a small shared SQLite file and every
+  worker tails it. Broadcasts then reach all workers on one host, e.g.
+  `uvicorn --workers 4`. Enable it with MEDICONNECT_EVENT_BUS=journal.
+
+start() is awaited once, on the event loop that receives deliveries.
+publish() must never block the event loop.
+"""
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.mediconnect import database as mediconnect_db
+
+BUS_DATABASE_URL = str(Path(__file__).parent.parent.parent / "data" / "mediconnect_events.db")
+POLL_INTERVAL = 0.005  # seconds between checks for events from other workers
+RETAIN_EVENTS = 10000  # journal rows kept for late readers; older ones are trimmed
+MAX_RETRY_DELAY = 1.0  # seconds; retries after a journal error back off up to this
+
+Deliver = Callable[[str, List[str]], None]
+
+class LocalBus:
+    """Delivers every event to this process only."""
+
+    name = "local"
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+        self.published = 0
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    def publish(self, text: str, topics: List[str]):
+        self.published += 1
+        self._deliver(text, topics)
+
+    def close(self):
+        pass
+
+    def snapshot(self) -> Dict:
+        return {"backend": self.name, "published": self.published}
+
+class JournalBus:
+    """Shares events between the worker processes on one host through a tailed SQLite journal.
+
+    Local subscribers get an event at once. A background thread appends
+    batches of published events to the journal. The same thread watches
+    PRAGMA data_version, which changes only when another connection
+    commits, and reads new rows whenever it moves. Idle polling therefore
+    never touches the table.
+
+    A journal error (e.g. SQLITE_BUSY past the busy timeout) is recorded in
+    snapshot(). The thread then reopens the journal and retries with
+    backoff. Unsent events are kept for the retry, but at most `retain` of
+    them, since other workers could not read older ones anyway.
+    """
+
+    name = "journal"
+
+    def __init__(self, path: str = BUS_DATABASE_URL, poll_interval: float = POLL_INTERVAL, retain: int = RETAIN_EVENTS):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retain = retain
+        self.origin = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self._unsent = 0
+        self._deliver: Optional[Deliver] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._outbox: "queue.SimpleQueue[Optional[Tuple[str, List[str]]]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._run, name="mediconnect-event-bus", daemon=True)
+        self._thread.start()
+        # Start tailing from the current end of the journal before anything is published
+        await asyncio.to_thread(self._ready.wait, 5)
+
+    def publish(self, text: str, topics: List[str]):
+        self.published += 1
+        self._deliver(text, topics)
+        self._outbox.put((text, topics))
+
+    def close(self):
+        if self._thread is not None:
+            self._outbox.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def snapshot(self) -> Dict:
+        return {
+            "backend": self.name,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "published": self.published,
+            "received": self.received,
+            "unsent": self._outbox.qsize() + self._unsent,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "lastError": self.last_error,
+        }
+
+    def _open(self) -> sqlite3.Connection:
+        conn = mediconnect_db.connect(self.path, isolation_level=None)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origin TEXT NOT NULL,
+                    topics TEXT NOT NULL, -- JSON array
+                    payload TEXT NOT NULL
+                )
+            ''')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _run(self):
+        conn: Optional[sqlite3.Connection] = None
+        last_id: Optional[int] = None
+        data_version = None
+        batch: List[Tuple[str, List[str]]] = []
+        delay = self.poll_interval
+        closing = False
+        while True:
+            try:
+                item = self._outbox.get(timeout=self.poll_interval)
+                while item is not None:
+                    batch.append(item)
+                    item = self._outbox.get_nowait()
+                closing = True
+            except queue.Empty:
+                pass
+            if len(batch) > self.retain:
+                self.dropped += len(batch) - self.retain
+                del batch[:-self.retain]
+            self._unsent = len(batch)
+            try:
+                if conn is None:
+                    conn = self._open()
+                    if last_id is None:
+                        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+                    # A reopened journal is read from last_id straight away, in case rows arrived meanwhile
+                    data_version = None
+                    self._ready.set()
+                if batch:
+                    self._append(conn, batch)
+                    batch = []
+                    self._unsent = 0
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != data_version:
+                    data_version = version
+                    last_id = self._tail(conn, last_id)
+                delay = self.poll_interval
+            except Exception as e:
+                # Keep the thread alive: unsent events stay in `batch` and are retried after a backoff
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Event journal {self.path} failed: {e}")
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                if not closing:
+                    time.sleep(delay)
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+            if closing:
+                break
+        if conn is not None:
+            conn.close()
+
+    def _append(self, conn: sqlite3.Connection, batch: List[Tuple[str, List[str]]]):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO events (origin, topics, payload) VALUES (?, ?, ?)",
+                [(self.origin, json.dumps(topics), text) for text, topics in batch]
+            )
+            conn.execute("DELETE FROM events WHERE id <= last_insert_rowid() - ?", (self.retain,))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def _tail(self, conn: sqlite3.Connection, last_id: int) -> int:
+        rows = conn.execute("SELECT id, origin, topics, payload FROM events WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+        events = [(payload, json.loads(topics)) for _, origin, topics, payload in rows if origin != self.origin]
+        if events:
+            self.received += len(events)
+            self._loop.call_soon_threadsafe(self._deliver_batch, events)
+        return rows[-1][0] if rows else last_id
+
+    def _deliver_batch(self, events: List[Tuple[str, List[str]]]):
+        for text, topics in events:
+            self._deliver(text, topics)
+
+BACKENDS = {"local": LocalBus, "journal": JournalBus}
+
+def create_bus():
+    """The bus selected by MEDICONNECT_EVENT_BUS (local or journal)."""
+    name = os.getenv("MEDICONNECT_EVENT_BUS", "local")
+    if name not in BACKENDS:
+        raise ValueError(f"MEDICONNECT_EVENT_BUS must be one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
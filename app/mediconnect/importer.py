@@ -0,0 +1,177 @@
+"""
+Bulk import of a hospital's existing patient registry.
+
+POST /api/admin/organizations/{org_id}/import streams a CSV file (with a
+header row) or NDJSON (one JSON object per line). Each record is one
+patient, optionally with one visit at the importing organization:
+
+    name, dob, gender, contact, bloodGroup    the patient
+    mrn                                       the hospital's own record number
+    visitDate, symptoms, diagnosis,           a visit; every visit field needs
+    priority, vitals                          visitDate
+
+Records that share an `mrn` are one patient, so a registry exported one
+row per visit still creates each patient once. Records that fail
+validation, or are not valid UTF-8, are skipped and reported by line
+number; the rest are written IMPORT_BATCH records per write intent, with
+executemany, so 100k patients cost a few dozen commits instead of 100k.
+
+Records are parsed as the body arrives and only one batch is held in
+memory. A CSV record must fit on a single line.
+"""
+import csv
+import json
+import time
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.mediconnect import async_database as async_db
+from app.mediconnect.database import IMPORT_BATCH
+
+MAX_REPORTED_ERRORS = 100
+BLOOD_GROUPS = {"A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"}
+GENDERS = {"m": "Male", "male": "Male", "f": "Female", "female": "Female", "o": "Other", "other": "Other"}
+PRIORITIES = {"normal", "emergency", "critical"}
+VISIT_FIELDS = ("visitDate", "symptoms", "diagnosis", "priority", "vitals")
+
+
+def _text(record: Dict[str, Any], field: str) -> Optional[str]:
+    value = record.get(field)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def validate(record: Dict[str, Any]) -> Tuple[tuple, Optional[tuple]]:
+    """Checks one record. Returns (patient, visit or None) as insert parameters; raises ValueError."""
+    name = _text(record, "name")
+    if not name:
+        raise ValueError("name is required")
+    try:
+        dob = date.fromisoformat(_text(record, "dob") or "")
+    except ValueError:
+        raise ValueError("dob must be a YYYY-MM-DD date")
+    if dob > date.today():
+        raise ValueError("dob is in the future")
+    gender = GENDERS.get((_text(record, "gender") or "").lower())
+    if not gender:
+        raise ValueError("gender must be Male, Female or Other")
+    blood_group = _text(record, "bloodGroup")
+    if blood_group is not None and blood_group.upper() not in BLOOD_GROUPS:
+        raise ValueError(f"unknown bloodGroup {blood_group!r}")
+    patient = (name, dob.isoformat(), gender, _text(record, "contact"), blood_group and blood_group.upper())
+
+    if not any(_text(record, field) for field in VISIT_FIELDS):
+        return patient, None
+    try:
+        visit_date = datetime.fromisoformat(_text(record, "visitDate") or "")
+    except ValueError:
+        raise ValueError("visitDate must be an ISO date or datetime")
+    priority = (_text(record, "priority") or "normal").lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(sorted(PRIORITIES))}")
+    vitals = record.get("vitals")
+    if isinstance(vitals, str) and vitals.strip():
+        try:
+            vitals = json.loads(vitals)
+        except ValueError:
+            raise ValueError("vitals must be a JSON object")
+    if vitals and not isinstance(vitals, dict):
+        raise ValueError("vitals must be a JSON object")
+    visit = (visit_date.isoformat(), json.dumps(vitals) if vitals else None,
+             _text(record, "symptoms"), _text(record, "diagnosis"), priority)
+    return patient, visit
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Splits a streamed body into raw lines without holding more than one chunk's worth."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def read_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    """(line number, record) for every non-blank line; a record that cannot be parsed is the ValueError."""
+    header = None
+    line_no = 0
+    async for raw in _lines(chunks):
+        line_no += 1
+        try:
+            line = raw.decode("utf-8-sig" if line_no == 1 else "utf-8").rstrip("\r")
+        except UnicodeDecodeError as e:
+            if fmt != "ndjson" and header is None:
+                # Without a header no line can be read; undecodable names just match no field
+                line = raw.decode("utf-8-sig", errors="replace").rstrip("\r")
+            else:
+                yield line_no, ValueError(f"not valid UTF-8 (byte {e.start})")
+                continue
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_no, ValueError("not valid JSON")
+                continue
+            yield line_no, record if isinstance(record, dict) else ValueError("not a JSON object")
+        elif header is None:
+            header = [field.strip() for field in next(csv.reader([line]))]
+        else:
+            values = next(csv.reader([line]))
+            if len(values) > len(header):
+                yield line_no, ValueError(f"{len(values)} fields, header has {len(header)}")
+                continue
+            yield line_no, dict(zip(header, values))
+
+
+async def import_stream(org_id: int, chunks: AsyncIterator[bytes], fmt: str = "csv") -> Dict[str, Any]:
+    """Validates and writes every record in the stream. Returns the import summary."""
+    start = time.perf_counter()
+    known: Dict[str, int] = {}  # mrn -> patient id, for patients written by earlier batches
+    patients: List[tuple] = []
+    visits: List[tuple] = []
+    batch_keys = set()
+    summary = {"rows": 0, "patients": 0, "visits": 0, "rejected": 0, "errors": []}
+
+    async def flush():
+        if patients or visits:
+            written = await async_db.import_records(org_id, patients, visits, known)
+            known.update(written["mrns"])
+            summary["patients"] += written["patients"]
+            summary["visits"] += written["visits"]
+        patients.clear()
+        visits.clear()
+        batch_keys.clear()
+
+    async for line_no, record in read_records(chunks, fmt):
+        summary["rows"] += 1
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            patient, visit = validate(record)
+        except ValueError as e:
+            summary["rejected"] += 1
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append({"line": line_no, "error": str(e)})
+            continue
+        # Records without an mrn are always a new patient
+        key = f"mrn:{_text(record, 'mrn')}" if _text(record, "mrn") else f"line:{line_no}"
+        if key not in known and key not in batch_keys:
+            batch_keys.add(key)
+            patients.append((key, *patient))
+        if visit:
+            visits.append((key, *visit))
+        if len(patients) + len(visits) >= IMPORT_BATCH:
+            await flush()
+    await flush()
+
+    seconds = time.perf_counter() - start
+    summary["seconds"] = round(seconds, 3)
+    summary["rowsPerSecond"] = round(summary["rows"] / seconds) if seconds else None
+    return summary
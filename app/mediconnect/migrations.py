@@ -0,0 +1,319 @@
+"""
+Versioned schema migrations for mediconnect.db.
+
+The schema version lives in SQLite's `PRAGMA user_version`. init_db() creates
+the base tables and then calls migrate(), which applies every migration newer
+than the stored version, in order, each in its own transaction. To change the
+schema, append a new (version, description, statements) entry to MIGRATIONS;
+never edit one that has already shipped.
+
+Run `python -m app.mediconnect.migrations --backfill-care-team` to compute
+the care_team assignment of every existing patient. tests/test_query_plans.py
+checks that none of the hot dashboard queries fall back to a full table scan.
+"""
+import sqlite3
+import sys
+from typing import List, Tuple
+
+def _counter(metric: str, organization_id: str, action_type: str, status: str, delta: int) -> str:
+    """Trigger statement that adds `delta` to one stat_counters row, creating it if needed."""
+    return (
+        "INSERT INTO stat_counters (metric, organization_id, action_type, status, value) "
+        f"VALUES ({metric}, {organization_id}, {action_type}, {status}, {delta}) "
+        f"ON CONFLICT DO UPDATE SET value = value + {delta};"
+    )
+
+def _change_log_triggers(table: str, name: str, patient_column: str) -> List[str]:
+    """Triggers that move a row's change_log entry to a fresh sequence number on every insert, update and delete."""
+    statements = []
+    for event, ref, deleted in (("INSERT", "new", 0), ("UPDATE", "new", 0), ("DELETE", "old", 1)):
+        statements.append(f"""CREATE TRIGGER IF NOT EXISTS changes_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+            INSERT OR REPLACE INTO change_log (table_name, row_id, patient_id, deleted)
+            VALUES ('{name}', {ref}.id, {ref}.{patient_column}, {deleted});
+        END""")
+    return statements
+
+def _care_team_doctor(visit: str) -> str:
+    """SQL for the doctor who owns `visit`: its attending doctor, else a doctor at its organization.
+
+    NULL when the visit has no attending staff or the organization has no
+    doctor; message routing then falls back to any doctor.
+    """
+    return f"""CASE WHEN {visit}.attended_by IS NULL THEN NULL ELSE COALESCE(
+        (SELECT id FROM users WHERE id = {visit}.attended_by AND role = 'doctor'),
+        (SELECT id FROM users WHERE role = 'doctor' AND organization_id = COALESCE(
+            {visit}.organization_id, (SELECT organization_id FROM users WHERE id = {visit}.attended_by)) LIMIT 1)
+    ) END"""
+
+# care_team rows for the patients with ids in (?, ?], from each one's latest visit
+CARE_TEAM_SQL = f"""
+    SELECT v.patient_id, v.id, {_care_team_doctor("v")}
+    FROM clinical_visits v
+    WHERE v.id IN (SELECT MAX(id) FROM clinical_visits WHERE patient_id > ? AND patient_id <= ? GROUP BY patient_id)
+"""
+
+MESSAGE_PREVIEW_CHARS = 200
+
+def _epoch_ms(timestamp: str) -> str:
+    """SQL for an ISO-8601 timestamp as integer Unix milliseconds."""
+    return f"CAST(ROUND((julianday({timestamp}) - 2440587.5) * 86400000) AS INTEGER)"
+
+def _unread(side: str, message: str) -> str:
+    """SQL that is 1 when `message` is unread by `side` (doctor or patient), else 0."""
+    sender = "patient" if side == "doctor" else "doctor"
+    return f"({message}.sender = '{sender}' AND NOT {message}.is_read)"
+
+_OLD_THREAD = "patient_id = old.patient_id AND doctor_id = old.doctor_id"
+
+def _conversations(where: str = "") -> str:
+    """INSERT statement computing the conversations row of every thread matching `where` from its messages."""
+    return f"""INSERT INTO conversations (patient_id, doctor_id, last_message_id, last_sender, preview, last_activity,
+                                       unread_by_doctor, unread_by_patient)
+        SELECT t.patient_id, t.doctor_id, m.id, m.sender, substr(m.content, 1, {MESSAGE_PREVIEW_CHARS}),
+               {_epoch_ms("m.created_at")}, t.unread_by_doctor, t.unread_by_patient
+        FROM (
+            SELECT patient_id, doctor_id, MAX(id) as last_id,
+                   SUM({_unread("doctor", "messages")}) as unread_by_doctor,
+                   SUM({_unread("patient", "messages")}) as unread_by_patient
+            FROM messages {where} GROUP BY patient_id, doctor_id
+        ) t
+        JOIN messages m ON m.id = t.last_id"""
+
+def stat_counters_sql(visits: str = "clinical_visits", actions: str = "clinical_actions", live_only: bool = False) -> str:
+    """Recomputes every stat_counters row from the base tables (or views over them).
+
+    With `live_only`, rows of deleted patients still waiting to be purged
+    are left out, as delete_patient already took them out of the counters.
+    """
+    live = "WHERE patient_id NOT IN (SELECT patient_id FROM deleted_patients)" if live_only else ""
+    return f"""
+    SELECT 'patients', 0, '', '', COUNT(*) FROM patients
+    UNION ALL
+    SELECT 'visits', organization_id, '', '', COUNT(*) FROM {visits} {live} GROUP BY organization_id
+    UNION ALL
+    SELECT 'actions', from_organization_id, type, status, COUNT(*) FROM {actions} {live}
+    GROUP BY from_organization_id, type, status
+"""
+
+STAT_COUNTERS_SQL = stat_counters_sql()
+
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Indexes for department queues and patient timelines", [
+        "CREATE INDEX IF NOT EXISTS idx_actions_type_created ON clinical_actions(type, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_actions_patient_created ON clinical_actions(patient_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_visits_patient_date ON clinical_visits(patient_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_visits_priority_date ON clinical_visits(priority, date)",
+    ]),
+    (2, "Indexes for patient-doctor messaging", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_doctor_patient ON messages(doctor_id, patient_id)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_patient ON messages(patient_id)",
+    ]),
+    (3, "Partial indexes for status-filtered queues and emergencies", [
+        "DROP INDEX IF EXISTS idx_actions_type_created",
+        "CREATE INDEX IF NOT EXISTS idx_actions_active ON clinical_actions(type, status, created_at) WHERE status IN ('pending', 'in_progress')",
+        "CREATE INDEX IF NOT EXISTS idx_actions_closed ON clinical_actions(type, status, created_at) WHERE status IN ('completed', 'cancelled')",
+        "DROP INDEX IF EXISTS idx_visits_priority_date",
+        "CREATE INDEX IF NOT EXISTS idx_visits_emergencies ON clinical_visits(date) WHERE priority IN ('emergency', 'critical')",
+    ]),
+    (4, "FTS5 trigram index for patient search", [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+            name, unique_id, contact,
+            content='patients', content_rowid='id', tokenize='trigram'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN
+            INSERT INTO patients_fts(rowid, name, unique_id, contact) VALUES (new.id, new.name, new.unique_id, new.contact);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+            INSERT INTO patients_fts(patients_fts, rowid, name, unique_id, contact) VALUES ('delete', old.id, old.name, old.unique_id, old.contact);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF name, unique_id, contact ON patients BEGIN
+            INSERT INTO patients_fts(patients_fts, rowid, name, unique_id, contact) VALUES ('delete', old.id, old.name, old.unique_id, old.contact);
+            INSERT INTO patients_fts(rowid, name, unique_id, contact) VALUES (new.id, new.name, new.unique_id, new.contact);
+        END""",
+        "INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Trigger-maintained counters behind /api/stats", [
+        """CREATE TABLE IF NOT EXISTS stat_counters (
+            metric TEXT NOT NULL, -- patients, visits, actions
+            organization_id INTEGER NOT NULL, -- 0 for the global patient registry
+            action_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, organization_id, action_type, status)
+        ) WITHOUT ROWID""",
+        """CREATE TRIGGER IF NOT EXISTS stats_patients_ai AFTER INSERT ON patients BEGIN
+            %s
+        END""" % _counter("'patients'", "0", "''", "''", 1),
+        """CREATE TRIGGER IF NOT EXISTS stats_patients_ad AFTER DELETE ON patients BEGIN
+            %s
+        END""" % _counter("'patients'", "0", "''", "''", -1),
+        """CREATE TRIGGER IF NOT EXISTS stats_visits_ai AFTER INSERT ON clinical_visits BEGIN
+            %s
+        END""" % _counter("'visits'", "new.organization_id", "''", "''", 1),
+        """CREATE TRIGGER IF NOT EXISTS stats_visits_ad AFTER DELETE ON clinical_visits BEGIN
+            %s
+        END""" % _counter("'visits'", "old.organization_id", "''", "''", -1),
+        """CREATE TRIGGER IF NOT EXISTS stats_visits_au AFTER UPDATE OF organization_id ON clinical_visits BEGIN
+            %s
+            %s
+        END""" % (_counter("'visits'", "old.organization_id", "''", "''", -1),
+                  _counter("'visits'", "new.organization_id", "''", "''", 1)),
+        """CREATE TRIGGER IF NOT EXISTS stats_actions_ai AFTER INSERT ON clinical_actions BEGIN
+            %s
+        END""" % _counter("'actions'", "new.from_organization_id", "new.type", "new.status", 1),
+        """CREATE TRIGGER IF NOT EXISTS stats_actions_ad AFTER DELETE ON clinical_actions BEGIN
+            %s
+        END""" % _counter("'actions'", "old.from_organization_id", "old.type", "old.status", -1),
+        """CREATE TRIGGER IF NOT EXISTS stats_actions_au AFTER UPDATE OF from_organization_id, type, status ON clinical_actions BEGIN
+            %s
+            %s
+        END""" % (_counter("'actions'", "old.from_organization_id", "old.type", "old.status", -1),
+                  _counter("'actions'", "new.from_organization_id", "new.type", "new.status", 1)),
+        "DELETE FROM stat_counters",
+        "INSERT INTO stat_counters (metric, organization_id, action_type, status, value) " + STAT_COUNTERS_SQL,
+    ]),
+    (6, "Change log for delta sync", [
+        # One entry per changed row; REPLACE gives the row a new, higher seq on every change
+        """CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL, -- patients, visits, actions, messages
+            row_id INTEGER NOT NULL,
+            patient_id INTEGER,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (table_name, row_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_change_log_patient ON change_log(patient_id, seq)",
+        *_change_log_triggers("patients", "patients", "id"),
+        *_change_log_triggers("clinical_visits", "visits", "patient_id"),
+        *_change_log_triggers("clinical_actions", "actions", "patient_id"),
+        *_change_log_triggers("messages", "messages", "patient_id"),
+    ]),
+    (7, "care_team assignments for message routing", [
+        # The doctor a patient's messages go to, kept in step with their latest visit.
+        # Existing patients are filled in by `--backfill-care-team`.
+        """CREATE TABLE IF NOT EXISTS care_team (
+            patient_id INTEGER PRIMARY KEY,
+            visit_id INTEGER NOT NULL, -- the latest visit, which decided doctor_id
+            doctor_id INTEGER
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS care_team_visits_ai AFTER INSERT ON clinical_visits
+        WHEN new.id >= COALESCE((SELECT visit_id FROM care_team WHERE patient_id = new.patient_id), 0) BEGIN
+            INSERT OR REPLACE INTO care_team (patient_id, visit_id, doctor_id) VALUES (new.patient_id, new.id, {_care_team_doctor("new")});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS care_team_visits_au AFTER UPDATE OF attended_by, organization_id ON clinical_visits
+        WHEN new.id = (SELECT visit_id FROM care_team WHERE patient_id = new.patient_id) BEGIN
+            UPDATE care_team SET doctor_id = {_care_team_doctor("new")} WHERE patient_id = new.patient_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS care_team_visits_ad AFTER DELETE ON clinical_visits
+        WHEN old.id = (SELECT visit_id FROM care_team WHERE patient_id = old.patient_id) BEGIN
+            DELETE FROM care_team WHERE patient_id = old.patient_id;
+            INSERT INTO care_team (patient_id, visit_id, doctor_id)
+            SELECT v.patient_id, v.id, {_care_team_doctor("v")} FROM clinical_visits v
+            WHERE v.patient_id = old.patient_id ORDER BY v.id DESC LIMIT 1;
+        END""",
+    ]),
+    (8, "Conversations behind the doctor inbox and unread counts", [
+        """CREATE TABLE IF NOT EXISTS conversations (
+            patient_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_sender TEXT NOT NULL,
+            preview TEXT NOT NULL, -- the start of the last message
+            last_activity INTEGER NOT NULL, -- Unix milliseconds of the last message
+            unread_by_doctor INTEGER NOT NULL DEFAULT 0,
+            unread_by_patient INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (patient_id, doctor_id)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_inbox ON conversations(doctor_id, last_activity, last_message_id)",
+        # Read marks only ever touch the unread tail of a thread
+        "CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(patient_id, doctor_id, sender) WHERE is_read = 0",
+        f"""CREATE TRIGGER IF NOT EXISTS conversations_messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO conversations (patient_id, doctor_id, last_message_id, last_sender, preview, last_activity,
+                                       unread_by_doctor, unread_by_patient)
+            VALUES (new.patient_id, new.doctor_id, new.id, new.sender, substr(new.content, 1, {MESSAGE_PREVIEW_CHARS}),
+                    {_epoch_ms("new.created_at")}, {_unread("doctor", "new")}, {_unread("patient", "new")})
+            ON CONFLICT (patient_id, doctor_id) DO UPDATE SET
+                last_sender = CASE WHEN excluded.last_message_id > last_message_id THEN excluded.last_sender ELSE last_sender END,
+                preview = CASE WHEN excluded.last_message_id > last_message_id THEN excluded.preview ELSE preview END,
+                last_activity = CASE WHEN excluded.last_message_id > last_message_id THEN excluded.last_activity ELSE last_activity END,
+                last_message_id = MAX(last_message_id, excluded.last_message_id),
+                unread_by_doctor = unread_by_doctor + excluded.unread_by_doctor,
+                unread_by_patient = unread_by_patient + excluded.unread_by_patient;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS conversations_messages_read AFTER UPDATE OF is_read ON messages
+        WHEN (old.is_read != 0) != (new.is_read != 0) BEGIN
+            UPDATE conversations SET
+                unread_by_doctor = unread_by_doctor + {_unread("doctor", "new")} - {_unread("doctor", "old")},
+                unread_by_patient = unread_by_patient + {_unread("patient", "new")} - {_unread("patient", "old")}
+            WHERE patient_id = new.patient_id AND doctor_id = new.doctor_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS conversations_messages_ad AFTER DELETE ON messages BEGIN
+            UPDATE conversations SET
+                unread_by_doctor = unread_by_doctor - {_unread("doctor", "old")},
+                unread_by_patient = unread_by_patient - {_unread("patient", "old")}
+            WHERE {_OLD_THREAD} AND last_message_id != old.id;
+            -- Deleting the last message hands the thread to the one before it, or ends it
+            DELETE FROM conversations WHERE {_OLD_THREAD} AND last_message_id = old.id;
+            {_conversations(f"WHERE {_OLD_THREAD} AND NOT EXISTS (SELECT 1 FROM conversations WHERE {_OLD_THREAD})")};
+        END""",
+        _conversations(),
+    ]),
+    (9, "Archival and deferred patient purge", [
+        # Deleted patients whose visits and actions the archiver has yet to purge
+        """CREATE TABLE IF NOT EXISTS deleted_patients (
+            patient_id INTEGER PRIMARY KEY,
+            deleted_at TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_actions_closed_updated ON clinical_actions(updated_at) WHERE status IN ('completed', 'cancelled')",
+        "CREATE INDEX IF NOT EXISTS idx_visits_date ON clinical_visits(date)",
+        "CREATE INDEX IF NOT EXISTS idx_actions_visit ON clinical_actions(visit_id)",
+    ]),
+    (10, "Transfer bundle imports", [
+        # One row per applied transfer bundle, so the same bundle is never applied twice
+        """CREATE TABLE IF NOT EXISTS transfer_imports (
+            bundle_id TEXT PRIMARY KEY,
+            patient_id INTEGER NOT NULL,
+            organization_id INTEGER NOT NULL,
+            imported_at TEXT NOT NULL
+        )""",
+    ]),
+    (11, "Per-table change log index", [
+        # Sync and ETag reads filtered to some tables probe each table's newest entries
+        # instead of walking every newer entry of the others
+        "CREATE INDEX IF NOT EXISTS idx_change_log_table ON change_log(table_name, seq)",
+    ]),
+]
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Applies all pending migrations and returns the resulting schema version."""
+    current = get_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA does not accept bound parameters; version is always an int from MIGRATIONS
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied mediconnect migration {version}: {description}")
+        current = version
+    return current
+
+if __name__ == "__main__":
+    from app.mediconnect import database as mediconnect_db
+
+    mediconnect_db.init_db()
+    if "--backfill-care-team" in sys.argv:
+        print(f"Assigned a care team to {mediconnect_db.backfill_care_team()} patients.")
+    else:
+        conn = sqlite3.connect(mediconnect_db.DATABASE_URL)
+        print(f"mediconnect.db is at schema version {get_version(conn)}.")
+        conn.close()
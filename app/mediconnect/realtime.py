@@ -0,0 +1,256 @@
+"""
+WebSocket fan-out for MediConnect events.
+
+Each connection gets a bounded send queue drained by its own writer task, so
+a broadcast only serializes the event once and enqueues it; it never waits
+on a socket. A client whose queue fills up (it is not reading fast enough)
+or whose socket errors is dropped instead of stalling everyone else.
+
+Clients subscribe to topics, either with query parameters on connect
+
+    /ws?organizationId=1&role=nurse
+
+or at any time by sending {"type": "SUBSCRIBE", "topics": ["patient:42"]}
+(and UNSUBSCRIBE likewise). Topics are "org:<id>", "role:<role>",
+"patient:<id>" and "doctor:<id>". An event is delivered to every client
+subscribed to at least one of its topics. A client that never subscribes to
+anything receives every event, as /ws always did.
+
+The manager sends {"type": "PING"} every HEARTBEAT_INTERVAL seconds and
+closes connections it has not heard from (any message, e.g. a PONG) within
+IDLE_TIMEOUT seconds.
+
+Delta-sync sockets use watch() to sleep until a commit or a broadcast
+suggests there may be new rows in the change log.
+
+Broadcasts go through a pub/sub bus (see `events`) so that, with several
+worker processes, an event published in one reaches subscribers attached
+to any of them.
+"""
+import asyncio
+import json
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from app.mediconnect import database as mediconnect_db
+from app.mediconnect import events, serializers
+from app.mediconnect.database import DEPARTMENT_ACTION_TYPES
+
+SEND_QUEUE_SIZE = 256
+HEARTBEAT_INTERVAL = 20.0
+IDLE_TIMEOUT = 60.0
+
+# WebSocket close codes
+CLOSE_GOING_AWAY = 1001
+CLOSE_TRY_AGAIN_LATER = 1013
+
+_ACTION_DEPARTMENTS = {t: role for role, types in DEPARTMENT_ACTION_TYPES.items() for t in types}
+
+def topics(organization_id: Optional[int] = None, roles: Iterable[str] = (),
+           patient_id: Optional[int] = None, doctor_id: Optional[int] = None) -> List[str]:
+    """The topic names for the given scopes; None values are skipped."""
+    names = [f"role:{role}" for role in roles if role]
+    if organization_id is not None:
+        names.append(f"org:{organization_id}")
+    if patient_id is not None:
+        names.append(f"patient:{patient_id}")
+    if doctor_id is not None:
+        names.append(f"doctor:{doctor_id}")
+    return names
+
+def action_topics(action: Dict[str, Any]) -> List[str]:
+    """Topics for a serialized action: its organization, its patient and the department that works it."""
+    department = _ACTION_DEPARTMENTS.get(action.get("type"))
+    return topics(action.get("fromOrganizationId"), [department] if department else (), action.get("patientId"))
+
+class Subscriber:
+    __slots__ = ("websocket", "topics", "queue", "task", "last_seen")
+
+    def __init__(self, websocket: WebSocket, topics: Set[str], queue_size: int):
+        self.websocket = websocket
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.last_seen = asyncio.get_running_loop().time()
+
+class ConnectionManager:
+    def __init__(self, bus=None, queue_size: int = SEND_QUEUE_SIZE, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        self.bus = bus or events.LocalBus()
+        self._bus_started = False
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.subscribers: Dict[WebSocket, Subscriber] = {}
+        self.by_topic: Dict[str, Set[Subscriber]] = {}
+        self.firehose: Set[Subscriber] = set()
+        self.counters = {"broadcasts": 0, "delivered": 0, "droppedSlow": 0, "droppedDead": 0, "reapedIdle": 0}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchers: Set[asyncio.Event] = set()
+        self._watching_commits = False
+        self._ping = serializers.dumps({"type": "PING"}).decode("utf-8")
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.subscribers)
+
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = ()) -> Subscriber:
+        await websocket.accept()
+        await self._start_bus()
+        subscriber = Subscriber(websocket, set(), self.queue_size)
+        subscriber.task = asyncio.create_task(self._send_loop(subscriber))
+        self.subscribers[websocket] = subscriber
+        self.firehose.add(subscriber)
+        self.subscribe(websocket, topics)
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        return subscriber
+
+    def disconnect(self, websocket: WebSocket):
+        """Forgets a connection. Safe to call more than once."""
+        subscriber = self._forget(websocket)
+        if subscriber and subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        for topic in topics:
+            subscriber.topics.add(topic)
+            self.by_topic.setdefault(topic, set()).add(subscriber)
+        if subscriber.topics:
+            self.firehose.discard(subscriber)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        for topic in topics:
+            subscriber.topics.discard(topic)
+            self._unindex(subscriber, topic)
+        if not subscriber.topics:
+            self.firehose.add(subscriber)
+
+    async def receive(self, websocket: WebSocket, text: str):
+        """Handles one client frame: any frame counts as a heartbeat, and (UN)SUBSCRIBE change topics."""
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None:
+            return
+        subscriber.last_seen = asyncio.get_running_loop().time()
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(message, dict) or not isinstance(message.get("topics"), list):
+            return
+        names = [str(t) for t in message["topics"]]
+        if message.get("type") == "SUBSCRIBE":
+            self.subscribe(websocket, names)
+        elif message.get("type") == "UNSUBSCRIBE":
+            self.unsubscribe(websocket, names)
+
+    async def broadcast(self, message: dict, topics: Iterable[str] = ()):
+        """Publishes `message` to every client, in any worker, subscribed to any of `topics`."""
+        await self._start_bus()
+        self.counters["broadcasts"] += 1
+        self.bus.publish(serializers.dumps(message).decode("utf-8"), list(topics))
+
+    def deliver(self, text: str, topics: List[str]):
+        """Bus callback: queues an encoded event for this process's matching clients."""
+        self.notify_changed()
+        targets = set(self.firehose)
+        for topic in topics:
+            targets.update(self.by_topic.get(topic, ()))
+        for subscriber in targets:
+            self._enqueue(subscriber, text)
+
+    def watch(self) -> asyncio.Event:
+        """An event set whenever the data may have changed: a commit in this process or any broadcast."""
+        if not self._watching_commits:
+            self._watching_commits = True
+            loop = asyncio.get_running_loop()
+            mediconnect_db.get_writer().commit_listeners.append(lambda: loop.call_soon_threadsafe(self.notify_changed))
+        changed = asyncio.Event()
+        self._watchers.add(changed)
+        return changed
+
+    def unwatch(self, changed: asyncio.Event):
+        self._watchers.discard(changed)
+
+    def notify_changed(self):
+        for changed in self._watchers:
+            changed.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self.subscribers),
+            "topics": len(self.by_topic),
+            "queued": sum(s.queue.qsize() for s in self.subscribers.values()),
+            "syncWatchers": len(self._watchers),
+            **self.counters,
+            "bus": self.bus.snapshot(),
+        }
+
+    async def _start_bus(self):
+        if not self._bus_started:
+            self._bus_started = True
+            await self.bus.start(self.deliver)
+
+    def _enqueue(self, subscriber: Subscriber, text: str):
+        try:
+            subscriber.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.counters["droppedSlow"] += 1
+            self._drop(subscriber, CLOSE_TRY_AGAIN_LATER)
+
+    async def _send_loop(self, subscriber: Subscriber):
+        websocket = subscriber.websocket
+        while True:
+            text = await subscriber.queue.get()
+            try:
+                await websocket.send_text(text)
+            except Exception:
+                self.counters["droppedDead"] += 1
+                self._forget(websocket)
+                return
+            self.counters["delivered"] += 1
+
+    async def _heartbeat_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.subscribers:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = loop.time()
+            for subscriber in list(self.subscribers.values()):
+                if now - subscriber.last_seen > self.idle_timeout:
+                    self.counters["reapedIdle"] += 1
+                    self._drop(subscriber, CLOSE_GOING_AWAY)
+                else:
+                    self._enqueue(subscriber, self._ping)
+
+    def _drop(self, subscriber: Subscriber, code: int):
+        self.disconnect(subscriber.websocket)
+        asyncio.create_task(self._close(subscriber.websocket, code))
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _forget(self, websocket: WebSocket) -> Optional[Subscriber]:
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is not None:
+            self.firehose.discard(subscriber)
+            for topic in subscriber.topics:
+                self._unindex(subscriber, topic)
+        return subscriber
+
+    def _unindex(self, subscriber: Subscriber, topic: str):
+        members = self.by_topic.get(topic)
+        if members is not None:
+            members.discard(subscriber)
+            if not members:
+                del self.by_topic[topic]
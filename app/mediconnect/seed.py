@@ -73,7 +73,7 @@ def seed_database():
         {"unique_id": "PAT-2026-002", "name": "Emily Davis", "dob": "1992-11-20T00:00:00.000Z", "gender": "Female", "contact": "+1555987654", "blood_group": "A-"},
     ]
     for p in patients:
-        existing = mediconnect_db.search_patients(p["unique_id"])
+        existing = mediconnect_db.get_patient_by_unique_id(p["unique_id"])
         if not existing:
             print(f"Creating Patient: {p['name']}...")
             mediconnect_db.create_patient(p["unique_id"], p["name"], p["dob"], p["gender"], p["contact"], p["blood_group"])
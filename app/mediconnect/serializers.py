@@ -0,0 +1,132 @@
+"""
+Row serializers and the JSON response class for the MediConnect API.
+
+Every table's snake_case -> camelCase mapping is declared once here as a
+spec and compiled at import time into a plain function that builds the
+response dict in a single literal, instead of each route copying the row
+and popping keys one by one. JSON columns (visit vitals, action payloads)
+are handed to the encoder as-is when orjson supports raw fragments, and
+decoded with orjson otherwise.
+
+Routes return `JSONResponse(...)` directly. This skips FastAPI's
+jsonable_encoder pass, which walks every value of every row in Python.
+"""
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+if ORJSON_AVAILABLE:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+    # orjson >= 3.9 embeds already-encoded JSON verbatim
+    _fragment = getattr(orjson, "Fragment", orjson.loads)
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, option=_OPTIONS)
+else:
+    _fragment = json.loads
+
+    def dumps(content: Any) -> bytes:
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_column(value: Optional[str]) -> Any:
+    """A stored JSON column, ready to be encoded. Empty values pass through unchanged."""
+    return _fragment(value) if value and isinstance(value, str) else value
+
+class JSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+class Json(str):
+    """Marks a spec entry as a column that stores JSON text."""
+
+def _expression(spec) -> str:
+    if isinstance(spec, dict):
+        return "{" + ", ".join(f"{key!r}: {_expression(value)}" for key, value in spec.items()) + "}"
+    if isinstance(spec, Json):
+        return f"_json(row.get({str(spec)!r}))"
+    return f"row.get({spec!r})"
+
+def compile_mapper(name: str, spec: Dict[str, Any]) -> Callable[[Dict], Dict]:
+    """Builds `name(row)`, which returns `spec` with every column name replaced by that column's value.
+
+    Values in `spec` are source column names, `Json(column)` for JSON
+    columns, or nested specs.
+    """
+    source = f"def {name}(row):\n    return {_expression(spec)}\n"
+    namespace = {"_json": json_column}
+    exec(compile(source, f"<mapper {name}>", "exec"), namespace)
+    mapper = namespace[name]
+    mapper.spec = spec
+    return mapper
+
+def many(mapper: Callable[[Dict], Dict], rows: Iterable[Dict]) -> List[Dict]:
+    return list(map(mapper, rows))
+
+# --- Table specs ---
+PATIENT = {
+    "id": "id", "uniqueId": "unique_id", "name": "name", "dob": "dob",
+    "gender": "gender", "contact": "contact", "bloodGroup": "blood_group",
+}
+
+USER = {
+    "id": "id", "organizationId": "organization_id", "employeeId": "employee_id",
+    "name": "name", "role": "role",
+}
+
+VISIT = {
+    "id": "id", "patientId": "patient_id", "organizationId": "organization_id", "date": "date",
+    "vitals": Json("vitals"), "symptoms": "symptoms", "diagnosis": "diagnosis",
+    "priority": "priority", "attendedBy": "attended_by",
+}
+
+ACTION = {
+    "id": "id", "patientId": "patient_id", "visitId": "visit_id", "authorId": "author_id",
+    "fromOrganizationId": "from_organization_id", "type": "type", "status": "status",
+    "description": "description", "payload": Json("payload"), "createdAt": "created_at",
+    "updatedAt": "updated_at", "completedAt": "completed_at", "completedBy": "completed_by",
+    "completedByOrganizationId": "completed_by_organization_id", "notes": "notes",
+}
+
+# The timeline and queue views show a slimmer action card
+ACTION_CARD = {
+    "id": "id", "patientId": "patient_id", "type": "type", "status": "status",
+    "description": "description", "payload": Json("payload"), "createdAt": "created_at",
+    "updatedAt": "updated_at", "completedAt": "completed_at", "notes": "notes",
+}
+
+patient = compile_mapper("patient", PATIENT)
+user = compile_mapper("user", USER)
+visit = compile_mapper("visit", VISIT)
+action = compile_mapper("action", ACTION)
+timeline_visit = compile_mapper("timeline_visit", {"visit": VISIT, "orgName": "orgName", "staffName": "staffName"})
+timeline_action = compile_mapper("timeline_action", {**ACTION_CARD, "authorName": "authorName", "orgName": "orgName"})
+queue_action = compile_mapper("queue_action", {
+    **ACTION_CARD, "patientName": "patientName", "uniqueId": "uniqueId",
+    "authorName": "authorName", "orgName": "orgName",
+})
+emergency = compile_mapper("emergency", {
+    "visit": VISIT,
+    "patient": {"id": "patient_id", "name": "patient_name", "uniqueId": "unique_id"},
+    "attendedBy": "attended_by_name",
+})
+
+# Delta sync rows carry everything the list views need to merge them in place
+SYNC = {
+    "patients": patient,
+    "visits": compile_mapper("sync_visit", {
+        **VISIT, "patientName": "patient_name", "uniqueId": "unique_id", "orgName": "orgName", "staffName": "staffName",
+    }),
+    "actions": compile_mapper("sync_action", {
+        **ACTION, "patientName": "patientName", "uniqueId": "uniqueId", "authorName": "authorName", "orgName": "orgName",
+    }),
+    "messages": dict,
+}
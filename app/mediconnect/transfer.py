@@ -0,0 +1,170 @@
+"""
+Transfer bundles: a patient's full record, moved between MediConnect sites.
+
+GET /api/patients/{id}/export streams the bundle and
+POST /api/transfers/import applies it at the receiving hospital. A bundle
+is NDJSON, optionally gzipped, one record per line:
+
+    {"type": "bundle", "version": 1, "bundleId": ..., "exportedAt": ...}
+    {"type": "patient", "data": {...}}
+    {"type": "organization" | "user" | "visit" | "action" | "message", "data": {...}}
+    {"type": "followup_patient" | "checkin", "data": {...}}
+    {"type": "end", "counts": {"visit": 12, ...}}
+
+The trailer's counts let the importer reject a truncated bundle. Rows are
+read from the database a chunk at a time as the response is sent, so the
+export's memory stays flat. An import is checked whole and then applied in
+one transaction; its follow-up check-ins live in followup.db and are
+added right after.
+"""
+import asyncio
+import json
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterator
+
+from app.followup import database as followup_db
+from app.mediconnect import async_database as async_db
+from app.mediconnect import database as mediconnect_db
+from app.mediconnect import serializers
+
+BUNDLE_VERSION = 1
+FLUSH_BYTES = 64 * 1024  # response chunk size
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Fields the importer needs in each record type, none of which may be null
+REQUIRED_FIELDS = {
+    "patient": ("unique_id", "name", "dob", "gender"),
+    "organization": ("id", "code"),
+    "user": ("id", "organization_id", "employee_id"),
+    "visit": ("id", "organization_id", "date"),
+    "action": ("author_id", "from_organization_id", "type", "status", "description", "created_at", "updated_at"),
+    "message": ("doctor_id", "sender", "content", "created_at"),
+    "followup_patient": ("name", "phone_number"),
+    "checkin": ("date",),
+}
+# Fields the importer parses as ISO-8601 timestamps (the follow-up trajectory replay reads check-in dates)
+TIMESTAMP_FIELDS = {("checkin", "date")}
+
+
+def _records(patient_id: int) -> Iterator[Dict[str, Any]]:
+    counts = defaultdict(int)
+    yield {"type": "bundle", "version": BUNDLE_VERSION, "bundleId": uuid.uuid4().hex,
+           "exportedAt": datetime.utcnow().isoformat()}
+    contact = None
+    for kind, row in mediconnect_db.export_patient(patient_id):
+        if kind == "patient":
+            contact = row["contact"]
+        counts[kind] += 1
+        yield {"type": kind, "data": row}
+    if contact:
+        for kind, row in followup_db.iter_patient_record(contact):
+            counts[kind] += 1
+            yield {"type": kind, "data": row}
+    yield {"type": "end", "counts": counts}
+
+
+def export_bundle(patient_id: int, compress: bool = False) -> Iterator[bytes]:
+    """The patient's bundle as response body chunks of about FLUSH_BYTES."""
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+    for record in _records(patient_id):
+        line = serializers.dumps(record) + b"\n"
+        pending.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            chunk = b"".join(pending)
+            pending, size = [], 0
+            chunk = gzip.compress(chunk) if gzip else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(pending)
+    yield gzip.compress(chunk) + gzip.flush() if gzip else chunk
+
+
+def _checked(kind: str, n: int, data: Any) -> Dict[str, Any]:
+    """The `n`th record of type `kind`, if it has every field the importer needs; raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError(f"{kind} record {n} has no data object")
+    for field in REQUIRED_FIELDS.get(kind, ()):
+        value = data.get(field)
+        if value is None:
+            raise ValueError(f"{kind} record {n} is missing {field}")
+        if (kind, field) in TIMESTAMP_FIELDS:
+            try:
+                datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{kind} record {n} has an invalid {field}")
+    return data
+
+
+async def read_bundle(chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """Parses a (possibly gzipped) bundle into its header and records by type; raises ValueError if it is malformed."""
+    gunzip = None
+    pending = b""
+    header, trailer = None, None
+    records = defaultdict(list)
+
+    def parse(line: bytes):
+        nonlocal header, trailer
+        if not line.strip():
+            return
+        if trailer is not None:
+            raise ValueError("Records after the end of the bundle")
+        try:
+            record = json.loads(line)
+            kind = record["type"]
+        except (ValueError, TypeError, KeyError):
+            raise ValueError("Bundle is not valid NDJSON")
+        if header is None:
+            if kind != "bundle" or record.get("version") != BUNDLE_VERSION:
+                raise ValueError(f"Not a version {BUNDLE_VERSION} transfer bundle")
+            if not isinstance(record.get("bundleId"), str) or not record["bundleId"]:
+                raise ValueError("Bundle has no bundleId")
+            header = record
+        elif kind == "end":
+            trailer = record
+        else:
+            records[kind].append(_checked(kind, len(records[kind]) + 1, record.get("data")))
+
+    async for chunk in chunks:
+        if gunzip is None:
+            if not chunk:
+                continue
+            gunzip = zlib.decompressobj(31) if chunk.startswith(GZIP_MAGIC) else False
+        if gunzip:
+            try:
+                chunk = gunzip.decompress(chunk)
+            except zlib.error:
+                raise ValueError("Bundle is not valid gzip")
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            parse(line)
+    try:
+        parse(pending)
+    except ValueError:
+        raise ValueError("Bundle is truncated")
+
+    if trailer is None:
+        raise ValueError("Bundle is truncated")
+    if any(len(records.get(kind, [])) != count for kind, count in trailer.get("counts", {}).items()):
+        raise ValueError("Bundle is truncated")
+    if len(records.get("patient", [])) != 1:
+        raise ValueError("Bundle must contain exactly one patient")
+    return {"header": header, "records": records}
+
+
+async def import_bundle(org_id: int, author_id: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """Applies a bundle received by `org_id`. Raises ValueError if it is malformed, BundleAlreadyImported if already applied."""
+    bundle = await read_bundle(chunks)
+    records = bundle["records"]
+    result = await async_db.apply_transfer_bundle(bundle["header"]["bundleId"], org_id, author_id, records)
+    result["checkins"] = 0
+    if records.get("followup_patient"):
+        result["checkins"] = await asyncio.to_thread(
+            followup_db.import_patient_record, records["followup_patient"][0], records.get("checkin", []))
+    return result
@@ -0,0 +1,75 @@
+import { useEffect, useRef, useState } from "react";
+
+export type SyncTable = "patients" | "visits" | "actions" | "messages";
+
+export type SyncDelta = {
+    cursor: string;
+    changes: Partial<Record<SyncTable, any[]>>;
+    deleted: Partial<Record<SyncTable, number[]>>;
+    more: boolean;
+};
+
+type LiveSyncOptions = {
+    tables: SyncTable[];
+    patientId?: number;
+    enabled?: boolean;
+};
+
+const RECONNECT_DELAY_MS = 2000;
+
+/**
+ * Subscribes to /ws/sync and calls `onDelta` with the rows that changed, replacing
+ * interval polling. The server only sends a frame when something changed; after a
+ * dropped connection the hook reconnects from its last cursor, so nothing is missed.
+ *
+ * Returns `ready` once the starting cursor is known. Gate the initial queries on it
+ * (`enabled: ready`) so no change can slip in between the load and the cursor.
+ */
+export function useLiveSync({ tables, patientId, enabled = true }: LiveSyncOptions, onDelta: (delta: SyncDelta) => void) {
+    const onDeltaRef = useRef(onDelta);
+    onDeltaRef.current = onDelta;
+    const tableKey = tables.join(",");
+    const [ready, setReady] = useState(false);
+
+    useEffect(() => {
+        if (!enabled) return;
+        let socket: WebSocket | null = null;
+        let cursor: string | null = null;
+        let retry: ReturnType<typeof setTimeout> | undefined;
+        let stopped = false;
+
+        const open = () => {
+            const params = new URLSearchParams({ tables: tableKey });
+            if (patientId !== undefined) params.set("patientId", String(patientId));
+            if (cursor) params.set("since", cursor);
+            const protocol = window.location.protocol === "https:" ? "wss:" : "ws:";
+            socket = new WebSocket(`${protocol}//${window.location.host}/ws/sync?${params}`);
+            socket.onmessage = (event) => {
+                const delta: SyncDelta = JSON.parse(event.data);
+                const initial = cursor === null;
+                cursor = delta.cursor;
+                // The first frame of a fresh subscription only carries the starting cursor
+                if (initial) setReady(true);
+                else onDeltaRef.current(delta);
+            };
+            socket.onclose = () => {
+                // Without live updates the page should still load
+                if (cursor === null) setReady(true);
+                if (!stopped) retry = setTimeout(open, RECONNECT_DELAY_MS);
+            };
+        };
+        open();
+
+        return () => {
+            stopped = true;
+            clearTimeout(retry);
+            socket?.close();
+        };
+    }, [tableKey, patientId, enabled]);
+
+    return ready;
+}
+
+export function hasChanges(delta: SyncDelta, table: SyncTable, match: (row: any) => boolean = () => true) {
+    return (delta.changes[table] || []).some(match) || (delta.deleted[table] || []).length > 0;
+}
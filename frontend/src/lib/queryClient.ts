@@ -10,6 +10,39 @@ async function defaultQueryFn({ queryKey }: { queryKey: readonly unknown[] }) {
     return res.json();
 }
 
+// Paginated list endpoints send the cursor of the next page in this header, and omit it on the last page
+const NEXT_CURSOR_HEADER = "X-Next-Cursor";
+
+export type Page<T> = { rows: T[]; nextCursor: string | null };
+
+async function getPage<T>(url: string, cursor: string | null): Promise<Page<T>> {
+    const page = cursor ? `${url}${url.includes("?") ? "&" : "?"}cursor=${encodeURIComponent(cursor)}` : url;
+    const res = await fetch(page);
+    if (!res.ok) {
+        const body = await res.json().catch(() => ({ message: res.statusText }));
+        throw new Error(body.message || res.statusText);
+    }
+    return { rows: await res.json(), nextCursor: res.headers.get(NEXT_CURSOR_HEADER) };
+}
+
+/** Query function for paginated list endpoints: follows X-Next-Cursor and returns every page's rows. */
+export async function fetchAllPages<T = any>({ queryKey }: { queryKey: readonly unknown[] }): Promise<T[]> {
+    const url = queryKey[0] as string;
+    const rows: T[] = [];
+    let cursor: string | null = null;
+    do {
+        const page: Page<T> = await getPage<T>(url, cursor);
+        rows.push(...page.rows);
+        cursor = page.nextCursor;
+    } while (cursor);
+    return rows;
+}
+
+/** useInfiniteQuery function for paginated list endpoints: one page per call, the page param being its cursor. */
+export async function fetchPage<T = any>({ queryKey, pageParam }: { queryKey: readonly unknown[]; pageParam: unknown }): Promise<Page<T>> {
+    return getPage<T>(queryKey[0] as string, (pageParam as string | null) ?? null);
+}
+
 export const queryClient = new QueryClient({
     defaultOptions: {
         queries: {
@@ -11,7 +11,9 @@ import { Textarea } from "@/components/ui/textarea";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogDescription, DialogFooter } from "@/components/ui/dialog";
 import { apiRequest } from "@/lib/utils";
+import { fetchAllPages } from "@/lib/queryClient";
 import { useToast } from "@/hooks/use-toast";
+import { useLiveSync, hasChanges } from "@/hooks/use-live-sync";
 import { formatDistanceToNow } from "date-fns";
 import { Link } from "wouter";
 import {
@@ -37,6 +39,13 @@ type QueueItem = {
     orgName: string;
 };
 
+// Action types each department works; mirrors DEPARTMENT_ACTION_TYPES on the server
+const departmentActionTypes: Record<string, string[]> = {
+    pharmacy: ["prescription"],
+    diagnostic: ["lab_test", "radiology"],
+    nurse: ["observation", "procedure", "transfer"],
+};
+
 const roleTheme: Record<string, { title: string; icon: React.ReactNode; accent: string; bgAccent: string }> = {
     pharmacy: {
         title: "Pharmacy Queue",
@@ -82,11 +91,27 @@ export default function DepartmentDashboard() {
 
     const theme = roleTheme[role] || roleTheme.pharmacy;
 
-    const { data: queue = [], isLoading } = useQuery<QueueItem[]>({
-        queryKey: [`/api/departments/${role}/queue`],
-        refetchInterval: 3000,
+    // The queue is refetched only when the server pushes a change to one of this department's actions
+    const syncReady = useLiveSync({ tables: ["actions"] }, (delta) => {
+        if (hasChanges(delta, "actions", (a) => (departmentActionTypes[role] || []).includes(a.type))) {
+            queryClient.invalidateQueries({
+                predicate: (query) => String(query.queryKey[0]).startsWith(`/api/departments/${role}/queue`),
+            });
+        }
     });
 
+    // Open work and finished work load separately; finished work is only the most recent page
+    const { data: openItems = [], isLoading } = useQuery<QueueItem[]>({
+        queryKey: [`/api/departments/${role}/queue?status=pending,in_progress&limit=500`],
+        queryFn: fetchAllPages,
+        enabled: syncReady,
+    });
+    const { data: completedItems = [] } = useQuery<QueueItem[]>({
+        queryKey: [`/api/departments/${role}/queue?status=completed&limit=50`],
+        enabled: syncReady,
+    });
+    const queue = [...openItems, ...completedItems];
+
     // Patient search
     const [search, setSearch] = useState("");
     const [foundPatient, setFoundPatient] = useState<any>(null);
@@ -256,7 +281,9 @@ function QueueCard({ item, user, theme }: { item: QueueItem; user: any; theme: a
             return res.json();
         },
         onSuccess: () => {
-            queryClient.invalidateQueries({ queryKey: [`/api/departments/${role}/queue`] });
+            queryClient.invalidateQueries({
+                predicate: (query) => String(query.queryKey[0]).startsWith(`/api/departments/${role}/queue`),
+            });
             toast({ title: "Updated", description: "Task status updated." });
             setShowNotesDialog(false);
             setNotes("");
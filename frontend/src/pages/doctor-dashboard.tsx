@@ -1,12 +1,13 @@
 
 import { useState } from "react";
-import { useQuery, useMutation } from "@tanstack/react-query";
+import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
 import { useAuth } from "@/hooks/use-auth";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { useToast } from "@/hooks/use-toast";
+import { useLiveSync, hasChanges } from "@/hooks/use-live-sync";
 import { apiRequest } from "@/lib/utils";
 import { Link } from "wouter";
 import {
@@ -41,8 +42,9 @@ export default function DoctorDashboard() {
         enabled: false,
     });
 
-    const { data: allPatients = [] } = useQuery<Patient[]>({
-        queryKey: ["/api/patients"],
+    // Patients come newest first, so the first page is the recent list
+    const { data: recentPatients = [] } = useQuery<Patient[]>({
+        queryKey: ["/api/patients?limit=5"],
     });
 
     const handleSearch = () => {
@@ -53,8 +55,6 @@ export default function DoctorDashboard() {
         refetch();
     };
 
-    const recentPatients = allPatients.slice(0, 5);
-
     return (
         <div className="space-y-6 animate-slide-up">
             {/* Header */}
@@ -183,9 +183,17 @@ function PatientCard({ patient }: { patient: Patient }) {
 }
 
 function ActiveEmergencies() {
+    const queryClient = useQueryClient();
+    const syncReady = useLiveSync({ tables: ["visits"] }, (delta) => {
+        // A visit matters if it is an emergency now or was one on screen (its priority may have dropped)
+        const shown = new Set((emergencies || []).map(({ visit }) => visit.id));
+        if (hasChanges(delta, "visits", (v) => ["emergency", "critical"].includes(v.priority) || shown.has(v.id))) {
+            queryClient.invalidateQueries({ queryKey: ["/api/visits/active-emergencies"] });
+        }
+    });
     const { data: emergencies } = useQuery<{ visit: any, patient: Patient, attendedBy: any }[]>({
         queryKey: ["/api/visits/active-emergencies"],
-        refetchInterval: 5000,
+        enabled: syncReady,
     });
 
     if (!emergencies || emergencies.length === 0) return null;
@@ -238,9 +246,26 @@ function ActiveEmergencies() {
 function PatientMessages() {
     const { user } = useAuth();
     const { toast } = useToast();
+    const queryClient = useQueryClient();
     const [selectedPatient, setSelectedPatient] = useState<any>(null);
     const [reply, setReply] = useState("");
 
+    const syncReady = useLiveSync({ tables: ["messages"], enabled: !!user?.id }, (delta) => {
+        if (hasChanges(delta, "messages", (m) => m.doctor_id === user?.id)) {
+            queryClient.invalidateQueries({ queryKey: ["/api/doctor/messages", user?.id] });
+        }
+        // Pushed rows are merged straight into the open thread
+        const threadId = selectedPatient?.patient_id;
+        const pushed = (delta.changes.messages || []).filter((m) => m.patient_id === threadId);
+        if (pushed.length) {
+            queryClient.setQueryData<any[]>(["/api/messages", threadId], (old = []) => {
+                const byId = new Map(old.map((m) => [m.id, m]));
+                pushed.forEach((m) => byId.set(m.id, m));
+                return Array.from(byId.values()).sort((a, b) => a.id - b.id);
+            });
+        }
+    });
+
     const { data: messages = [], refetch } = useQuery<any[]>({
         queryKey: ["/api/doctor/messages", user?.id],
         queryFn: async () => {
@@ -248,8 +273,7 @@ function PatientMessages() {
             const res = await apiRequest("GET", `/api/doctor/messages?doctorId=${user.id}`);
             return res.json();
         },
-        refetchInterval: 5000,
-        enabled: !!user?.id,
+        enabled: !!user?.id && syncReady,
     });
 
     const { data: history = [] } = useQuery<any[]>({
@@ -259,8 +283,7 @@ function PatientMessages() {
             const res = await apiRequest("GET", `/api/messages/${selectedPatient.patient_id}`);
             return res.json();
         },
-        enabled: !!selectedPatient,
-        refetchInterval: 3000,
+        enabled: !!selectedPatient && syncReady,
     });
 
     const markReadMutation = useMutation({
@@ -288,12 +311,12 @@ function PatientMessages() {
 
     const handleOpenThread = (msg: any) => {
         setSelectedPatient(msg);
-        if (msg.sender === 'patient' && !msg.is_read) {
+        if (msg.unread_count > 0) {
             markReadMutation.mutate(msg.patient_id);
         }
     };
 
-    const unreadCount = messages.filter((m: any) => m.sender === 'patient' && !m.is_read).length;
+    const unreadCount = messages.reduce((total: number, m: any) => total + m.unread_count, 0);
 
     return (
         <div className="space-y-3">
@@ -1,6 +1,6 @@
 import React, { useState } from "react";
 import { PrintPatientButton } from "@/components/print-patient-button";
-import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
+import { useQuery, useInfiniteQuery, useMutation, useQueryClient, type Query } from "@tanstack/react-query";
 import { useAuth } from "@/hooks/use-auth";
 import { useForm } from "react-hook-form";
 import { zodResolver } from "@hookform/resolvers/zod";
@@ -34,7 +34,9 @@ import {
   DialogFooter,
 } from "@/components/ui/dialog";
 import { useToast } from "@/hooks/use-toast";
+import { useLiveSync, hasChanges } from "@/hooks/use-live-sync";
 import { apiRequest } from "@/lib/utils";
+import { fetchAllPages, fetchPage } from "@/lib/queryClient";
 import { Link } from "wouter";
 import {
   UserPlus,
@@ -87,26 +89,49 @@ const vitalsSchema = z.object({
 
 const combinedSchema = patientSchema.merge(vitalsSchema);
 
+const PATIENT_PAGE_SIZE = 50;
+const NURSE_OPEN_QUEUE = "/api/departments/nurse/queue?status=pending,in_progress&limit=500";
+
+// The paged list and any search results both go stale when a patient is added or removed
+const isPatientListQuery = (query: Query) =>
+  String(query.queryKey[0]).startsWith("/api/patients?") ||
+  String(query.queryKey[0]).startsWith("/api/patients/search");
+
 export default function NurseDashboard() {
   const { user } = useAuth();
   const { toast } = useToast();
   const queryClient = useQueryClient();
 
-  const { data: patients = [], isLoading } = useQuery<Patient[]>({
-    queryKey: ["/api/patients"],
+  // Patients come newest first; older pages load on request instead of all at once
+  const {
+    data: patientPages,
+    isLoading: isListLoading,
+    hasNextPage,
+    fetchNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery({
+    queryKey: [`/api/patients?limit=${PATIENT_PAGE_SIZE}`],
+    queryFn: fetchPage<Patient>,
+    initialPageParam: null as string | null,
+    getNextPageParam: (last) => last.nextCursor,
   });
+  const patients = patientPages?.pages.flatMap((page) => page.rows) ?? [];
 
   const { data: stats } = useQuery<any>({
     queryKey: ["/api/stats"],
   });
 
   const [searchQuery, setSearchQuery] = useState("");
+  const search = searchQuery.trim();
 
-  const filteredPatients = patients.filter(
-    (p) =>
-      p.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-      p.uniqueId.toLowerCase().includes(searchQuery.toLowerCase()),
-  );
+  // A search asks the server, so it finds patients on pages not loaded yet
+  const { data: searchResults = [], isLoading: isSearchLoading } = useQuery<Patient[]>({
+    queryKey: [`/api/patients/search?query=${encodeURIComponent(search)}`],
+    enabled: search.length > 0,
+  });
+
+  const filteredPatients = search ? searchResults : patients;
+  const isLoading = search ? isSearchLoading : isListLoading;
 
   return (
     <div className="space-y-6 animate-slide-up">
@@ -153,7 +178,7 @@ export default function NurseDashboard() {
             <UserPlus className="w-4 h-4" /> New Check-In
           </TabsTrigger>
           <TabsTrigger value="patients" className="gap-2">
-            <Users className="w-4 h-4" /> Patients ({patients.length})
+            <Users className="w-4 h-4" /> Patients ({stats?.totalPatients ?? patients.length})
           </TabsTrigger>
           <TabsTrigger value="transfers" className="gap-2">
             <Truck className="w-4 h-4" /> Transfers
@@ -192,6 +217,19 @@ export default function NurseDashboard() {
               {filteredPatients.map((patient) => (
                 <PatientRow key={patient.id} patient={patient} />
               ))}
+              {!search && hasNextPage && (
+                <Button
+                  variant="outline"
+                  onClick={() => fetchNextPage()}
+                  disabled={isFetchingNextPage}
+                >
+                  {isFetchingNextPage ? (
+                    <Loader2 className="animate-spin w-4 h-4" />
+                  ) : (
+                    "Load more"
+                  )}
+                </Button>
+              )}
             </div>
           )}
         </TabsContent>
@@ -290,7 +328,7 @@ function CheckInForm() {
       return { patient, vitals };
     },
     onSuccess: ({ patient, vitals }) => {
-      queryClient.invalidateQueries({ queryKey: ["/api/patients"] });
+      queryClient.invalidateQueries({ predicate: isPatientListQuery });
       queryClient.invalidateQueries({ queryKey: ["/api/stats"] });
       setSuccessPatient(patient);
       setVitalsData(vitals);
@@ -598,7 +636,7 @@ function PatientRow({ patient }: { patient: Patient }) {
       await apiRequest("DELETE", `/api/patients/${patient.id}`);
     },
     onSuccess: () => {
-      queryClient.invalidateQueries({ queryKey: ["/api/patients"] });
+      queryClient.invalidateQueries({ predicate: isPatientListQuery });
       queryClient.invalidateQueries({ queryKey: ["/api/stats"] });
       toast({
         title: "Deleted",
@@ -803,9 +841,17 @@ function TransferQueue() {
   const queryClient = useQueryClient();
   const { toast } = useToast();
 
+  const syncReady = useLiveSync({ tables: ["actions"] }, (delta) => {
+    if (hasChanges(delta, "actions", (a) => a.type === "transfer")) {
+      queryClient.invalidateQueries({ queryKey: [NURSE_OPEN_QUEUE] });
+    }
+  });
+
+  // Only open transfers can be accepted, so finished ones are never fetched
   const { data: queue = [], isLoading } = useQuery<any[]>({
-    queryKey: [`/api/departments/nurse/queue`],
-    refetchInterval: 5000,
+    queryKey: [NURSE_OPEN_QUEUE],
+    queryFn: fetchAllPages,
+    enabled: syncReady,
   });
 
   // Filter for transfers only and where target is current org (incoming)
@@ -836,7 +882,7 @@ function TransferQueue() {
     },
     onSuccess: () => {
       queryClient.invalidateQueries({
-        queryKey: [`/api/departments/nurse/queue`],
+        queryKey: [NURSE_OPEN_QUEUE],
       });
       toast({
         title: "Transfer Accepted",
@@ -893,15 +939,24 @@ function TransferQueue() {
                 )}
               </div>
             </div>
-            <Button
-              className="bg-blue-600 hover:bg-blue-700"
-              onClick={() =>
-                updateMutation.mutate({ id: item.id, status: "completed" })
-              }
-              disabled={updateMutation.isPending}
-            >
-              Accept & Admit
-            </Button>
+            <div className="flex gap-2">
+              {item.payload?.exportUrl && (
+                <Button variant="outline" asChild>
+                  <a href={`${item.payload.exportUrl}?format=gzip`} download>
+                    Download Record
+                  </a>
+                </Button>
+              )}
+              <Button
+                className="bg-blue-600 hover:bg-blue-700"
+                onClick={() =>
+                  updateMutation.mutate({ id: item.id, status: "completed" })
+                }
+                disabled={updateMutation.isPending}
+              >
+                Accept & Admit
+              </Button>
+            </div>
           </CardContent>
         </Card>
       ))}
@@ -11,6 +11,7 @@ import { Textarea } from "@/components/ui/textarea";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "@/components/ui/select";
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogDescription, DialogFooter } from "@/components/ui/dialog";
 import { useToast } from "@/hooks/use-toast";
+import { useLiveSync } from "@/hooks/use-live-sync";
 import { apiRequest } from "@/lib/utils";
 import { Link } from "wouter";
 import { formatDistanceToNow } from "date-fns";
@@ -74,9 +75,14 @@ export default function PatientDetails({ id }: { id: string }) {
         queryKey: [`/api/patients/${patientId}`],
     });
 
+    // Only this patient's visits and actions are pushed, so any delta means the timeline changed
+    const syncReady = useLiveSync({ tables: ["visits", "actions"], patientId }, () => {
+        queryClient.invalidateQueries({ queryKey: [`/api/patients/${patientId}/details`] });
+    });
+
     const { data: details, isLoading: isLoadingDetails } = useQuery<{ visits: any[]; actions: TimelineAction[] }>({
         queryKey: [`/api/patients/${patientId}/details`],
-        refetchInterval: 5000,
+        enabled: syncReady,
     });
 
     const [showDiagnosisDialog, setShowDiagnosisDialog] = useState(false);
@@ -253,7 +253,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const messageHistoryContainer = document.getElementById('messageHistory');
     const messageInput = document.getElementById('messageInput');
     const sendMessageBtn = document.getElementById('sendMessageBtn');
-    let messagePollingInterval = null;
+    let messageSync = null;
 
     if (refreshFollowupBtn) refreshFollowupBtn.addEventListener('click', fetchFollowupDashboard);
     if (triggerDemoCheckinBtn) triggerDemoCheckinBtn.addEventListener('click', async () => {
@@ -465,6 +465,38 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Live message updates: /ws/sync pushes a frame only when this patient's messages change
+    function startMessageSync() {
+        stopMessageSync();
+        const sync = { socket: null, cursor: null, retry: null, stopped: false };
+        const open = () => {
+            const params = new URLSearchParams({ tables: 'messages', patientId: currentUserNumericId });
+            if (sync.cursor) params.set('since', sync.cursor);
+            const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+            sync.socket = new WebSocket(`${protocol}//${window.location.host}/ws/sync?${params}`);
+            sync.socket.onmessage = (event) => {
+                const delta = JSON.parse(event.data);
+                const initial = sync.cursor === null;
+                sync.cursor = delta.cursor;
+                // The first frame fixes the starting point, so load the thread after it
+                if (initial || (delta.changes.messages || []).length) loadMessages();
+            };
+            sync.socket.onclose = () => {
+                if (!sync.stopped) sync.retry = setTimeout(open, 2000);
+            };
+        };
+        open();
+        messageSync = sync;
+    }
+
+    function stopMessageSync() {
+        if (!messageSync) return;
+        messageSync.stopped = true;
+        clearTimeout(messageSync.retry);
+        if (messageSync.socket) messageSync.socket.close();
+        messageSync = null;
+    }
+
     async function sendMessage() {
         const text = messageInput.value.trim();
         if (!text || !currentUserNumericId) return;
@@ -503,10 +535,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
             }
             messageModal.classList.remove('hidden');
-            await loadMessages();
-            // Start polling for new messages when modal is open
-            if (messagePollingInterval) clearInterval(messagePollingInterval);
-            messagePollingInterval = setInterval(loadMessages, 3000);
+            // Loads the thread, then keeps it current while the modal is open
+            startMessageSync();
 
             // Mark as read
             fetch(`/api/messages/read?patientId=${currentUserNumericId}&doctorId=0&reader=patient`, { method: 'POST' }).catch(console.error);
@@ -516,7 +546,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (closeMessageModal) {
         closeMessageModal.addEventListener('click', () => {
             messageModal.classList.add('hidden');
-            if (messagePollingInterval) clearInterval(messagePollingInterval);
+            stopMessageSync();
         });
     }
 
@@ -526,28 +556,58 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // --- History Logic ---
-    async function fetchHistory() {
-        historyList.innerHTML = '<p class="text-muted">Loading history...</p>';
+    let historyContinuation = null;
+
+    async function fetchHistory(more = false) {
+        if (!more) historyList.innerHTML = '<p class="text-muted">Loading history...</p>';
         try {
             const headers = authToken ? { 'Authorization': `Bearer ${authToken}` } : {};
-            const response = await fetch('/api/history', { headers });
+            const params = new URLSearchParams({ limit: 20 });
+            if (more && historyContinuation) params.set('continuation', historyContinuation);
+            const response = await fetch(`/api/history?${params}`, { headers });
             const data = await response.json();
-            renderHistory(data);
+            historyContinuation = data.continuation;
+            renderHistory(data.items, more);
         } catch (error) {
             console.error('History Error:', error);
             historyList.innerHTML = '<p class="text-danger">Failed to load history.</p>';
         }
     }
 
-    function renderHistory(history) {
-        historyList.innerHTML = '';
-        if (history.length === 0) {
+    async function openHistoryItem(item) {
+        // Pages list a summary of each entry; signed-in users fetch the full record when opening one
+        if (item.ai_report === undefined && item.translated_text === undefined) {
+            const response = await fetch(`/api/history/${item.type}/${encodeURIComponent(item.id)}`, {
+                headers: { 'Authorization': `Bearer ${authToken}` }
+            });
+            if (!response.ok) {
+                alert('Failed to load this entry.');
+                return;
+            }
+            item = await response.json();
+        }
+        showSection('none'); // Hide others
+        resultsSection.classList.remove('hidden');
+
+        if (item.type === 'prescription') {
+            renderPrescriptionResults(item);
+        } else {
+            renderAnalyzeResults(item);
+        }
+    }
+
+    function renderHistory(history, more = false) {
+        const loadMore = document.getElementById('historyLoadMore');
+        if (loadMore) loadMore.remove();
+        if (!more) historyList.innerHTML = '';
+        if (!more && history.length === 0) {
             historyList.innerHTML = '<p class="text-muted">No analysis history found.</p>';
             return;
         }
 
         history.forEach(item => {
             const date = new Date(item.timestamp).toLocaleString();
+            const flagCount = item.flag_count ?? (item.flags ? item.flags.length : 0);
             const el = document.createElement('div');
             el.className = 'history-item';
             el.style = 'padding: 1rem; border-bottom: 1px solid var(--border-color); cursor: pointer; display: flex; justify-content: space-between; align-items: center;';
@@ -558,21 +618,22 @@ document.addEventListener('DOMContentLoaded', () => {
                 </div>
                 ${item.type === 'prescription' ?
                     `<div class="badge" style="background: var(--bg-color); padding: 0.25rem 0.75rem; border-radius: 1rem; font-size: 0.75rem;">${item.language}</div>` :
-                    `<div class="badge" style="background: var(--bg-color); padding: 0.25rem 0.75rem; border-radius: 1rem; font-size: 0.75rem;">${item.flags ? item.flags.length : 0} Flags</div>`
+                    `<div class="badge" style="background: var(--bg-color); padding: 0.25rem 0.75rem; border-radius: 1rem; font-size: 0.75rem;">${flagCount} Flags</div>`
                 }
             `;
-            el.onclick = () => {
-                showSection('none'); // Hide others
-                resultsSection.classList.remove('hidden');
-
-                if (item.type === 'prescription') {
-                    renderPrescriptionResults(item);
-                } else {
-                    renderAnalyzeResults(item);
-                }
-            };
+            el.onclick = () => openHistoryItem(item);
             historyList.appendChild(el);
         });
+
+        if (historyContinuation) {
+            const button = document.createElement('button');
+            button.id = 'historyLoadMore';
+            button.className = 'btn btn-outline';
+            button.style = 'margin: 1rem auto; display: block;';
+            button.textContent = 'Load more';
+            button.onclick = () => fetchHistory(true);
+            historyList.appendChild(button);
+        }
     }
 
     // --- Settings Logic ---
@@ -753,15 +814,51 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Wow Factor 1: Trends Fetching ---
+    // Points per analyte the server downsamples each series to
+    const TREND_POINTS = 200;
+    // Series already loaded, and the newest date in them; later loads only ask for what is newer
+    let trendData = null;
+    let trendsSince = null;
+    let trendsUser = null;
+
     async function fetchTrends() {
         const chartsContainer = document.getElementById('chartsContainer');
         chartsContainer.innerHTML = '<p class="text-muted">Loading trends...</p>';
         try {
             const headers = authToken ? { 'Authorization': `Bearer ${authToken}` } : {};
-            const response = await fetch('/api/trends', { headers });
+            if (trendsUser !== authToken) {
+                trendData = null;
+                trendsSince = null;
+                trendsUser = authToken;
+            }
+            const params = new URLSearchParams({ points: TREND_POINTS });
+            if (trendData && trendsSince) params.set('since', trendsSince);
+            const response = await fetch(`/api/trends?${params}`, { headers });
 
             if (!response.ok) throw new Error("Failed to load trends");
-            const data = await response.json();
+            const fresh = await response.json();
+            trendData = trendData || {};
+            let overflow = false;
+            for (const [metric, info] of Object.entries(fresh)) {
+                const known = trendData[metric];
+                if (known && params.has('since')) {
+                    known.dates.push(...info.dates);
+                    known.values.push(...info.values);
+                    known.unit = info.unit;
+                    if (known.values.length > TREND_POINTS) overflow = true;
+                } else {
+                    trendData[metric] = info;
+                }
+                const last = info.dates[info.dates.length - 1];
+                if (last && (!trendsSince || last > trendsSince)) trendsSince = last;
+            }
+            if (overflow) {
+                // Appended points are not resampled: past the budget, reload the downsampled series whole
+                trendData = null;
+                trendsSince = null;
+                return fetchTrends();
+            }
+            const data = trendData;
 
             chartsContainer.innerHTML = '';
 
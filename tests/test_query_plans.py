@@ -0,0 +1,109 @@
+"""
+EXPLAIN QUERY PLAN regression check for the hot MediConnect read paths.
+
+Each entry of HOT_QUERIES calls the real query function against a fresh
+database built by init_db(), so the checked SQL can never drift from what
+the app runs. Every SELECT it issues must search an index rather than scan
+a table, in mediconnect.db, the archive, or behind a view. Scans of
+CTEs/subqueries (already bounded by a LIMIT), of partial indexes (bounded
+by their predicate) and of FTS virtual tables are allowed.
+"""
+import re
+import sqlite3
+
+import pytest
+
+from app.mediconnect import database as mediconnect_db
+
+HOT_QUERIES = [
+    ("get_department_queue", lambda db: db.get_department_queue(["pharmacy", "diagnostic", "nurse"])),
+    ("get_department_queue(active)", lambda db: db.get_department_queue(["nurse"], ["pending", "in_progress"])),
+    ("get_department_queue(page 2)", lambda db: db.get_department_queue(["diagnostic"], ["completed"], 50, db.encode_cursor("2024-01-01", 1))),
+    ("get_patient_details", lambda db: db.get_patient_details(1)),
+    ("get_active_emergencies", lambda db: db.get_active_emergencies()),
+    ("get_active_emergencies(page 2)", lambda db: db.get_active_emergencies(["critical"], 50, db.encode_cursor("2024-01-01", 1))),
+    ("get_all_patients(page 2)", lambda db: db.get_all_patients(50, db.encode_cursor(100))),
+    ("search_patients", lambda db: db.search_patients("Smith")),
+    ("get_messages_by_patient", lambda db: db.get_messages_by_patient(1)),
+    ("get_messages_for_doctor", lambda db: db.get_messages_for_doctor(1)),
+    ("get_changes", lambda db: db.get_changes(db.encode_cursor(0), limit=50)),
+    ("get_changes(actions)", lambda db: db.get_changes(db.encode_cursor(0), ["actions"], limit=50)),
+    ("get_changes(patient)", lambda db: db.get_changes(db.encode_cursor(0), ["visits", "actions"], 1)),
+    ("get_version", lambda db: db.get_version(["actions", "patients"])),
+    ("get_version(patient)", lambda db: db.get_version(["visits", "actions"], 1)),
+]
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """A schema-only mediconnect.db (and archive) built by init_db() in a temporary directory."""
+    path = str(tmp_path_factory.mktemp("mediconnect") / "mediconnect.db")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(mediconnect_db, "DATABASE_URL", path)
+        mediconnect_db.init_db()
+        yield path
+
+
+SCHEMAS = ("main", "archive", "temp")
+
+
+def _sources(sql):
+    """Maps each FROM/JOIN alias to what it names, so "SCAN a" over a CTE is told apart from a table scan."""
+    sources = {}
+    for source, alias in re.findall(r"(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        sources[source] = source
+        if alias and alias.upper() not in ("WHERE", "ON", "LEFT", "JOIN", "ORDER", "GROUP", "LIMIT", "UNION"):
+            sources[alias] = source
+    return sources
+
+
+def _with_views(sources, views):
+    """Adds the aliases used inside any view `sources` names, since the plan shows those views' scans too."""
+    pending = [name for name in sources.values() if name in views]
+    while pending:
+        for alias, source in _sources(views.pop(pending.pop(), "")).items():
+            sources.setdefault(alias, source)
+            if source in views:
+                pending.append(source)
+    return sources
+
+
+@pytest.mark.parametrize("name,run", HOT_QUERIES, ids=[name for name, _ in HOT_QUERIES])
+def test_hot_query_is_index_backed(database, monkeypatch, name, run):
+    statements = []
+
+    def traced_get_db():
+        conn = sqlite3.connect(database)
+        mediconnect_db.attach_archive(conn, database)
+        conn.row_factory = mediconnect_db.dict_factory
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(mediconnect_db, "DATABASE_URL", database)
+    monkeypatch.setattr(mediconnect_db, "get_db", traced_get_db)
+    run(mediconnect_db)
+
+    conn = sqlite3.connect(database)
+    mediconnect_db.attach_archive(conn, database)
+    try:
+        schema = [row for name in SCHEMAS for row in conn.execute(f"SELECT type, name, sql FROM {name}.sqlite_master")]
+        # FTS shadow tables are read by SQLite itself, keyed by the virtual table's own lookups
+        fts = tuple(f"{name}_" for kind, name, sql in schema if kind == "table" and "VIRTUAL TABLE" in (sql or ""))
+        tables = {name for kind, name, sql in schema if kind == "table" and not (fts and name.startswith(fts))}
+        views = {name: sql for kind, name, sql in schema if kind == "view"}
+        partial_indexes = {name for kind, name, sql in schema if kind == "index" and " WHERE " in (sql or "")}
+        failures = []
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                continue
+            sources = _with_views(_sources(sql), dict(views))
+            for step in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                scan = re.match(r"SCAN (?:\w+\.)?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?", step[3])
+                if (not scan or sources.get(scan.group(1), scan.group(1)) not in tables
+                        or scan.group(2) in partial_indexes or "VIRTUAL TABLE" in step[3]):
+                    continue
+                failures.append(f"{step[3]}\n    {' '.join(sql.split())}")
+    finally:
+        conn.close()
+    assert statements, f"{name} issued no SQL"
+    assert not failures, "full table scans:\n" + "\n".join(failures)